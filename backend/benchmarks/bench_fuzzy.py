@@ -0,0 +1,61 @@
+"""
+Trigram index build time, memory footprint and query latency.
+
+Rows are generated in memory, so this measures the index itself rather
+than the database read that feeds it.
+
+    python benchmarks/bench_fuzzy.py --sizes 100000 1000000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from common import measure, random_author, random_title
+
+from books.fuzzy import TrigramIndex
+
+# Misspellings of the synthetic vocabulary in common.py
+QUERIES = ['shadw', 'murakamy', 'tolstio', 'goldn rivr', 'ishigro kazu', 'kingdm of glas']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        rng = random.Random(size)
+        rows = [(i + 1, random_title(rng), random_author(rng), None) for i in range(size)]
+
+        index = TrigramIndex()
+        index.sync = lambda: None  # no database behind these rows
+        start = time.perf_counter()
+        index.load(rows)
+        build = time.perf_counter() - start
+
+        # Second build under tracemalloc, which is too slow to time
+        tracemalloc.start()
+        traced = TrigramIndex()
+        traced.load(rows)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del traced
+
+        print(f'{size} books: build {build:.2f}s, {memory / 2**20:.1f} MiB traced '
+              f'({index.memory_usage() / 2**20:.1f} MiB in postings)')
+        for query in QUERIES:
+            latency = measure(lambda: index.search(query), args.repeat)
+            hits = index.search(query, limit=3)
+            print(f'  {query:<16} {latency:8.2f} ms  top score {hits[0][1] if hits else 0:.2f}')
+
+        # Incremental maintenance: re-index 1000 edited books
+        start = time.perf_counter()
+        for book_id in range(1, 1001):
+            index._add(book_id, random_title(rng), random_author(rng))
+        print(f'  1000 incremental updates: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
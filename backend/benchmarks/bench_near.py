@@ -0,0 +1,63 @@
+"""
+"Books near me" latency with and without the grid-cell prefilter.
+
+The unfiltered column replaces the cell ranges with one range spanning the
+whole grid, so every located book has its distance computed.
+
+    python benchmarks/bench_near.py --books 100000 --users 5000
+"""
+import argparse
+import random
+
+from common import make_books, make_users, measure, test_database
+
+from rest_framework.test import APIClient
+
+from books import geo, views
+from books.models import UserProfile
+
+# Owners scattered over roughly Europe
+LAT_RANGE = (36.0, 64.0)
+LON_RANGE = (-10.0, 30.0)
+ORIGIN = '59.91,10.75'
+RADII = (5, 25, 100, 500)
+WHOLE_GRID = [(0, geo.CELL_COLUMNS * int(180 / geo.CELL_DEGREES))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        rng = random.Random(3)
+        owners = make_users(args.users)
+        profiles = []
+        for owner in owners:
+            lat, lon = rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+            profiles.append(UserProfile(
+                user=owner, location=f'{lat:.4f},{lon:.4f}',
+                latitude=lat, longitude=lon, geo_cell=geo.cell_for(lat, lon),
+            ))
+        UserProfile.objects.bulk_create(profiles, batch_size=1000)
+        make_books(args.books, owners)
+
+        client = APIClient()
+        print(f'{args.books} books, {args.users} owners')
+        print(f"{'radius km':>10} {'hits':>6} {'cells ms':>10} {'scan ms':>10}")
+        for radius in RADII:
+            params = {'near': ORIGIN, 'radius_km': radius, 'limit': 200}
+            hits = len(client.get('/api/books/search/', params).json())
+            indexed = measure(lambda: client.get('/api/books/search/', params).content, args.repeat)
+            ranges, views.cell_ranges = views.cell_ranges, lambda *args: WHOLE_GRID
+            try:
+                scan = measure(lambda: client.get('/api/books/search/', params).content, args.repeat)
+            finally:
+                views.cell_ranges = ranges
+            print(f'{radius:>10} {hits:>6} {indexed:>10.1f} {scan:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Overdue sweep throughput over a synthetic loan history.
+
+Most loans are long returned and a small share are out past their due
+date, which is the shape the (returned, due_date) index is for.
+
+    python benchmarks/bench_overdue.py --loans 1000000 --overdue 0.03
+"""
+import argparse
+import random
+import resource
+import time
+from datetime import timedelta
+
+from common import make_books, make_users, test_database
+
+from django.utils import timezone
+
+from books.models import Book, BookLoan, BookRequest, LoanReminder
+from books.overdue import BATCH_SIZE, sweep_overdue
+
+
+def make_loans(count, overdue, users, book_ids, seed=5, batch_size=20000):
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        requests = BookRequest.objects.bulk_create([
+            BookRequest(book_id=rng.choice(book_ids), requester=rng.choice(users),
+                        request_type='borrow', status='accepted')
+            for _ in range(size)
+        ])
+        loans = []
+        for book_request in requests:
+            roll = rng.random()
+            if roll < overdue:
+                # Out and late
+                due, returned = today - timedelta(days=rng.randint(1, 60)), False
+            elif roll < overdue * 2:
+                # Out and not yet due
+                due, returned = today + timedelta(days=rng.randint(0, 14)), False
+            else:
+                due, returned = today - timedelta(days=rng.randint(1, 1500)), True
+            loans.append(BookLoan(book_request=book_request, due_date=due, returned=returned))
+        BookLoan.objects.bulk_create(loans)
+        created += size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--loans', type=int, default=1000000)
+    parser.add_argument('--overdue', type=float, default=0.03, help='share of loans that are out and late')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    with test_database():
+        users = make_users(1000)
+        make_books(2000, users)
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        started = time.perf_counter()
+        make_loans(args.loans, args.overdue, users, book_ids)
+        print(f'{args.loans} loans inserted in {time.perf_counter() - started:.1f}s')
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for run in ('first', 'repeat'):
+            started = time.perf_counter()
+            flagged = sweep_overdue(batch_size=args.batch_size)
+            elapsed = time.perf_counter() - started
+            rate = flagged / elapsed if flagged else 0
+            print(f'{run:>6} sweep: {flagged} flagged in {elapsed:.2f}s ({rate:,.0f} rows/s)')
+        grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+        print(f'{LoanReminder.objects.count()} reminders queued, peak RSS grew {grown:.1f} MB during the sweeps')
+
+
+if __name__ == '__main__':
+    main()
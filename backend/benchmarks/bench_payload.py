@@ -0,0 +1,43 @@
+"""
+Payload size and response time of the book list in full and sparse modes.
+
+    python benchmarks/bench_payload.py --books 2000
+"""
+import argparse
+
+from common import make_books, make_users, measure, test_database
+
+from rest_framework.test import APIClient
+
+from books.models import Book
+
+MODES = [
+    ('full', {}),
+    ('card', {'fields': 'card'}),
+    ('omit text', {'omit': 'description,book_photos'}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        make_books(args.books, make_users(50))
+        # Realistic weight for the columns card views never show
+        photos = [f'https://images.example.com/books/{n}.jpg' for n in range(4)]
+        Book.objects.update(book_photos=photos)
+
+        client = APIClient()
+        print(f'{args.books} books')
+        print(f"{'mode':<10} {'bytes':>10} {'ms':>8}")
+        for name, params in MODES:
+            size = len(client.get('/api/books/', params).content)
+            latency = measure(lambda: client.get('/api/books/', params).content, args.repeat)
+            print(f'{name:<10} {size:>10} {latency:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare /api/books/search/ query latency: the original four-way icontains
+scan against the full-text index.
+
+    python benchmarks/bench_search.py --sizes 100000 1000000
+"""
+import argparse
+
+from common import make_books, make_users, measure, test_database
+
+from django.db.models import Q
+
+from books.models import Book
+from books.search import full_text_search
+
+QUERIES = ['shadow', 'golden river', 'murakami', 'sil', 'kalomi', 'kingdom glass']
+
+
+def legacy_search(query):
+    return Book.objects.filter(availability='available').filter(
+        Q(title__icontains=query) |
+        Q(author__icontains=query) |
+        Q(isbn__icontains=query) |
+        Q(description__icontains=query)
+    )
+
+
+def indexed_search(query):
+    return full_text_search(Book.objects.filter(availability='available'), query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # "all" materializes every matching id (what the unpaginated endpoint
+    # does); "p1" fetches only the first 20. Times are median ms.
+    print(f"{'books':>9} {'query':<18} {'legacy all':>10} {'fts all':>8} {'legacy p1':>10} {'fts p1':>8} {'rows':>7}")
+    with test_database():
+        owners = make_users(100)
+        loaded = 0
+        for size in sorted(args.sizes):
+            make_books(size - loaded, owners, seed=size)
+            loaded = size
+            for query in QUERIES:
+                rows = len(list(indexed_search(query).values_list('id', flat=True)))
+                timings = [
+                    measure(lambda: list(legacy_search(query).values_list('id', flat=True)), args.repeat),
+                    measure(lambda: list(indexed_search(query).values_list('id', flat=True)), args.repeat),
+                    measure(lambda: list(legacy_search(query).values_list('id', flat=True)[:20]), args.repeat),
+                    measure(lambda: list(indexed_search(query).values_list('id', flat=True)[:20]), args.repeat),
+                ]
+                print(f'{size:>9} {query:<18} ' + ' '.join(
+                    f'{t:>{w}.1f}' for t, w in zip(timings, (10, 8, 10, 8))
+                ) + f' {rows:>7}')
+
+
+if __name__ == '__main__':
+    main()
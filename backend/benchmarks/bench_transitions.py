@@ -0,0 +1,125 @@
+"""
+Concurrent request acceptance: throughput, conflict rate and correctness.
+
+Every book gets several pending requests; worker threads race to accept
+all of them (each one twice, like a double-click). Exactly one request per
+book may win. --naive replays the old read-check-then-save logic for
+comparison.
+
+    python benchmarks/bench_transitions.py --books 200 --requests 5 --threads 8
+"""
+import argparse
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+
+from common import make_books, make_users, test_database
+
+from django.db import IntegrityError, OperationalError, connection, connections
+from django.db.models import Count, Q
+
+from books import transitions
+from books.models import Book, BookLoan, BookRequest
+
+
+def naive_accept(book_request):
+    # The pre-transition view logic: check, then write, no transaction
+    book_request = BookRequest.objects.select_related('book').get(pk=book_request.pk)
+    if book_request.status != 'pending':
+        raise transitions.TransitionError('Request is no longer pending')
+    if book_request.book.availability != 'available':
+        raise transitions.TransitionError('Book is no longer available')
+    book_request.status = 'accepted'
+    book_request.book.availability = 'borrowed'
+    book_request.book.save()
+    book_request.save()
+    BookRequest.objects.filter(book=book_request.book, status='pending').exclude(
+        id=book_request.id
+    ).update(status='declined')
+    BookLoan.objects.create(book_request=book_request, due_date=time.strftime('%Y-%m-%d'))
+
+
+def worker(tasks, accept, stats, lock):
+    counts = {'accepted': 0, 'conflicts': 0, 'busy': 0, 'errors': 0}
+    try:
+        while True:
+            try:
+                book_request = tasks.get_nowait()
+            except queue.Empty:
+                break
+            while True:
+                try:
+                    accept(book_request)
+                    counts['accepted'] += 1
+                except transitions.TransitionError:
+                    counts['conflicts'] += 1
+                except IntegrityError:
+                    # Only the naive path gets here: a second loan for one request
+                    counts['errors'] += 1
+                except OperationalError:
+                    # SQLite "database is locked": back off and retry
+                    counts['busy'] += 1
+                    time.sleep(0.001)
+                    continue
+                break
+    finally:
+        connections.close_all()
+    with lock:
+        for key, value in counts.items():
+            stats[key] += value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5, help='pending requests per book')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--naive', action='store_true', help='use the old non-atomic logic')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, test_database(os.path.join(directory, 'bench.sqlite3')):
+        users = make_users(args.requests + 1)
+        make_books(args.books, users[:1])
+        Book.objects.update(availability='available')
+        BookRequest.objects.bulk_create([
+            BookRequest(book_id=book_id, requester=user, request_type='borrow')
+            for book_id in Book.objects.values_list('id', flat=True)
+            for user in users[1:]
+        ])
+        attempts = list(BookRequest.objects.all()) * 2
+        random.Random(5).shuffle(attempts)
+        tasks = queue.Queue()
+        for book_request in attempts:
+            tasks.put(book_request)
+
+        accept = naive_accept if args.naive else transitions.accept_request
+        stats = {'accepted': 0, 'conflicts': 0, 'busy': 0, 'errors': 0}
+        lock = threading.Lock()
+        threads = [threading.Thread(target=worker, args=(tasks, accept, stats, lock)) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        double_lent = Book.objects.annotate(
+            accepted=Count('requests', filter=Q(requests__status='accepted'))
+        ).filter(accepted__gt=1).count()
+        print(f'{connection.vendor}, {args.threads} threads, {args.books} books x {args.requests} requests, '
+              f'{len(attempts)} attempts{" (naive)" if args.naive else ""}')
+        print(f"accepted/sec     {stats['accepted'] / elapsed:10.1f}")
+        print(f"attempts/sec     {len(attempts) / elapsed:10.1f}")
+        print(f"conflict rate    {stats['conflicts'] / len(attempts):10.1%}")
+        print(f"busy retries     {stats['busy']:10d}")
+        print(f"errors           {stats['errors']:10d}")
+        print(f"accepted         {stats['accepted']:10d}  (expected {args.books})")
+        print(f"loans            {BookLoan.objects.count():10d}")
+        print(f"double-lent      {double_lent:10d}")
+
+
+if __name__ == '__main__':
+    main()
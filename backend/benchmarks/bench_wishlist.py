@@ -0,0 +1,57 @@
+"""
+Wishlist-with-availability latency and query count against wishlist size,
+and the time to rebuild the stored matches from scratch.
+
+    python benchmarks/bench_wishlist.py --books 20000 --sizes 10 50 200
+"""
+import argparse
+import random
+
+from common import make_books, make_users, measure, random_author, random_title, test_database
+
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from books.matching import rebuild_matches
+from books.models import Book, Wishlist
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        users = make_users(50)
+        make_books(args.books, users[1:])
+        reader = users[0]
+        titles = list(Book.objects.values_list('title', flat=True)[:max(args.sizes)])
+
+        client = APIClient()
+        client.force_authenticate(reader)
+        rng = random.Random(11)
+        print(f'{args.books} books')
+        print(f"{'items':>6} {'matches':>8} {'rebuild ms':>11} {'queries':>8} {'ms':>8}")
+        for size in args.sizes:
+            Wishlist.objects.filter(user=reader).delete()
+            # Half the items are on the shelf somewhere, half are not
+            Wishlist.objects.bulk_create([
+                Wishlist(user=reader, title=titles[i] if i % 2 else random_title(rng), author=random_author(rng))
+                for i in range(size)
+            ])
+            # bulk_create skips the signals that maintain matches
+            matches = rebuild_matches()
+            rebuild = measure(rebuild_matches, 1)
+            # DEBUG keeps a bounded query log; a full one hides new queries
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                client.get('/api/wishlist/with_availability/')
+            latency = measure(lambda: client.get('/api/wishlist/with_availability/').content, args.repeat)
+            print(f'{size:>6} {matches:>8} {rebuild:>11.1f} {len(captured):>8} {latency:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+
+Every benchmark runs against a throwaway test database (the same one
+``manage.py test`` would create), never against db.sqlite3.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from itertools import accumulate
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+# Set Django settings
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booklending.settings')
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from books.models import Book, Genre
+
+WORDS = (
+    'shadow river garden silent empire winter stone glass night ocean '
+    'crown forest letter secret summer mountain island kingdom fire city '
+    'song memory house storm golden broken last lost hidden wild light '
+    'dream journey bridge tower mirror road harbor wolf raven promise'
+).split()
+FIRST_NAMES = (
+    'Anna James Maria Ahmed Kenji Olga Pedro Grace Tomas Leila Victor '
+    'Nadia Samuel Ingrid Diego Yuki Fatima Arthur Chloe Ivan'
+).split()
+LAST_NAMES = (
+    'Tolstoy Austen Murakami Achebe Orwell Morrison Borges Woolf Garcia '
+    'Dickens Atwood Okafor Lindgren Calvino Pamuk Ishiguro Brontë Hughes'
+).split()
+SYLLABLES = 'ka lo mi ren dor va shi tel an bro quin sa tor el mun dra fi ve'.split()
+GENRES = ['Fiction', 'Mystery', 'Science Fiction', 'Fantasy', 'History',
+          'Biography', 'Romance', 'Poetry', 'Thriller', 'Philosophy']
+
+
+@contextmanager
+def test_database(name=None):
+    """``name`` puts an SQLite test database in a file rather than in memory,
+    which threads need to see each other's writes with proper locking."""
+    old_name = connection.settings_dict['NAME']
+    if name is not None and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def make_users(count, prefix='bench'):
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com') for i in range(count)],
+        batch_size=1000,
+    )
+    return list(User.objects.filter(username__startswith=prefix).order_by('id'))
+
+
+def vocabulary(size=20000, seed=7):
+    """Real words first, then pseudo-words, with Zipf-like weights."""
+    rng = random.Random(seed)
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words, list(accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+
+
+VOCABULARY, CUM_WEIGHTS = vocabulary()
+
+
+def random_words(rng, count):
+    return rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=count)
+
+
+def random_title(rng):
+    return ' '.join(word.capitalize() for word in random_words(rng, rng.randint(2, 4)))
+
+
+def random_author(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def random_isbn(rng):
+    body = f'978{rng.randrange(10**8, 10**9)}'
+    check = -sum((3 if i % 2 else 1) * int(digit) for i, digit in enumerate(body)) % 10
+    return f'{body}{check}'
+
+
+def make_books(count, owners, seed=42, batch_size=5000):
+    """Bulk insert ``count`` synthetic books spread across ``owners``."""
+    rng = random.Random(seed)
+    genres = {name: Genre.for_name(name) for name in GENRES}
+    created = 0
+    while created < count:
+        batch = []
+        for i in range(created, min(created + batch_size, count)):
+            genre = genres[rng.choice(GENRES)]
+            isbn = random_isbn(rng)
+            batch.append(Book(
+                owner=owners[i % len(owners)],
+                title=random_title(rng),
+                author=random_author(rng),
+                isbn=isbn,
+                isbn13=isbn,
+                genre=genre.name,
+                genre_ref=genre,
+                description=' '.join(random_words(rng, rng.randint(10, 40))),
+                condition=rng.choice(['new', 'like_new', 'good', 'fair', 'poor']),
+                lending_type=rng.choice(['lending', 'swapping', 'both']),
+                availability=rng.choices(['available', 'borrowed', 'unavailable'], [8, 1, 1])[0],
+            ))
+        Book.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def measure(fn, repeat=5):
+    """Run ``fn`` ``repeat`` times and return the median wall time in ms."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
@@ -87,6 +87,18 @@ DATABASES = {
 }
 
 
+# Cache
+# The catalog version counter and facet counts live here. Point this at a
+# shared cache (Redis/Memcached) when running more than one worker process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'booklending',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Book, BookRequest, BookLoan, UserProfile, Wishlist
+from .models import Book, BookRequest, BookLoan, Genre, UserProfile, Wishlist
 
 
 @admin.register(UserProfile)
@@ -9,11 +9,18 @@ class UserProfileAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
 
 
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ['name', 'key']
+    search_fields = ['name']
+    readonly_fields = ['key']
+
+
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     list_display = ['title', 'author', 'owner', 'condition', 'availability', 'lending_type', 'created_at']
-    list_filter = ['condition', 'availability', 'lending_type', 'genre']
-    search_fields = ['title', 'author', 'isbn', 'owner__username']
+    list_filter = ['condition', 'availability', 'lending_type', 'genre_ref']
+    search_fields = ['title', 'author', '=isbn13', 'owner__username']
     readonly_fields = ['created_at', 'updated_at']
     list_per_page = 25
 
@@ -0,0 +1,63 @@
+from django.db import connection, transaction
+
+from .models import ArchivedBookLoan, ArchivedBookRequest, BookLoan, BookRequest, LoanReminder
+
+# Moves finished history out of books_bookrequest and books_bookloan.
+#
+# A request is finished once it is completed, declined or cancelled and any
+# loan it opened has been returned; neither can change again. Each batch
+# copies the requests and their loans into the archive tables under their
+# original ids and deletes them from the hot tables in one transaction, so a
+# row is always in exactly one of the two. The deletes are plain DELETE
+# statements that skip model signals: the rows are moved, not removed, so the
+# book counters, totals and change log must not see them go.
+
+TERMINAL_STATUSES = ('completed', 'declined', 'cancelled')
+BATCH_SIZE = 1000
+
+
+def _columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _delete(model, column, ids):
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(column)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', list(ids))
+
+
+def _archive(ids):
+    with transaction.atomic():
+        ArchivedBookRequest.objects.bulk_create([
+            ArchivedBookRequest(**row)
+            for row in BookRequest.objects.filter(pk__in=ids).values(*_columns(BookRequest))
+        ])
+        loans = [
+            ArchivedBookLoan(**row)
+            for row in BookLoan.objects.filter(book_request_id__in=ids).values(*_columns(BookLoan))
+        ]
+        ArchivedBookLoan.objects.bulk_create(loans)
+        LoanReminder.objects.filter(loan__book_request_id__in=ids).delete()
+        _delete(BookLoan, 'book_request_id', ids)
+        _delete(BookRequest, 'id', ids)
+    return len(loans)
+
+
+def archive_history(before, batch_size=BATCH_SIZE):
+    """Archive requests finished before ``before`` (a datetime), in batches
+    of ``batch_size`` walked in primary key order. Returns the number of
+    (requests, loans) moved."""
+    candidates = BookRequest.objects.filter(status__in=TERMINAL_STATUSES, updated_at__lt=before).exclude(
+        bookloan__returned=False
+    ).order_by('pk').values_list('pk', flat=True)
+    requests = loans = 0
+    last = 0
+    while True:
+        ids = list(candidates.filter(pk__gt=last)[:batch_size])
+        if not ids:
+            return requests, loans
+        loans += _archive(ids)
+        requests += len(ids)
+        last = ids[-1]
@@ -0,0 +1,62 @@
+import time
+
+from django.core.cache import cache
+
+# Write-generation counter for the book catalog. Every Book write bumps it,
+# so anything cached under a key that includes the current version is
+# invalidated implicitly. It starts from a timestamp rather than 1 so an
+# evicted counter can never come back as a version that was already used.
+CATALOG_VERSION_KEY = 'books:catalog_version'
+CATALOG_MODIFIED_KEY = 'books:catalog_modified'
+# The default cache is per process (LocMemCache): a bump in one worker never
+# reaches the others. Versions therefore expire and come back as a fresh
+# timestamp, so no process serves an old version, or anything cached under
+# it, for longer than this. With a shared cache it only costs one extra
+# revalidation per period.
+VERSION_TIMEOUT = 60
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns() // 1000, timeout=VERSION_TIMEOUT)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def catalog_modified():
+    """When the catalog last changed, as a Unix timestamp (whole seconds)."""
+    modified = cache.get(CATALOG_MODIFIED_KEY)
+    if modified is None:
+        cache.add(CATALOG_MODIFIED_KEY, int(time.time()), timeout=VERSION_TIMEOUT)
+        modified = cache.get(CATALOG_MODIFIED_KEY)
+    return modified
+
+
+def bump_catalog_version():
+    cache.set(CATALOG_MODIFIED_KEY, int(time.time()), timeout=VERSION_TIMEOUT)
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns() // 1000, timeout=VERSION_TIMEOUT)
+        return cache.get(CATALOG_VERSION_KEY)
+
+
+# Per-user write generation, for data cached per user (the dashboard
+# summary). Writes that touch a user's books, requests or loans bump it.
+def user_version_key(user_id):
+    return f'books:user_version:{user_id}'
+
+
+def user_version(user_id):
+    version = cache.get(user_version_key(user_id))
+    if version is None:
+        cache.add(user_version_key(user_id), time.time_ns() // 1000, timeout=VERSION_TIMEOUT)
+        version = cache.get(user_version_key(user_id))
+    return version
+
+
+def bump_user_versions(user_ids):
+    # A fresh timestamp rather than incr: one round trip for any number of users
+    version = time.time_ns() // 1000
+    cache.set_many({user_version_key(user_id): version for user_id in set(user_ids)}, timeout=VERSION_TIMEOUT)
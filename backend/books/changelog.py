@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+
+from .models import ChangeLogEntry
+
+# Change feed behind /api/changes/.
+#
+# Every change to a book, request, loan or wishlist entry appends one entry
+# per reader: book changes are public (user NULL); request and loan changes
+# go to the requester and to the book's owner, and wishlist changes to the
+# entry's user. Entries are written in the transaction that makes the
+# change: by the model signals for saves and deletes, and explicitly where
+# books.transitions and books.overdue change rows with UPDATE or
+# bulk_create. ``data`` carries the state clients sync on (availability,
+# status, returned); anything else they re-fetch.
+
+PUBLIC = (None,)
+
+
+def entries(kind, object_id, action, audience=PUBLIC, **data):
+    return [
+        ChangeLogEntry(kind=kind, object_id=object_id, action=action, user_id=user_id, data=data)
+        for user_id in dict.fromkeys(audience)
+    ]
+
+
+def record(*batches):
+    ChangeLogEntry.objects.bulk_create([entry for batch in batches for entry in batch])
+
+
+def must_reset(since):
+    """Whether entries after ``since`` have been expired, so a reader at
+    ``since`` has to reload everything."""
+    return ChangeLogEntry.objects.filter(kind='log', id__gt=since).exists()
+
+
+def compact(before):
+    """Drop entries superseded by a newer entry for the same object and
+    reader, then expire everything older than ``before``.
+
+    Superseded entries carry nothing a client still needs: it ends up at the
+    latest state either way. Expired entries do, so the newest expired entry
+    is kept as a ``log``/``compacted`` marker and readers from before it are
+    told to reset. Returns (superseded, expired).
+    """
+    newer = ChangeLogEntry.objects.filter(kind=OuterRef('kind'), object_id=OuterRef('object_id'), id__gt=OuterRef('id'))
+    with transaction.atomic():
+        superseded = ChangeLogEntry.objects.filter(user__isnull=False).filter(
+            Exists(newer.filter(user=OuterRef('user')))
+        ).delete()[0]
+        superseded += ChangeLogEntry.objects.filter(user__isnull=True).filter(
+            Exists(newer.filter(user__isnull=True))
+        ).delete()[0]
+        through = ChangeLogEntry.objects.filter(created_at__lt=before).aggregate(through=Max('id'))['through']
+        if through is None:
+            return superseded, 0
+        expired = ChangeLogEntry.objects.filter(id__lt=through).delete()[0]
+        expired += ChangeLogEntry.objects.filter(pk=through).exclude(kind='log').update(
+            kind='log', object_id=0, action='compacted', user=None, data={}
+        )
+    return superseded, expired
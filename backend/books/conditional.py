@@ -0,0 +1,41 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.request import Request
+
+from .cache import catalog_modified, catalog_version
+
+
+def catalog_validators(request):
+    """ETag and Last-Modified for a catalog read, without touching the DB.
+
+    The ETag covers the catalog version, the user (own books are excluded
+    from some listings) and the full path (fields, cursor, ...).
+    """
+    user = request.user.pk if request.user.is_authenticated else 0
+    key = f'{catalog_version()}:{user}:{request.get_full_path()}'
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"', catalog_modified()
+
+
+def catalog_conditional(view):
+    """Answer conditional GETs on catalog endpoints with 304 Not Modified
+    while the catalog version is unchanged, before anything is serialized."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        request = next(arg for arg in args if isinstance(arg, Request))
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        etag, modified = catalog_validators(request)
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            response = view(*args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        # Clients may keep the body but must revalidate before reusing it
+        response['Cache-Control'] = 'no-cache'
+        return response
+    return wrapped
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .cache import bump_catalog_version
+from .models import ArchivedBookLoan, ArchivedBookRequest, Book, BookLoan, BookRequest
+
+# Popularity counters on Book.
+#
+# Each change is a single UPDATE ... SET x = x + n on the book row, so
+# concurrent writers never lose an increment and nothing is read first.
+# Loans and ratings are counted by books.transitions in the same UPDATE that
+# moves the book's availability. Book.save() never writes the counters, so
+# edits of a loaded book cannot undo them. Archived requests and loans still
+# count.
+# Paths that skip these hooks (bulk imports, cascading deletes of loans)
+# drift until reconcile_counters() runs.
+
+COUNTERS = ('request_count', 'loan_count', 'rating_sum', 'rating_count')
+
+
+def request_added(book_id):
+    Book.objects.filter(pk=book_id).update(request_count=F('request_count') + 1)
+
+
+def request_removed(book_id):
+    Book.objects.filter(pk=book_id).update(request_count=Greatest(F('request_count') - 1, 0))
+
+
+def _total(queryset, aggregate):
+    return Coalesce(
+        Subquery(queryset.order_by().values(group=Value(1)).annotate(total=aggregate).values('total')),
+        0,
+        output_field=IntegerField(),
+    )
+
+
+def _totals(hot, archived, aggregate):
+    return _total(hot, aggregate) + _total(archived, aggregate)
+
+
+def reconcile_counters():
+    """Recompute every book's counters from the request and loan tables in
+    one UPDATE, touching only rows that drifted. Returns how many did."""
+    requests = BookRequest.objects.filter(book=OuterRef('pk'))
+    archived_requests = ArchivedBookRequest.objects.filter(book=OuterRef('pk'))
+    loans = BookLoan.objects.filter(book_request__book=OuterRef('pk'))
+    archived_loans = ArchivedBookLoan.objects.filter(book_request__book=OuterRef('pk'))
+    rated, archived_rated = loans.filter(rating__isnull=False), archived_loans.filter(rating__isnull=False)
+    actual = {
+        'request_count': _totals(requests, archived_requests, Count('id')),
+        'loan_count': _totals(loans, archived_loans, Count('id')),
+        'rating_sum': _totals(rated, archived_rated, Sum('rating')),
+        'rating_count': _totals(rated, archived_rated, Count('id')),
+    }
+    drifted = Q()
+    for name in COUNTERS:
+        drifted |= ~Q(**{name: F(f'actual_{name}')})
+    with transaction.atomic():
+        fixed = Book.objects.alias(**{f'actual_{name}': value for name, value in actual.items()}).filter(
+            drifted
+        ).update(**actual)
+        if fixed:
+            # Ratings are part of the serialized book
+            transaction.on_commit(bump_catalog_version)
+    return fixed
@@ -0,0 +1,56 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .cache import bump_user_versions, user_version
+from .models import Book, BookLoan, BookRequest
+
+# Per-user counters for the dashboard: one conditional aggregate per table,
+# cached under the user's write generation. Every filter is rooted in an
+# indexed column of the table itself (owner, requester, or book_id /
+# book_request_id IN a subquery on those), so each query only reads the
+# user's own rows.
+
+SUMMARY_TIMEOUT = 60 * 60 * 24
+
+
+def touch_users(*user_ids):
+    """Invalidate the cached summaries of ``user_ids`` once the current
+    transaction commits."""
+    transaction.on_commit(lambda: bump_user_versions(user_ids))
+
+
+def compute_summary(user, today):
+    owned = Book.objects.filter(owner=user)
+    books = owned.aggregate(
+        owned=Count('id'),
+        available=Count('id', filter=Q(availability='available')),
+        borrowed=Count('id', filter=Q(availability='borrowed')),
+    )
+    requests = BookRequest.objects.filter(Q(requester=user) | Q(book__in=owned.values('id')))
+    pending = requests.filter(status__in=('pending', 'waitlisted')).aggregate(
+        pending_incoming=Count('id', filter=Q(status='pending') & ~Q(requester=user)),
+        pending_outgoing=Count('id', filter=Q(status='pending', requester=user)),
+        waitlisted=Count('id', filter=Q(status='waitlisted', requester=user)),
+    )
+    # An open loan always belongs to an accepted request
+    loans = BookLoan.objects.filter(
+        returned=False, book_request__in=requests.filter(status='accepted').values('id')
+    ).aggregate(
+        active_loans=Count('id', filter=Q(book_request__requester=user)),
+        overdue=Count('id', filter=Q(book_request__requester=user, due_date__lt=today)),
+        lent_out=Count('id', filter=~Q(book_request__requester=user)),
+    )
+    return {**books, **pending, **loans}
+
+
+def dashboard_summary(user):
+    # The date is part of the key: loans turn overdue without any write
+    today = timezone.localdate()
+    key = f'books:dashboard:{user.pk}:{user_version(user.pk)}:{today.isoformat()}'
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_summary(user, today)
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
@@ -0,0 +1,73 @@
+import heapq
+import math
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Book, FeaturedBook
+
+# Featured books, ranked ahead of time.
+#
+# rank_featured_books() streams the available books once, scores each from
+# its stored counters and writes the best FEATURED_POOL to FeaturedBook.
+# The endpoints read the first FEATURED_SIZE of those that are still
+# available, in rank order, so serving them is a join against a table of a
+# few dozen rows. Until the first ranking they fall back to the stored
+# request counts on book_avail_popular_idx.
+#
+# score = log(1 + requests)                              demand
+#       + RATING_WEIGHT * (bayesian rating - 1) / 4      quality, 0..1
+#       + RECENCY_WEIGHT * 0.5 ** (age / half-life)      freshness, 0..1
+#
+# The rating is pulled towards PRIOR_RATING by PRIOR_WEIGHT phantom votes,
+# so one five-star loan does not outrank a long run of fours.
+
+FEATURED_SIZE = 6
+FEATURED_POOL = 24
+RATING_WEIGHT = 2.0
+RECENCY_WEIGHT = 1.0
+RECENCY_HALF_LIFE_DAYS = 30
+PRIOR_RATING = 3.0
+PRIOR_WEIGHT = 2
+
+
+def score(request_count, rating_sum, rating_count, age_days):
+    rating = (rating_sum + PRIOR_RATING * PRIOR_WEIGHT) / (rating_count + PRIOR_WEIGHT)
+    return (
+        math.log1p(request_count)
+        + RATING_WEIGHT * (rating - 1) / 4
+        + RECENCY_WEIGHT * 0.5 ** (max(age_days, 0) / RECENCY_HALF_LIFE_DAYS)
+    )
+
+
+def rank_featured_books(now=None, size=FEATURED_POOL):
+    """Recompute the featured ranking. Returns how many books were ranked."""
+    now = now or timezone.now()
+    candidates = Book.objects.filter(availability='available').values_list(
+        'id', 'request_count', 'rating_sum', 'rating_count', 'created_at'
+    ).iterator(chunk_size=2000)
+    top = heapq.nlargest(size, (
+        (score(requests, rating_sum, rating_count, (now - created_at).total_seconds() / 86400), book_id)
+        for book_id, requests, rating_sum, rating_count, created_at in candidates
+    ))
+    with transaction.atomic():
+        previous = list(FeaturedBook.objects.values_list('book_id', flat=True))
+        FeaturedBook.objects.all().delete()
+        FeaturedBook.objects.bulk_create([
+            FeaturedBook(rank=rank, book_id=book_id, score=book_score, ranked_at=now)
+            for rank, (book_score, book_id) in enumerate(top, start=1)
+        ])
+        if previous != [book_id for _, book_id in top]:
+            # The featured endpoints answer conditional GETs by catalog version
+            transaction.on_commit(bump_catalog_version)
+    return len(top)
+
+
+def featured_books(queryset):
+    """The featured books among ``queryset``, best first."""
+    available = queryset.filter(availability='available')
+    featured = list(available.filter(featured__isnull=False).order_by('featured__rank')[:FEATURED_SIZE])
+    if featured:
+        return featured
+    return list(available.order_by('-request_count', '-created_at')[:FEATURED_SIZE])
@@ -0,0 +1,258 @@
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db.models import Case, IntegerField, When
+
+from .cache import catalog_version
+
+# In-process character-trigram index over Book.title and Book.author, for
+# typo-tolerant matching ("tolstio" -> "Tolstoy").
+#
+# Postings hold internal slot numbers rather than book ids. Re-indexing a
+# book gives it a new slot and retires the old one, so edits and deletes
+# never have to rewrite postings lists; dead slots are skipped at query
+# time and dropped by compact() once they pile up.
+#
+# Each worker process keeps its own copy. Writes made in this process are
+# applied immediately by signals; writes made elsewhere are picked up on
+# the next query through the catalog version and an updated_at watermark.
+# Deleted books can linger until the next compaction, so callers always
+# re-filter the returned ids against the database.
+
+FIELDS = ('title', 'author')
+DEFAULT_THRESHOLD = 0.45
+CONTAINMENT_WEIGHT = 0.7
+# Clock skew allowance when catching up on other processes' writes.
+SYNC_OVERLAP = timedelta(seconds=2)
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[\W_]+', ' ', text.casefold()).strip()
+
+
+def trigrams(text):
+    """pg_trgm-style trigrams: each word padded with two leading spaces and
+    one trailing space, so short words and word starts weigh more."""
+    grams = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._postings = {field: defaultdict(lambda: array('I')) for field in FIELDS}
+        self._sizes = {field: array('H') for field in FIELDS}
+        self._slot_book = array('Q')
+        self._book_slot = {}
+        self._dead = 0
+        self.synced_version = None
+        self.watermark = None
+
+    def __len__(self):
+        return len(self._book_slot)
+
+    def load(self, rows=None):
+        """(Re)build from ``(id, title, author, updated_at)`` rows, or from
+        the Book table when no rows are given."""
+        from .models import Book
+
+        with self._lock:
+            self._reset()
+            version = catalog_version()
+            if rows is None:
+                rows = Book.objects.values_list('id', 'title', 'author', 'updated_at').iterator(chunk_size=5000)
+            for book_id, title, author, updated_at in rows:
+                self._add(book_id, title, author)
+                self._advance(updated_at)
+            self.synced_version = version
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+        else:
+            self.sync()
+
+    def sync(self):
+        """Catch up with writes made by other processes since the last sync."""
+        from .models import Book
+
+        version = catalog_version()
+        if version == self.synced_version:
+            return
+        with self._lock:
+            changed = Book.objects.all()
+            if self.watermark is not None:
+                changed = changed.filter(updated_at__gte=self.watermark - SYNC_OVERLAP)
+            for book_id, title, author, updated_at in changed.values_list('id', 'title', 'author', 'updated_at'):
+                self._add(book_id, title, author)
+                self._advance(updated_at)
+            self.synced_version = version
+
+    def _advance(self, updated_at):
+        if updated_at is not None and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    def add(self, book):
+        with self._lock:
+            self._add(book.pk, book.title, book.author)
+            self._advance(book.updated_at)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._retire(book_id)
+            self._maybe_compact()
+
+    def _retire(self, book_id):
+        slot = self._book_slot.pop(book_id, None)
+        if slot is not None:
+            self._slot_book[slot] = 0
+            self._dead += 1
+
+    def _add(self, book_id, title, author):
+        self._retire(book_id)
+        slot = len(self._slot_book)
+        self._slot_book.append(book_id)
+        self._book_slot[book_id] = slot
+        for field, text in zip(FIELDS, (title, author)):
+            grams = trigrams(text)
+            self._sizes[field].append(min(len(grams), 0xFFFF))
+            postings = self._postings[field]
+            for gram in grams:
+                postings[gram].append(slot)
+
+    def _maybe_compact(self):
+        if self._dead > 1000 and self._dead * 4 > len(self._slot_book):
+            self.compact()
+
+    def compact(self):
+        """Rewrite postings without dead slots."""
+        with self._lock:
+            live = array('Q')
+            remap = {}
+            for slot, book_id in enumerate(self._slot_book):
+                if book_id:
+                    remap[slot] = len(live)
+                    live.append(book_id)
+            for field in FIELDS:
+                self._sizes[field] = array('H', (self._sizes[field][slot] for slot in remap))
+                postings = defaultdict(lambda: array('I'))
+                for gram, slots in self._postings[field].items():
+                    kept = array('I', (remap[slot] for slot in slots if slot in remap))
+                    if kept:
+                        postings[gram] = kept
+                self._postings[field] = postings
+            self._slot_book = live
+            self._book_slot = {book_id: slot for slot, book_id in enumerate(live)}
+            self._dead = 0
+
+    def search(self, text, fields=FIELDS, limit=50, threshold=DEFAULT_THRESHOLD):
+        """Return up to ``limit`` (or all) ``(book_id, similarity)`` pairs,
+        best first.
+
+        Similarity blends how much of the query the field covers with
+        trigram Jaccard, so "shadw" still finds "The Shadow of the Wind"
+        while exact-length matches rank first. The best of the requested
+        fields wins.
+        """
+        query = trigrams(text)
+        if not query:
+            return []
+        self.ensure_loaded()
+        best = {}
+        with self._lock:
+            for field in fields:
+                postings = self._postings[field]
+                overlap = Counter()
+                for gram in query:
+                    slots = postings.get(gram)
+                    if slots:
+                        overlap.update(slots)
+                sizes = self._sizes[field]
+                # Both terms are at most shared / |query|, so anything below
+                # threshold * |query| shared trigrams can be skipped cheaply.
+                floor = threshold * len(query)
+                for slot, shared in overlap.items():
+                    if shared < floor:
+                        continue
+                    book_id = self._slot_book[slot]
+                    if not book_id:
+                        continue
+                    score = (
+                        CONTAINMENT_WEIGHT * shared / len(query) +
+                        (1 - CONTAINMENT_WEIGHT) * shared / (len(query) + sizes[slot] - shared)
+                    )
+                    if score >= threshold and score > best.get(book_id, 0):
+                        best[book_id] = score
+        if limit is None:
+            return sorted(best.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(limit, best.items(), key=lambda item: item[1])
+
+    def memory_usage(self):
+        """Approximate bytes held by postings and slot tables."""
+        total = self._slot_book.itemsize * len(self._slot_book)
+        for field in FIELDS:
+            total += self._sizes[field].itemsize * len(self._sizes[field])
+            total += sum(slots.itemsize * len(slots) for slots in self._postings[field].values())
+        return total
+
+
+trigram_index = TrigramIndex()
+
+
+def similarity(text, other):
+    """The index's similarity score between two strings, 0..1."""
+    query, grams = trigrams(text), trigrams(other)
+    if not query or not grams:
+        return 0.0
+    shared = len(query & grams)
+    return (
+        CONTAINMENT_WEIGHT * shared / len(query) +
+        (1 - CONTAINMENT_WEIGHT) * shared / (len(query) + len(grams) - shared)
+    )
+
+
+def fuzzy_book_ids(text, fields=FIELDS, limit=50, threshold=DEFAULT_THRESHOLD):
+    """Ids of books whose title/author resemble ``text``, best first."""
+    return [book_id for book_id, _ in trigram_index.search(text, fields, limit, threshold)]
+
+
+# Candidates checked against the queryset per query
+FILTER_BATCH = 500
+
+
+def fuzzy_filter(queryset, text, fields=FIELDS, limit=50, threshold=DEFAULT_THRESHOLD):
+    """Restrict ``queryset`` to its ``limit`` closest fuzzy matches for
+    ``text``, most similar first.
+
+    The index knows nothing of the queryset's filters, so its candidates
+    are checked against them in batches, best first, until ``limit`` pass:
+    books the queryset excludes never take a place among the results.
+    """
+    candidates = fuzzy_book_ids(text, fields, None, threshold)
+    ids = []
+    for start in range(0, len(candidates), FILTER_BATCH):
+        batch = candidates[start:start + FILTER_BATCH]
+        passing = set(queryset.filter(id__in=batch).order_by().values_list('id', flat=True))
+        ids += [book_id for book_id in batch if book_id in passing]
+        if len(ids) >= limit:
+            break
+    ids = ids[:limit]
+    if not ids:
+        return queryset.none()
+    position = Case(*[When(id=book_id, then=rank) for rank, book_id in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(id__in=ids).order_by(position)
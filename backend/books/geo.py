@@ -0,0 +1,174 @@
+import math
+import re
+
+# Coordinates for profiles and "books near me" search, without a spatial
+# database extension.
+#
+# Profiles are geocoded from user-supplied lat/lon, a "lat,lon" location
+# string, or the small offline gazetteer below. Each geocoded profile is
+# filed under a fixed-size grid cell, numbered row by row; a radius query
+# turns into indexed ``geo_cell BETWEEN`` lookups, one per row of cells that
+# covers the circle, and exact distances are only computed for the books in
+# those cells.
+
+CELL_DEGREES = 0.25
+CELL_COLUMNS = int(360 / CELL_DEGREES)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+GAZETTEER = {
+    'amsterdam': (52.3676, 4.9041),
+    'athens': (37.9838, 23.7275),
+    'atlanta': (33.7490, -84.3880),
+    'auckland': (-36.8485, 174.7633),
+    'austin': (30.2672, -97.7431),
+    'bangalore': (12.9716, 77.5946),
+    'bangkok': (13.7563, 100.5018),
+    'barcelona': (41.3874, 2.1686),
+    'beijing': (39.9042, 116.4074),
+    'bergen': (60.3913, 5.3221),
+    'berlin': (52.5200, 13.4050),
+    'bogota': (4.7110, -74.0721),
+    'boston': (42.3601, -71.0589),
+    'brussels': (50.8503, 4.3517),
+    'budapest': (47.4979, 19.0402),
+    'buenos aires': (-34.6037, -58.3816),
+    'cairo': (30.0444, 31.2357),
+    'cape town': (-33.9249, 18.4241),
+    'chicago': (41.8781, -87.6298),
+    'copenhagen': (55.6761, 12.5683),
+    'dallas': (32.7767, -96.7970),
+    'delhi': (28.7041, 77.1025),
+    'denver': (39.7392, -104.9903),
+    'dhaka': (23.8103, 90.4125),
+    'dubai': (25.2048, 55.2708),
+    'dublin': (53.3498, -6.2603),
+    'edinburgh': (55.9533, -3.1883),
+    'frankfurt': (50.1109, 8.6821),
+    'geneva': (46.2044, 6.1432),
+    'hamburg': (53.5511, 9.9937),
+    'helsinki': (60.1699, 24.9384),
+    'hong kong': (22.3193, 114.1694),
+    'houston': (29.7604, -95.3698),
+    'istanbul': (41.0082, 28.9784),
+    'jakarta': (-6.2088, 106.8456),
+    'johannesburg': (-26.2041, 28.0473),
+    'karachi': (24.8607, 67.0011),
+    'kyiv': (50.4501, 30.5234),
+    'lagos': (6.5244, 3.3792),
+    'lima': (-12.0464, -77.0428),
+    'lisbon': (38.7223, -9.1393),
+    'london': (51.5072, -0.1276),
+    'los angeles': (34.0522, -118.2437),
+    'madrid': (40.4168, -3.7038),
+    'manchester': (53.4808, -2.2426),
+    'manila': (14.5995, 120.9842),
+    'melbourne': (-37.8136, 144.9631),
+    'mexico city': (19.4326, -99.1332),
+    'miami': (25.7617, -80.1918),
+    'milan': (45.4642, 9.1900),
+    'montreal': (45.5019, -73.5674),
+    'moscow': (55.7558, 37.6173),
+    'mumbai': (19.0760, 72.8777),
+    'munich': (48.1351, 11.5820),
+    'nairobi': (-1.2921, 36.8219),
+    'new york': (40.7128, -74.0060),
+    'osaka': (34.6937, 135.5023),
+    'oslo': (59.9139, 10.7522),
+    'paris': (48.8566, 2.3522),
+    'philadelphia': (39.9526, -75.1652),
+    'prague': (50.0755, 14.4378),
+    'rio de janeiro': (-22.9068, -43.1729),
+    'rome': (41.9028, 12.4964),
+    'san francisco': (37.7749, -122.4194),
+    'santiago': (-33.4489, -70.6693),
+    'sao paulo': (-23.5558, -46.6396),
+    'seattle': (47.6062, -122.3321),
+    'seoul': (37.5665, 126.9780),
+    'shanghai': (31.2304, 121.4737),
+    'singapore': (1.3521, 103.8198),
+    'stockholm': (59.3293, 18.0686),
+    'sydney': (-33.8688, 151.2093),
+    'taipei': (25.0330, 121.5654),
+    'tokyo': (35.6762, 139.6503),
+    'toronto': (43.6532, -79.3832),
+    'vancouver': (49.2827, -123.1207),
+    'vienna': (48.2082, 16.3738),
+    'warsaw': (52.2297, 21.0122),
+    'washington': (38.9072, -77.0369),
+    'zurich': (47.3769, 8.5417),
+}
+
+COORDINATES = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*[,;\s]\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def parse_coordinates(text):
+    """``"59.91, 10.75"`` -> ``(59.91, 10.75)``; None if not a valid pair."""
+    match = COORDINATES.match(text or '')
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None
+
+
+def geocode(location):
+    """Resolve a free-text location offline; None when it is unknown."""
+    coordinates = parse_coordinates(location)
+    if coordinates:
+        return coordinates
+    name = ' '.join((location or '').casefold().split())
+    if name in GAZETTEER:
+        return GAZETTEER[name]
+    # "Oslo, Norway" -> "oslo"
+    first = name.split(',')[0].strip()
+    return GAZETTEER.get(first)
+
+
+def cell_for(lat, lon):
+    row = min(int((lat + 90) / CELL_DEGREES), int(180 / CELL_DEGREES) - 1)
+    column = int((lon + 180) / CELL_DEGREES) % CELL_COLUMNS
+    return row * CELL_COLUMNS + column
+
+
+def cell_ranges(lat, lon, radius_km):
+    """Grid cells covering the circle, as inclusive ``(first, last)`` ranges
+    of cell numbers: one per row (two where the circle crosses the
+    antimeridian), so a few dozen at most whatever the radius."""
+    lat_span = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + lat_span, 89.9)))
+    lon_span = min(radius_km / (KM_PER_DEGREE * cos_lat), 180)
+
+    top = min(int((lat + lat_span + 90) / CELL_DEGREES), int(180 / CELL_DEGREES) - 1)
+    bottom = max(int((lat - lat_span + 90) / CELL_DEGREES), 0)
+    left = int((lon - lon_span + 180) // CELL_DEGREES)
+    right = int((lon + lon_span + 180) // CELL_DEGREES)
+    if right - left + 1 >= CELL_COLUMNS:
+        columns = [(0, CELL_COLUMNS - 1)]
+    elif left < 0:
+        columns = [(0, right), (left + CELL_COLUMNS, CELL_COLUMNS - 1)]
+    elif right >= CELL_COLUMNS:
+        columns = [(0, right - CELL_COLUMNS), (left, CELL_COLUMNS - 1)]
+    else:
+        columns = [(left, right)]
+
+    ranges = []
+    for row in range(bottom, top + 1):
+        for first, last in columns:
+            first, last = row * CELL_COLUMNS + first, row * CELL_COLUMNS + last
+            # Whole rows (near the poles) join up with the next one
+            if ranges and ranges[-1][1] + 1 == first:
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+    return ranges
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,49 @@
+import re
+
+from django.core.exceptions import ValidationError
+
+# ISBN handling: user input may be ISBN-10 or ISBN-13, with or without
+# hyphens and spaces. Everything is compared through the canonical ISBN-13
+# (digits only), which is what the indexed isbn13 columns hold.
+
+SEPARATORS = re.compile(r'[\s-]+')
+SHAPE = re.compile(r'^(\d{9}[\dX]|\d{13})$')
+
+
+def compact(value):
+    """``"0-306-40615-2"`` -> ``"0306406152"``."""
+    return SEPARATORS.sub('', value or '').upper()
+
+
+def _isbn10_check(digits):
+    total = sum((10 - i) * int(digit) for i, digit in enumerate(digits[:9]))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def _isbn13_check(digits):
+    total = sum((3 if i % 2 else 1) * int(digit) for i, digit in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def to_isbn13(value):
+    """Canonical ISBN-13 for an ISBN-10/13 with a valid checksum, else None."""
+    isbn = compact(value)
+    if not SHAPE.match(isbn):
+        return None
+    if len(isbn) == 10:
+        if isbn[9] != _isbn10_check(isbn):
+            return None
+        isbn = '978' + isbn[:9]
+        return isbn + _isbn13_check(isbn)
+    if isbn[12] != _isbn13_check(isbn):
+        return None
+    return isbn
+
+
+def validate_isbn(value):
+    """Compact form of ``value`` for storage; blank stays blank."""
+    isbn = compact(value)
+    if isbn and to_isbn13(isbn) is None:
+        raise ValidationError('Enter a valid ISBN-10 or ISBN-13.')
+    return isbn
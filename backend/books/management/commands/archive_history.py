@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books.archive import BATCH_SIZE, archive_history
+
+
+class Command(BaseCommand):
+    help = 'Move finished requests and returned loans older than --days into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Only archive rows untouched for this many days')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        requests, loans = archive_history(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {requests} requests and {loans} loans'))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books.changelog import compact
+
+
+class Command(BaseCommand):
+    help = 'Drop superseded change log entries and expire those older than --days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Clients further behind than this must reload')
+
+    def handle(self, *args, **options):
+        superseded, expired = compact(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Removed {superseded} superseded and {expired} expired entries'))
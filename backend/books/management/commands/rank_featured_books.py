@@ -0,0 +1,18 @@
+import time
+
+from books.featured import FEATURED_POOL, rank_featured_books
+from books.management.loop import LoopCommand
+
+
+class Command(LoopCommand):
+    help = 'Recompute the featured books shown on the landing page'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--size', type=int, default=FEATURED_POOL)
+
+    def run(self, **options):
+        started = time.perf_counter()
+        ranked = rank_featured_books(size=options['size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} featured books in {elapsed:.1f}s'))
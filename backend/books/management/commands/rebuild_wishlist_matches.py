@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.matching import rebuild_matches
+
+
+class Command(BaseCommand):
+    help = 'Recompute the wishlist match table from scratch'
+
+    def handle(self, *args, **options):
+        count = rebuild_matches()
+        self.stdout.write(self.style.SUCCESS(f'Stored {count} wishlist matches'))
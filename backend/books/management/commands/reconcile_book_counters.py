@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the request, loan and rating counters of every book'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters()
+        self.stdout.write(self.style.SUCCESS(f'Corrected counters on {fixed} books'))
@@ -0,0 +1,12 @@
+from books.management.loop import LoopCommand
+from books.stats import reconcile_stats
+
+
+class Command(LoopCommand):
+    help = 'Recount the site-wide statistics and correct any drifted counters'
+
+    def run(self, **options):
+        drifted = reconcile_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Corrected {", ".join(drifted)}' if drifted else 'All counters were accurate'
+        ))
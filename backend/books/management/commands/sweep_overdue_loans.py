@@ -0,0 +1,18 @@
+import time
+
+from books.management.loop import LoopCommand
+from books.overdue import BATCH_SIZE, sweep_overdue
+
+
+class Command(LoopCommand):
+    help = 'Flag overdue loans and queue a reminder for each borrower'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def run(self, **options):
+        started = time.perf_counter()
+        flagged = sweep_overdue(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Flagged {flagged} overdue loans in {elapsed:.1f}s'))
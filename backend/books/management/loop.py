@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class LoopCommand(BaseCommand):
+    """A command that runs once, or again every ``--loop SECONDS`` until it
+    is stopped, for hosts without cron. Subclasses implement run()."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Keep running, again every SECONDS (instead of scheduling with cron)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.run(**options)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def run(self, **options):
+        raise NotImplementedError('subclasses of LoopCommand must provide a run() method')
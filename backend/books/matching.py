@@ -0,0 +1,151 @@
+import heapq
+
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+
+from .fuzzy import DEFAULT_THRESHOLD, similarity
+from .geo import distance_km
+from .models import Book, Wishlist, WishlistMatch
+
+# Maintenance of the WishlistMatch table.
+#
+# A book matches a wishlist entry when it is available, belongs to someone
+# else, and either has the same canonical ISBN-13, or its title contains the
+# entry's title or (for entries with an author) its author contains the
+# entry's author, case-insensitively.
+# Every write that can change that answer refreshes the affected rows:
+# book saves and wishlist saves through signals, deletes through CASCADE.
+# rebuild_matches() recomputes the whole table with one INSERT ... SELECT.
+
+MATCH_FIELDS = {'title', 'author', 'isbn', 'isbn13', 'availability'}
+
+
+def books_for_wishlist(wishlist):
+    criteria = Q(title__icontains=wishlist.title)
+    if wishlist.author:
+        criteria |= Q(author__icontains=wishlist.author)
+    if wishlist.isbn13:
+        criteria |= Q(isbn13=wishlist.isbn13)
+    return Book.objects.filter(criteria, availability='available').exclude(owner_id=wishlist.user_id)
+
+
+def wishlists_for_book(book):
+    # Reverse containment: entries whose title is a substring of this book's
+    if book.availability != 'available':
+        return Wishlist.objects.none()
+    criteria = Q(book_title__icontains=F('title')) | (~Q(author='') & Q(book_author__icontains=F('author')))
+    if book.isbn13:
+        criteria |= Q(isbn13=book.isbn13)
+    return Wishlist.objects.alias(
+        book_title=Value(book.title), book_author=Value(book.author)
+    ).filter(criteria).exclude(user_id=book.owner_id)
+
+
+def refresh_book_matches(book):
+    wanted = set(wishlists_for_book(book).values_list('id', flat=True))
+    existing = WishlistMatch.objects.filter(book=book)
+    with transaction.atomic():
+        existing.exclude(wishlist_id__in=wanted).delete()
+        have = set(existing.values_list('wishlist_id', flat=True))
+        WishlistMatch.objects.bulk_create(
+            [WishlistMatch(wishlist_id=pk, book=book) for pk in wanted - have], ignore_conflicts=True
+        )
+
+
+def refresh_wishlist_matches(wishlist):
+    wanted = set(books_for_wishlist(wishlist).values_list('id', flat=True))
+    existing = WishlistMatch.objects.filter(wishlist=wishlist)
+    with transaction.atomic():
+        existing.exclude(book_id__in=wanted).delete()
+        have = set(existing.values_list('book_id', flat=True))
+        WishlistMatch.objects.bulk_create(
+            [WishlistMatch(wishlist=wishlist, book_id=pk) for pk in wanted - have], ignore_conflicts=True
+        )
+
+
+def _like_pattern(column):
+    # '%' || escaped column || '%', as Django's icontains builds it
+    escaped = f"REPLACE(REPLACE(REPLACE(UPPER({column}), '\\', '\\\\'), '%%', '\\%%'), '_', '\\_')"
+    return f"'%%' || {escaped} || '%%'"
+
+
+def rebuild_matches():
+    """Recompute every match in one set-based statement; returns the count.
+
+    Each entry's LIKE patterns and each book's upper-cased columns are built
+    once, in materialized CTEs, rather than once per (entry, book) pair.
+    """
+    match_table = WishlistMatch._meta.db_table
+    book_table = Book._meta.db_table
+    wishlist_table = Wishlist._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {match_table}")
+        cursor.execute(
+            f"WITH w AS MATERIALIZED ("
+            f"SELECT id, user_id, {_like_pattern('title')} AS title_pattern, "
+            f"CASE WHEN author = '' THEN NULL ELSE {_like_pattern('author')} END AS author_pattern, "
+            f"NULLIF(isbn13, '') AS isbn13 "
+            f"FROM {wishlist_table}), "
+            f"b AS MATERIALIZED ("
+            f"SELECT id, owner_id, UPPER(title) AS title, UPPER(author) AS author, isbn13 "
+            f"FROM {book_table} WHERE availability = %s) "
+            f"INSERT INTO {match_table} (wishlist_id, book_id) "
+            f"SELECT w.id, b.id FROM w JOIN b ON b.owner_id <> w.user_id "
+            f"WHERE b.isbn13 = w.isbn13 "
+            f"OR b.title LIKE w.title_pattern ESCAPE '\\' "
+            f"OR b.author LIKE w.author_pattern ESCAPE '\\'",
+            ['available'],
+        )
+    return WishlistMatch.objects.count()
+
+
+# Ranking for find_matches. Tiers, best first: same ISBN, title and author
+# both match, title matches (word for word or by trigram similarity), author
+# only. Within a tier: title similarity, then book condition, then distance
+# to the owner, then newest.
+MATCH_TIERS = {'isbn': 4, 'title_author': 3, 'title': 2, 'author': 1}
+CONDITION_RANK = {value: rank for rank, (value, _) in enumerate(Book.CONDITION_CHOICES)}
+
+
+def top_matches(wishlist, rows, limit, origin=None):
+    """Score candidate rows for ``wishlist`` in one pass and keep the best.
+
+    ``rows`` are dicts with id, title, author, isbn13, condition, created_at
+    and the owner's latitude/longitude. Returns the number of rows that
+    match at all and the best ``limit`` of them as ``(match_type,
+    distance_km, row)``, best first.
+    """
+    title = wishlist.title.casefold()
+    author = wishlist.author.casefold()
+    keyed = []
+    for row in rows:
+        book_title = row['title'].casefold()
+        title_score = 1.0 if title in book_title else similarity(wishlist.title, row['title'])
+        title_match = title_score >= DEFAULT_THRESHOLD
+        author_match = bool(author) and (
+            author in row['author'].casefold() or similarity(wishlist.author, row['author']) >= DEFAULT_THRESHOLD
+        )
+        if wishlist.isbn13 and row['isbn13'] == wishlist.isbn13:
+            match_type = 'isbn'
+        elif title_match and (author_match or not author):
+            match_type = 'title_author'
+        elif title_match:
+            match_type = 'title'
+        elif author_match:
+            match_type = 'author'
+        else:
+            continue
+        distance = None
+        if origin and row['latitude'] is not None:
+            distance = distance_km(origin[0], origin[1], row['latitude'], row['longitude'])
+        key = (
+            -MATCH_TIERS[match_type],
+            -title_score,
+            CONDITION_RANK.get(row['condition'], len(CONDITION_RANK)),
+            distance if distance is not None else float('inf'),
+            -row['created_at'].timestamp(),
+            -row['id'],
+        )
+        keyed.append((key, match_type, distance, row))
+    best = heapq.nsmallest(limit, keyed, key=lambda entry: entry[0])
+    return len(keyed), [(match_type, distance, row) for _, match_type, distance, row in best]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from books.search import ensure_fulltext_index
+    ensure_fulltext_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    from books.search import drop_fulltext_index
+    drop_fulltext_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_cover_image_url'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:57
+
+from collections import Counter, defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_genres(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Genre = apps.get_model('books', 'Genre')
+
+    # Group raw spellings by normalized key; the most common spelling wins.
+    spellings = defaultdict(Counter)
+    for raw, count in Book.objects.values_list('genre').annotate(count=models.Count('id')).order_by():
+        spellings[' '.join(raw.split()).casefold()][raw] += count
+
+    for key, raws in spellings.items():
+        names = Counter()
+        for raw, count in raws.items():
+            names[' '.join(raw.split())] += count
+        canonical = sorted(names.items(), key=lambda item: (-item[1], item[0]))[0][0]
+        genre = Genre.objects.create(key=key, name=canonical)
+        for raw in raws:
+            Book.objects.filter(genre=raw).update(genre=canonical, genre_ref=genre)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_book_updated_at_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('key', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['key'],
+            },
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='genre_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='books', to='books.genre'),
+        ),
+        migrations.RunPython(backfill_genres, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_genre'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['availability', 'owner'], name='book_avail_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookloan',
+            index=models.Index(fields=['returned', 'due_date'], name='loan_returned_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookrequest',
+            index=models.Index(fields=['book', 'status'], name='request_book_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookrequest',
+            index=models.Index(fields=['requester', 'created_at'], name='request_requester_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wishlist',
+            index=models.Index(fields=['user', 'created_at'], name='wishlist_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:02
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def geocode_profiles(apps, schema_editor):
+    from books.geo import cell_for, geocode
+
+    UserProfile = apps.get_model('books', 'UserProfile')
+    for profile in UserProfile.objects.exclude(location='').iterator():
+        coordinates = geocode(profile.location)
+        if coordinates:
+            UserProfile.objects.filter(pk=profile.pk).update(
+                latitude=coordinates[0], longitude=coordinates[1], geo_cell=cell_for(*coordinates)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='geo_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.RunPython(geocode_profiles, migrations.RunPython.noop),
+    ]
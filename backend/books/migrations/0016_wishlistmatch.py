@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_matches(apps, schema_editor):
+    # Same rule as books.matching, spelled out against the historical models
+    Book = apps.get_model('books', 'Book')
+    Wishlist = apps.get_model('books', 'Wishlist')
+    WishlistMatch = apps.get_model('books', 'WishlistMatch')
+    for wishlist in Wishlist.objects.all():
+        criteria = models.Q(title__icontains=wishlist.title)
+        if wishlist.author:
+            criteria |= models.Q(author__icontains=wishlist.author)
+        books = Book.objects.filter(criteria, availability='available').exclude(owner_id=wishlist.user_id)
+        WishlistMatch.objects.bulk_create(
+            [WishlistMatch(wishlist=wishlist, book_id=pk) for pk in books.values_list('id', flat=True)]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_userprofile_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WishlistMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wishlist_matches', to='books.book')),
+                ('wishlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='books.wishlist')),
+            ],
+            options={
+                'unique_together': {('wishlist', 'book')},
+            },
+        ),
+        migrations.RunPython(backfill_matches, migrations.RunPython.noop),
+    ]
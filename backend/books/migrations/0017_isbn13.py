@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+from books.isbn import to_isbn13
+
+
+def backfill_isbn13(apps, schema_editor):
+    for name in ('Book', 'Wishlist'):
+        model = apps.get_model('books', name)
+        for pk, isbn in list(model.objects.exclude(isbn='').values_list('id', 'isbn')):
+            isbn13 = to_isbn13(isbn)
+            if isbn13:
+                model.objects.filter(pk=pk).update(isbn13=isbn13)
+
+    # Wishlist entries now also match available books with the same ISBN
+    Book = apps.get_model('books', 'Book')
+    Wishlist = apps.get_model('books', 'Wishlist')
+    WishlistMatch = apps.get_model('books', 'WishlistMatch')
+    for wishlist in Wishlist.objects.exclude(isbn13=''):
+        books = Book.objects.filter(isbn13=wishlist.isbn13, availability='available').exclude(owner_id=wishlist.user_id)
+        WishlistMatch.objects.bulk_create(
+            [WishlistMatch(wishlist=wishlist, book_id=pk) for pk in books.values_list('id', flat=True)],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_wishlistmatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn13',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=13),
+        ),
+        migrations.AddField(
+            model_name='wishlist',
+            name='isbn13',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=13),
+        ),
+        migrations.RunPython(backfill_isbn13, migrations.RunPython.noop),
+    ]
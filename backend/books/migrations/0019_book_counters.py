@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    # Same totals as books.counters.reconcile_counters, against the historical models
+    Book = apps.get_model('books', 'Book')
+    BookRequest = apps.get_model('books', 'BookRequest')
+    BookLoan = apps.get_model('books', 'BookLoan')
+
+    def total(queryset, aggregate):
+        return Coalesce(models.Subquery(
+            queryset.order_by().values(group=models.Value(1)).annotate(total=aggregate).values('total')
+        ), 0, output_field=models.IntegerField())
+
+    loans = BookLoan.objects.filter(book_request__book=models.OuterRef('pk'))
+    rated = loans.filter(rating__isnull=False)
+    Book.objects.update(
+        request_count=total(BookRequest.objects.filter(book=models.OuterRef('pk')), models.Count('id')),
+        loan_count=total(loans, models.Count('id')),
+        rating_sum=total(rated, models.Sum('rating')),
+        rating_count=total(rated, models.Count('id')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0018_loan_overdue_reminders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='loan_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='request_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['availability', '-request_count', '-created_at'], name='book_avail_popular_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0019_book_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBookRequest',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('request_type', models.CharField(choices=[('borrow', 'Borrow'), ('swap', 'Swap')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=10)),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_requests', to='books.book')),
+                ('requester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_book_requests', to=settings.AUTH_USER_MODEL)),
+                ('swap_book', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_swap_requests', to='books.book')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedBookLoan',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('due_date', models.DateField()),
+                ('return_date', models.DateField(blank=True, null=True)),
+                ('returned', models.BooleanField(default=True)),
+                ('rating', models.IntegerField(blank=True, null=True)),
+                ('review', models.TextField(blank=True)),
+                ('overdue', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('book_request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='loan', to='books.archivedbookrequest')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedbookrequest',
+            index=models.Index(fields=['requester', 'created_at'], name='archived_requester_created_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def enqueue_pending(apps, schema_editor):
+    # Requests already waiting on a borrowed book join its queue in arrival order
+    Book = apps.get_model('books', 'Book')
+    BookRequest = apps.get_model('books', 'BookRequest')
+    for book in Book.objects.filter(availability='borrowed', requests__status='pending').distinct():
+        waiting = BookRequest.objects.filter(book=book, status='pending').order_by('created_at', 'id')
+        for ticket, book_request in enumerate(waiting, start=1):
+            book_request.status = 'waitlisted'
+            book_request.queue_ticket = ticket
+            book_request.save(update_fields=['status', 'queue_ticket'])
+        book.queue_tail = ticket
+        book.save(update_fields=['queue_tail'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0021_change_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bookrequest',
+            name='request_book_status_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedbookrequest',
+            name='queue_ticket',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='queue_tail',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='bookrequest',
+            name='queue_ticket',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='archivedbookrequest',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('waitlisted', 'Waitlisted')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='bookrequest',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('waitlisted', 'Waitlisted')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='bookrequest',
+            index=models.Index(fields=['book', 'status', 'queue_ticket'], name='request_book_queue_idx'),
+        ),
+        migrations.RunPython(enqueue_pending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    # Same totals as books.stats.true_counts, against the historical models
+    Book = apps.get_model('books', 'Book')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    StatCounter = apps.get_model('books', 'StatCounter')
+    totals = {
+        'total_books': Book.objects.count(),
+        'total_users': User.objects.count(),
+        'total_loans': (
+            apps.get_model('books', 'BookLoan').objects.count()
+            + apps.get_model('books', 'ArchivedBookLoan').objects.count()
+        ),
+        'active_requests': apps.get_model('books', 'BookRequest').objects.filter(
+            status__in=('pending', 'waitlisted')
+        ).count(),
+        'available_books': Book.objects.filter(availability='available').count(),
+    }
+    StatCounter.objects.bulk_create([StatCounter(name=name, value=value) for name, value in totals.items()])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0022_waitlist'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('name', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0023_stat_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeaturedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(unique=True)),
+                ('score', models.FloatField()),
+                ('ranked_at', models.DateTimeField()),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='featured', to='books.book')),
+            ],
+            options={
+                'ordering': ['rank'],
+            },
+        ),
+    ]
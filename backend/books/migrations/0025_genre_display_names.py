@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:00
+
+from django.db import migrations, models
+
+
+def rename_genres(apps, schema_editor):
+    # Same rule as Genre.refresh_names: the spelling most of its books use
+    Genre = apps.get_model('books', 'Genre')
+    Book = apps.get_model('books', 'Book')
+    for genre in Genre.objects.all():
+        spelling = Book.objects.filter(genre_ref=genre).values('genre').annotate(
+            count=models.Count('id')
+        ).order_by('-count', 'genre').values_list('genre', flat=True).first()
+        if spelling and genre.name != spelling:
+            genre.name = spelling
+            genre.save(update_fields=['name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0024_featured_books'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_genres, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,23 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .geo import cell_for, geocode
+from .isbn import to_isbn13
+
 # Remove any dynamic field additions to User model
 # Profile picture will be handled through UserProfile model only
 
+class ChangeLoggedModel(models.Model):
+    # Saves run in a transaction so the change log entry written by the
+    # post_save signal commits (or rolls back) together with the row
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     phone = models.CharField(max_length=15, blank=True)
@@ -14,12 +27,86 @@ class UserProfile(models.Model):
     location = models.CharField(max_length=200, blank=True)
     website = models.URLField(blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    geo_cell = models.IntegerField(null=True, blank=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
-class Book(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        profile = super().from_db(db, field_names, values)
+        # The stored location and coordinates, so a save can tell whether the
+        # location moved without new coordinates
+        profile._stored_geo = profile._loaded_geo()
+        return profile
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or {'location', 'latitude', 'longitude'} & set(fields):
+            self._stored_geo = self._loaded_geo()
+
+    def _loaded_geo(self):
+        loaded = self.__dict__
+        if {'location', 'latitude', 'longitude'} <= loaded.keys():
+            return loaded['location'], loaded['latitude'], loaded['longitude']
+        return None
+
+    def save(self, *args, **kwargs):
+        # Explicit coordinates win; otherwise geocode the location text,
+        # again whenever it changes
+        stored = getattr(self, '_stored_geo', None)
+        relocated = stored is not None and self.location != stored[0] and (
+            (self.latitude, self.longitude) == stored[1:]
+        )
+        if relocated or self.latitude is None or self.longitude is None:
+            self.latitude, self.longitude = geocode(self.location) or (None, None)
+        if self.latitude is not None and self.longitude is not None:
+            self.geo_cell = cell_for(self.latitude, self.longitude)
+        else:
+            self.geo_cell = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'latitude', 'longitude', 'geo_cell'}
+        super().save(*args, **kwargs)
+        self._stored_geo = self._loaded_geo()
+
+class Genre(models.Model):
+    name = models.CharField(max_length=100)
+    key = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['key']
+
+    @staticmethod
+    def normalize_key(name):
+        # "  Science   fiction " and "science Fiction" are the same genre
+        return ' '.join((name or '').split()).casefold()
+
+    @classmethod
+    def for_name(cls, name):
+        key = cls.normalize_key(name)
+        genre, created = cls.objects.get_or_create(key=key, defaults={'name': ' '.join((name or '').split())})
+        return genre
+
+    @classmethod
+    def refresh_names(cls, *genre_ids):
+        # Named after the spelling most of its books use, ties going to the
+        # first in sort order (as migration 0013 chose), so the name never
+        # depends on which spelling was saved first
+        for genre_id in {genre_id for genre_id in genre_ids if genre_id}:
+            spelling = Book.objects.filter(genre_ref_id=genre_id).values('genre').annotate(
+                count=models.Count('id')
+            ).order_by('-count', 'genre').values_list('genre', flat=True).first()
+            if spelling:
+                cls.objects.filter(pk=genre_id).exclude(name=spelling).update(name=spelling)
+
+    def __str__(self):
+        return self.name
+
+class Book(ChangeLoggedModel):
     CONDITION_CHOICES = [
         ('new', 'New'),
         ('like_new', 'Like New'),
@@ -44,7 +131,9 @@ class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=100)
     isbn = models.CharField(max_length=13, blank=True)
+    isbn13 = models.CharField(max_length=13, blank=True, db_index=True, editable=False)
     genre = models.CharField(max_length=100)
+    genre_ref = models.ForeignKey(Genre, on_delete=models.PROTECT, null=True, blank=True, related_name='books')
     description = models.TextField(blank=True)
     condition = models.CharField(max_length=10, choices=CONDITION_CHOICES)
     lending_type = models.CharField(max_length=10, choices=LENDING_TYPE_CHOICES)
@@ -53,19 +142,81 @@ class Book(models.Model):
     cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
     cover_image_url = models.URLField(blank=True)
     book_photos = models.JSONField(default=list, blank=True)
+    # Maintained with F() updates by books.counters and books.transitions
+    # (never written by save(), see below); reconcile_book_counters
+    # recomputes them
+    request_count = models.PositiveIntegerField(default=0, editable=False)
+    loan_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    # Last waitlist ticket handed out for this book (see books.transitions)
+    queue_tail = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='book_created_id_idx'),
+            models.Index(fields=['updated_at'], name='book_updated_at_idx'),
+            models.Index(fields=['availability', 'owner'], name='book_avail_owner_idx'),
+            models.Index(fields=['availability', '-request_count', '-created_at'], name='book_avail_popular_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} by {self.author}"
 
-class BookRequest(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        # The stored availability, so a save can tell whether it changed (books.stats)
+        book._stored_availability = book.__dict__.get('availability')
+        # and the stored genre, so it can tell whether a genre's name may change
+        book._stored_genre = book.__dict__.get('genre_ref_id'), book.__dict__.get('genre')
+        return book
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 1)
+
+    # Columns only ever moved by UPDATE ... SET x = x + n. A save of a
+    # loaded instance would write back the values it read, losing every
+    # increment made since, so updates leave them out.
+    F_UPDATED_FIELDS = ('request_count', 'loan_count', 'rating_sum', 'rating_count', 'queue_tail')
+
+    def save(self, *args, **kwargs):
+        # Keep the free-text genre and the normalized Genre row in step; the
+        # text keeps the owner's spelling, minus stray whitespace.
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'genre' in update_fields:
+            self.genre = ' '.join((self.genre or '').split())
+            self.genre_ref = Genre.for_name(self.genre)
+            if update_fields is not None:
+                kwargs['update_fields'] = update_fields = {*update_fields, 'genre_ref'}
+        if update_fields is None or 'isbn' in update_fields:
+            self.isbn13 = to_isbn13(self.isbn) or ''
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'isbn13'}
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = {
+                    field.attname for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                }
+            kwargs['update_fields'] = set(update_fields).difference(self.F_UPDATED_FIELDS)
+        super().save(*args, **kwargs)
+
+class BookRequest(ChangeLoggedModel):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('accepted', 'Accepted'),
         ('declined', 'Declined'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
+        ('waitlisted', 'Waitlisted'),
     ]
     
     REQUEST_TYPE_CHOICES = [
@@ -79,34 +230,191 @@ class BookRequest(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     message = models.TextField(blank=True)
     swap_book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True, blank=True, related_name='swap_requests')
+    # Place in the book's waitlist; lower tickets are served first
+    queue_ticket = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'status', 'queue_ticket'], name='request_book_queue_idx'),
+            models.Index(fields=['requester', 'created_at'], name='request_requester_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.requester.username} - {self.book.title} ({self.request_type})"
 
-class BookLoan(models.Model):
+class BookLoan(ChangeLoggedModel):
     book_request = models.OneToOneField(BookRequest, on_delete=models.CASCADE)
     due_date = models.DateField()
     return_date = models.DateField(null=True, blank=True)
     returned = models.BooleanField(default=False)
     rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)], null=True, blank=True)
     review = models.TextField(blank=True)
+    overdue = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['returned', 'due_date'], name='loan_returned_due_idx'),
+        ]
+
     def __str__(self):
         return f"{self.book_request.book.title} - {self.book_request.requester.username}"
 
-class Wishlist(models.Model):
+# Outbox of reminders for a mailer to deliver; sent_at stays empty until then
+class LoanReminder(models.Model):
+    KIND_CHOICES = [
+        ('overdue', 'Overdue'),
+    ]
+
+    loan = models.ForeignKey(BookLoan, on_delete=models.CASCADE, related_name='reminders')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='loan_reminders')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['loan', 'kind']
+        indexes = [
+            models.Index(fields=['sent_at', 'created_at'], name='reminder_unsent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} reminder for {self.recipient.username}"
+
+# Terminal requests and their returned loans, moved out of the hot tables by
+# books.archive with their original ids
+class ArchivedBookRequest(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_requests')
+    requester = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_book_requests')
+    request_type = models.CharField(max_length=10, choices=BookRequest.REQUEST_TYPE_CHOICES)
+    status = models.CharField(max_length=10, choices=BookRequest.STATUS_CHOICES)
+    message = models.TextField(blank=True)
+    swap_book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, null=True, blank=True, related_name='archived_swap_requests'
+    )
+    queue_ticket = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['requester', 'created_at'], name='archived_requester_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.requester.username} - {self.book.title} ({self.request_type}, archived)"
+
+class ArchivedBookLoan(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    book_request = models.OneToOneField(ArchivedBookRequest, on_delete=models.CASCADE, related_name='loan')
+    due_date = models.DateField()
+    return_date = models.DateField(null=True, blank=True)
+    returned = models.BooleanField(default=True)
+    rating = models.IntegerField(null=True, blank=True)
+    review = models.TextField(blank=True)
+    overdue = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.book_request.book.title} - {self.book_request.requester.username} (archived)"
+
+class Wishlist(ChangeLoggedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlist')
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=100, blank=True)
     isbn = models.CharField(max_length=13, blank=True)
+    isbn13 = models.CharField(max_length=13, blank=True, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ['user', 'title', 'author']
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='wishlist_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.title}"
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'isbn' in update_fields:
+            self.isbn13 = to_isbn13(self.isbn) or ''
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'isbn13'}
+        super().save(*args, **kwargs)
+
+# Available books that satisfy a wishlist entry, maintained by books.matching
+class WishlistMatch(models.Model):
+    wishlist = models.ForeignKey(Wishlist, on_delete=models.CASCADE, related_name='matches')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='wishlist_matches')
+
+    class Meta:
+        unique_together = ['wishlist', 'book']
+
+    def __str__(self):
+        return f"{self.wishlist} - {self.book.title}"
+
+# Append-only feed of changes for incremental sync; the id is the sequence
+class ChangeLogEntry(models.Model):
+    KIND_CHOICES = [
+        ('book', 'Book'),
+        ('request', 'Request'),
+        ('loan', 'Loan'),
+        ('wishlist', 'Wishlist'),
+        ('log', 'Log'),
+    ]
+
+    ACTION_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+        ('compacted', 'Compacted'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # Who may read it; NULL for public catalog changes. No database
+    # constraint: deleting a user removes their entries first, and the
+    # deletes of their requests, loans and wishlist rows that follow still
+    # log to them. Those entries are never read and expire with the rest.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='change_log', db_constraint=False
+    )
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='changelog_user_seq_idx'),
+            models.Index(fields=['kind', 'object_id'], name='changelog_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} {self.object_id} {self.action}"
+
+# Site-wide totals behind /api/statistics/, kept by books.stats
+class StatCounter(models.Model):
+    name = models.CharField(max_length=30, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+# The featured list served on the landing page, rewritten by books.featured
+class FeaturedBook(models.Model):
+    rank = models.PositiveSmallIntegerField(unique=True)
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name='featured')
+    score = models.FloatField()
+    ranked_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['rank']
 
     def __str__(self):
-        return f"{self.user.username} - {self.title}"
\ No newline at end of file
+        return f"#{self.rank} {self.book.title}"
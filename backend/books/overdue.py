@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .changelog import entries, record
+from .models import BookLoan, LoanReminder
+
+# Flags unreturned loans past their due date and queues one reminder per loan.
+#
+# Candidates are read through loan_returned_due_idx (returned, due_date) as a
+# stream of (id, requester) pairs, so memory stays bounded by the batch size
+# however many loans there are. Each batch is flagged and its reminders queued
+# in its own transaction; the stream walks that index, whose columns the
+# batches never write, so the open cursor is not disturbed by them. Flagged
+# loans are skipped on the next run and the reminder is unique per loan and
+# kind, so running the sweep again (or concurrently) queues nothing twice.
+# Flagging a loan is logged to the change feed for its borrower and lender.
+
+BATCH_SIZE = 2000
+
+
+def _flag(batch):
+    with transaction.atomic():
+        # Locked, so only loans this sweep flags are logged: an overlapping
+        # sweep may have flagged (and logged) some of the batch since it was read
+        unflagged = set(BookLoan.objects.select_for_update().filter(
+            pk__in=[loan_id for loan_id, _, _ in batch], overdue=False
+        ).values_list('id', flat=True))
+        batch = [row for row in batch if row[0] in unflagged]
+        flagged = BookLoan.objects.filter(pk__in=unflagged).update(overdue=True)
+        LoanReminder.objects.bulk_create(
+            [LoanReminder(loan_id=loan_id, recipient_id=requester_id, kind='overdue') for loan_id, requester_id, _ in batch],
+            ignore_conflicts=True,
+        )
+        record(*(
+            entries('loan', loan_id, 'updated', (requester_id, owner_id), returned=False, overdue=True)
+            for loan_id, requester_id, owner_id in batch
+        ))
+    return flagged
+
+
+def sweep_overdue(today=None, batch_size=BATCH_SIZE):
+    """Flag loans due before ``today`` that are still out. Returns the number
+    of loans flagged."""
+    today = today or timezone.localdate()
+    # returned=False compiles to NOT returned, which SQLite cannot seek an
+    # index on; the IN form gives it the equality it needs
+    candidates = BookLoan.objects.filter(returned__in=[False], due_date__lt=today, overdue=False).order_by(
+        'due_date'
+    ).values_list('id', 'book_request__requester_id', 'book_request__book__owner_id')
+    flagged = 0
+    batch = []
+    for row in candidates.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            flagged += _flag(batch)
+            batch = []
+    if batch:
+        flagged += _flag(batch)
+    return flagged
@@ -0,0 +1,166 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import Count, Q
+
+# Full-text index over Book.title/author/isbn/description.
+#
+# SQLite: an external-content FTS5 table kept in sync with books_book by
+# triggers, ranked with bm25().
+# PostgreSQL: a GIN expression index over the same columns, ranked with
+# ts_rank_cd().
+# Any other backend falls back to the original icontains scan.
+
+FTS_TABLE = 'books_book_fts'
+FTS_COLUMNS = ('title', 'author', 'isbn', 'description')
+
+# bm25 column weights, in FTS_COLUMNS order: a title hit outranks a
+# description hit.
+BM25_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+PG_INDEX = 'books_book_search_gin'
+PG_DOCUMENT = (
+    "to_tsvector('english', coalesce(books_book.title, '') || ' ' || "
+    "coalesce(books_book.author, '') || ' ' || coalesce(books_book.isbn, '') || ' ' || "
+    "coalesce(books_book.description, ''))"
+)
+
+_SQLITE_TRIGGERS = {
+    'books_book_fts_ai': (
+        "CREATE TRIGGER IF NOT EXISTS books_book_fts_ai AFTER INSERT ON books_book BEGIN "
+        "INSERT INTO books_book_fts(rowid, title, author, isbn, description) "
+        "VALUES (new.id, new.title, new.author, new.isbn, new.description); END"
+    ),
+    'books_book_fts_ad': (
+        "CREATE TRIGGER IF NOT EXISTS books_book_fts_ad AFTER DELETE ON books_book BEGIN "
+        "INSERT INTO books_book_fts(books_book_fts, rowid, title, author, isbn, description) "
+        "VALUES ('delete', old.id, old.title, old.author, old.isbn, old.description); END"
+    ),
+    'books_book_fts_au': (
+        "CREATE TRIGGER IF NOT EXISTS books_book_fts_au "
+        "AFTER UPDATE OF title, author, isbn, description ON books_book BEGIN "
+        "INSERT INTO books_book_fts(books_book_fts, rowid, title, author, isbn, description) "
+        "VALUES ('delete', old.id, old.title, old.author, old.isbn, old.description); "
+        "INSERT INTO books_book_fts(rowid, title, author, isbn, description) "
+        "VALUES (new.id, new.title, new.author, new.isbn, new.description); END"
+    ),
+}
+
+
+def ensure_fulltext_index(conn=None):
+    """Create the full-text index if it (or any of its triggers) is missing.
+
+    SQLite drops a table's triggers whenever a migration rebuilds books_book,
+    so this runs after every migrate and rebuilds the FTS content when it had
+    to recreate anything.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            expected = {FTS_TABLE, *_SQLITE_TRIGGERS}
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name IN (%s)"
+                % ', '.join('%s' for _ in expected),
+                list(expected),
+            )
+            missing = expected - {row[0] for row in cursor.fetchall()}
+            if not missing:
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(FTS_COLUMNS)}, content='books_book', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            for sql in _SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON books_book USING GIN ({PG_DOCUMENT})")
+
+
+def drop_fulltext_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for name in _SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query.casefold())
+
+
+def full_text_search(queryset, query):
+    """Restrict ``queryset`` to books matching ``query``, best match first.
+
+    Every word in the query must match (as a prefix, so partially typed
+    words from the search box still hit). Punctuation is ignored.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none() if query.strip() else queryset
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+        return queryset.extra(
+            select={'rank': f'bm25({FTS_TABLE}, {weights})'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = books_book.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            order_by=['rank'],
+        )
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.extra(
+            select={'rank': f"ts_rank_cd({PG_DOCUMENT}, to_tsquery('english', %s))"},
+            select_params=[tsquery],
+            where=[f"{PG_DOCUMENT} @@ to_tsquery('english', %s)"],
+            params=[tsquery],
+            order_by=['-rank'],
+        )
+    return queryset.filter(
+        Q(title__icontains=query) |
+        Q(author__icontains=query) |
+        Q(isbn__icontains=query) |
+        Q(description__icontains=query)
+    )
+
+
+# Facet name -> column; genres are counted per Genre, whatever the spelling
+FACET_FIELDS = {'genre': 'genre_ref__name', 'condition': 'condition', 'lending_type': 'lending_type'}
+
+
+def search_facets(queryset):
+    """Per-genre/condition/lending_type/availability counts for ``queryset``.
+
+    One GROUP BY over all four columns, folded in Python. ``queryset`` must
+    not be filtered on availability: the availability facet counts every
+    status, the other facets (and ``total``) count only available books so
+    they line up with what search returns.
+    """
+    rows = queryset.order_by().values(*FACET_FIELDS.values(), 'availability').annotate(count=Count('id'))
+    counts = {field: {} for field in (*FACET_FIELDS, 'availability')}
+    total = 0
+    for row in rows:
+        availability = row['availability']
+        counts['availability'][availability] = counts['availability'].get(availability, 0) + row['count']
+        if availability != 'available':
+            continue
+        total += row['count']
+        for field, column in FACET_FIELDS.items():
+            counts[field][row[column]] = counts[field].get(row[column], 0) + row['count']
+    return {
+        'total': total,
+        'facets': {
+            field: [
+                {'value': value, 'count': count}
+                for value, count in sorted(values.items(), key=lambda item: (-item[1], item[0]))
+            ]
+            for field, values in counts.items()
+        },
+    }
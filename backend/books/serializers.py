@@ -1,13 +1,22 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Book, BookRequest, BookLoan, UserProfile, Wishlist
+from .isbn import validate_isbn
+from .models import ArchivedBookLoan, Book, BookRequest, BookLoan, UserProfile, Wishlist
 
-class BookCreateSerializer(serializers.ModelSerializer):
+class ISBNFieldMixin(serializers.Serializer):
+    # Hyphenated input is longer than the column, so no max_length here;
+    # validate_isbn checks the checksum and compacts it to fit.
+    isbn = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_isbn(self, value):
+        return validate_isbn(value)
+
+
+class BookCreateSerializer(ISBNFieldMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ['title', 'author', 'isbn', 'genre', 'description', 'condition', 'lending_type', 'publication_year', 'cover_image_url']
         extra_kwargs = {
-            'isbn': {'required': False, 'allow_blank': True},
             'description': {'required': False, 'allow_blank': True},
             'condition': {'default': 'good'},
             'lending_type': {'default': 'lending'},
@@ -48,14 +57,74 @@ class UserProfileSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class BookSerializer(serializers.ModelSerializer):
+def requested_fields(request, param):
+    if request is None:
+        return set()
+    value = request.query_params.get(param, '')
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """Trim the serialized fields with ``?fields=a,b`` or ``?omit=c,d``.
+
+    ``FIELD_PRESETS`` maps a single ``fields`` value (e.g. ``card``) to a
+    named field list. ``SOURCE_COLUMNS`` lists the model columns behind
+    computed fields, so views can narrow the SQL with ``only()`` to match.
+    """
+    FIELD_PRESETS = {}
+    SOURCE_COLUMNS = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.selected_fields(self.context.get('request'), self.fields.keys())
+        for name in set(self.fields) - selected:
+            self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, request, available):
+        available = set(available)
+        fields = requested_fields(request, 'fields')
+        if len(fields) == 1 and next(iter(fields)) in cls.FIELD_PRESETS:
+            fields = set(cls.FIELD_PRESETS[next(iter(fields))])
+        selected = (fields & available) or available
+        return selected - requested_fields(request, 'omit')
+
+    @classmethod
+    def sparse_queryset(cls, queryset, request):
+        """Load only the columns the selected fields need."""
+        if not (requested_fields(request, 'fields') or requested_fields(request, 'omit')):
+            return queryset
+        columns = {'id'}
+        for name in cls.selected_fields(request, cls().get_fields().keys()):
+            columns.update(cls.SOURCE_COLUMNS.get(name, (name,)))
+        # Joins for fields that were not asked for would clash with only()
+        queryset = queryset.select_related(None)
+        related = {column.split('__')[0] for column in columns if '__' in column}
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns)
+
+
+class BookSerializer(SparseFieldsetMixin, ISBNFieldMixin, serializers.ModelSerializer):
+    FIELD_PRESETS = {
+        'card': ('id', 'title', 'author', 'genre', 'availability', 'display_image', 'owner_name'),
+    }
+    SOURCE_COLUMNS = {
+        'owner_name': ('owner__username',),
+        'owner_email': ('owner__email',),
+        'display_image': ('cover_image', 'cover_image_url'),
+        'average_rating': ('rating_sum', 'rating_count'),
+    }
     owner_name = serializers.CharField(source='owner.username', read_only=True)
     owner_email = serializers.CharField(source='owner.email', read_only=True)
     display_image = serializers.SerializerMethodField()
+    average_rating = serializers.FloatField(read_only=True)
     
     class Meta:
         model = Book
-        exclude = ('owner',)
+        # request_count moves without a catalog version bump, so the raw
+        # counters stay out of the cached representation
+        exclude = ('owner', 'genre_ref', 'request_count', 'loan_count', 'rating_sum', 'queue_tail')
         read_only_fields = ('created_at', 'updated_at')
     
     def get_display_image(self, obj):
@@ -80,7 +149,14 @@ class BookLoanSerializer(serializers.ModelSerializer):
         model = BookLoan
         fields = '__all__'
 
-class WishlistSerializer(serializers.ModelSerializer):
+class ArchivedBookLoanSerializer(BookLoanSerializer):
+    archived = serializers.BooleanField(default=True, read_only=True)
+
+    class Meta:
+        model = ArchivedBookLoan
+        fields = '__all__'
+
+class WishlistSerializer(ISBNFieldMixin, serializers.ModelSerializer):
     class Meta:
         model = Wishlist
         fields = '__all__'
@@ -0,0 +1,178 @@
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import counters, stats
+from .changelog import entries, record
+from .cache import bump_catalog_version
+from .dashboard import touch_users
+from .fuzzy import trigram_index
+from .matching import MATCH_FIELDS, refresh_book_matches, refresh_wishlist_matches
+from .models import ArchivedBookLoan, Book, BookLoan, BookRequest, Genre, Wishlist
+from .search import ensure_fulltext_index
+
+
+@receiver(post_migrate)
+def restore_fulltext_index(sender, using='default', **kwargs):
+    # Table rebuilds during migrate drop the FTS triggers; put them back.
+    if sender.name == 'books':
+        ensure_fulltext_index(connections[using])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_catalog(sender, **kwargs):
+    # After commit: a reader between the bump and the commit would cache
+    # the old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Book)
+def rename_saved_book_genre(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and 'genre' not in update_fields):
+        return
+    stored = getattr(instance, '_stored_genre', (None, None))
+    instance._stored_genre = instance.genre_ref_id, instance.genre
+    if instance._stored_genre != stored:
+        Genre.refresh_names(instance.genre_ref_id, stored[0])
+
+
+@receiver(post_delete, sender=Book)
+def rename_deleted_book_genre(sender, instance, **kwargs):
+    Genre.refresh_names(instance.genre_ref_id)
+
+
+@receiver(post_save, sender=Book)
+def index_book_trigrams(sender, instance, **kwargs):
+    # An unloaded index builds itself from the table on first use.
+    if trigram_index.loaded:
+        trigram_index.add(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book_trigrams(sender, instance, **kwargs):
+    if trigram_index.loaded:
+        trigram_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def refresh_book_wishlist_matches(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not MATCH_FIELDS & set(update_fields)):
+        return
+    refresh_book_matches(instance)
+
+
+@receiver(post_save, sender=Wishlist)
+def refresh_wishlist_entry_matches(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_wishlist_matches(instance)
+
+
+@receiver(post_save, sender=BookRequest)
+def count_book_request(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        counters.request_added(instance.book_id)
+
+
+@receiver(post_delete, sender=BookRequest)
+def uncount_book_request(sender, instance, **kwargs):
+    counters.request_removed(instance.book_id)
+
+
+@receiver(post_save, sender=Book)
+def count_book_stats(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    # Unknown for instances that were not loaded with their availability
+    stored = None if created else getattr(instance, '_stored_availability', None) or instance.availability
+    instance._stored_availability = instance.availability
+    stats.adjust(
+        total_books=1 if created else 0,
+        available_books=(instance.availability == 'available') - (stored == 'available'),
+    )
+
+
+@receiver(post_delete, sender=Book)
+def uncount_book_stats(sender, instance, **kwargs):
+    stats.adjust(total_books=-1, available_books=-1 if instance.availability == 'available' else 0)
+
+
+@receiver(post_save, sender=BookRequest)
+@receiver(post_delete, sender=BookRequest)
+def count_request_stats(sender, instance, created=False, raw=False, **kwargs):
+    # Status changes go through books.transitions, which adjust the counts themselves
+    if raw or instance.status not in stats.ACTIVE_STATUSES:
+        return
+    if kwargs['signal'] is post_delete:
+        stats.adjust(active_requests=-1)
+    elif created:
+        stats.adjust(active_requests=1)
+
+
+@receiver(post_save, sender=BookLoan)
+@receiver(post_delete, sender=BookLoan)
+@receiver(post_delete, sender=ArchivedBookLoan)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def count_row_stats(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    name = 'total_users' if sender is User else 'total_loans'
+    if kwargs['signal'] is post_delete:
+        stats.adjust(**{name: -1})
+    elif created:
+        stats.adjust(**{name: 1})
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def touch_book_owner(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_users(instance.owner_id)
+
+
+@receiver(post_save, sender=BookRequest)
+@receiver(post_delete, sender=BookRequest)
+def touch_request_parties(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_users(instance.requester_id, instance.book.owner_id)
+
+
+def _action(kwargs):
+    if kwargs['signal'] is post_delete:
+        return 'deleted'
+    return 'created' if kwargs.get('created') else 'updated'
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def log_book_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record(entries('book', instance.pk, _action(kwargs), availability=instance.availability))
+
+
+@receiver(post_save, sender=BookRequest)
+@receiver(post_delete, sender=BookRequest)
+def log_request_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        audience = (instance.requester_id, instance.book.owner_id)
+        record(entries('request', instance.pk, _action(kwargs), audience, status=instance.status))
+
+
+@receiver(post_save, sender=BookLoan)
+@receiver(post_delete, sender=BookLoan)
+def log_loan_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        book_request = instance.book_request
+        audience = (book_request.requester_id, book_request.book.owner_id)
+        record(entries(
+            'loan', instance.pk, _action(kwargs), audience, returned=instance.returned, overdue=instance.overdue
+        ))
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def log_wishlist_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record(entries('wishlist', instance.pk, _action(kwargs), (instance.user_id,)))
@@ -0,0 +1,81 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import ArchivedBookLoan, Book, BookLoan, BookRequest, StatCounter
+
+# Site-wide totals for /api/statistics/.
+#
+# Each total is a StatCounter row moved by the writes that change it: model
+# signals for saves and deletes, and books.transitions for the UPDATEs and
+# bulk inserts that skip them. adjust() is a single UPDATE ... SET value =
+# value + delta, so concurrent writers never lose an increment. Readers get
+# the totals from the cache, or from the five rows by primary key when the
+# cache was cleared by a commit; neither touches the counted tables.
+# reconcile_stats() recounts those and corrects any drift.
+
+STATS = ('total_books', 'total_users', 'total_loans', 'active_requests', 'available_books')
+STATS_KEY = 'books:stats'
+# Another worker's writes only clear its own LocMemCache copy
+STATS_TIMEOUT = 60
+# Requests still waiting for the book
+ACTIVE_STATUSES = ('pending', 'waitlisted')
+
+
+def _invalidate():
+    transaction.on_commit(lambda: cache.delete(STATS_KEY))
+
+
+def adjust(**deltas):
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    StatCounter.objects.filter(name__in=deltas).update(value=F('value') + Case(
+        *[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+        output_field=IntegerField(),
+    ))
+    _invalidate()
+
+
+def true_counts():
+    return {
+        'total_books': Book.objects.count(),
+        'total_users': User.objects.count(),
+        # Archived loans still happened
+        'total_loans': BookLoan.objects.count() + ArchivedBookLoan.objects.count(),
+        'active_requests': BookRequest.objects.filter(status__in=ACTIVE_STATUSES).count(),
+        'available_books': Book.objects.filter(availability='available').count(),
+    }
+
+
+def reconcile_stats():
+    """Recount every total and correct the rows that drifted (or are
+    missing). Returns the names that were corrected.
+
+    Writes that land between the recount and the upsert can still leave a
+    small drift; the next run picks it up.
+    """
+    with transaction.atomic():
+        actual = true_counts()
+        stored = dict(StatCounter.objects.filter(name__in=STATS).values_list('name', 'value'))
+        drifted = [name for name in STATS if stored.get(name) != actual[name]]
+        StatCounter.objects.bulk_create(
+            [StatCounter(name=name, value=actual[name]) for name in drifted],
+            update_conflicts=True, unique_fields=['name'], update_fields=['value'],
+        )
+        if drifted:
+            _invalidate()
+    return drifted
+
+
+def get_stats():
+    stats = cache.get(STATS_KEY)
+    if stats is None:
+        stats = dict(StatCounter.objects.filter(name__in=STATS).values_list('name', 'value'))
+        if len(stats) < len(STATS):
+            reconcile_stats()
+            stats = dict(StatCounter.objects.filter(name__in=STATS).values_list('name', 'value'))
+        stats = {name: stats[name] for name in STATS}
+        cache.set(STATS_KEY, stats, timeout=STATS_TIMEOUT)
+    return stats
@@ -1,3 +1,1628 @@
+import re
+import time
+import unittest
+from unittest import mock
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .fuzzy import TrigramIndex, similarity, trigram_index
+from .geo import cell_for, cell_ranges
+from .isbn import to_isbn13
+from .archive import archive_history
+from .cache import VERSION_TIMEOUT, bump_catalog_version, catalog_version
+from .changelog import compact
+from .counters import reconcile_counters
+from .featured import rank_featured_books
+from .matching import rebuild_matches
+from .models import (
+    ArchivedBookLoan, ArchivedBookRequest, Book, BookLoan, BookRequest, ChangeLogEntry, FeaturedBook, Genre,
+    LoanReminder, StatCounter, UserProfile, Wishlist, WishlistMatch,
+)
+from . import transitions
+from . import overdue
+from .overdue import sweep_overdue
+from .search import full_text_search
+from .serializers import BookSerializer
+from .stats import STATS_TIMEOUT, reconcile_stats, true_counts
+
+SCAN = re.compile(r'^SCAN (\S+)')
+
+# Tables small enough (or rarely read) that a scan is not a regression.
+TOLERATED_SCANS = {'books_genre'}
+
+# Saving an available book looks for wishlist entries whose title or author
+# it contains; substring-of-the-value lookups have no B-tree form.
+BOOK_WRITE_SCANS = ['books_wishlist']
+
+
+def full_scans(sql):
+    """Tables that ``sql`` reads with a full scan, per EXPLAIN QUERY PLAN.
+
+    Walking an index in order to feed a LIMIT (keyset pages, top-N lists)
+    only touches the rows returned, so it does not count.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        details = [row[-1] for row in cursor.fetchall()]
+    limited = re.search(r'\bLIMIT\b', sql, re.IGNORECASE)
+    tables = set(connection.introspection.table_names())
+    scans = []
+    for detail in details:
+        match = SCAN.match(detail)
+        # Subqueries and derived tables are scans of rows already narrowed
+        if not match or 'VIRTUAL TABLE' in detail or match.group(1) not in tables:
+            continue
+        if limited and ' USING INDEX ' in detail:
+            continue
+        if match.group(1) not in TOLERATED_SCANS:
+            scans.append(detail)
+    return scans
+
+
+def make_user(username):
+    return User.objects.create_user(username, f'{username}@example.com', 'password123')
+
+
+BOOK_DEFAULTS = {'author': 'Frank Herbert', 'genre': 'Fiction', 'condition': 'good', 'lending_type': 'lending'}
+
+
+def make_book(owner, title='Dune', **fields):
+    return Book.objects.create(owner=owner, title=title, **{**BOOK_DEFAULTS, **fields})
+
+
+class LendingTestCase(TestCase):
+    """Starts every test with an ``owner`` and an API client."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+
+    def setUp(self):
+        self.client = APIClient()
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(LendingTestCase):
+    """Every query each endpoint issues must use an index on the hot tables.
+
+    A test fails when a query plan falls back to ``SCAN <table>``, so a
+    dropped or unusable index shows up here rather than in production.
+    Endpoints that legitimately read a whole table list it in ``allow``.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.borrower = make_user('borrower')
+        UserProfile.objects.create(user=cls.owner, location='Oslo')
+        UserProfile.objects.create(user=cls.borrower)
+        cls.book = make_book(cls.owner, 'The Shadow of the Wind', author='Carlos Ruiz Zafon')
+        cls.lent_book = make_book(
+            cls.owner, 'War and Peace', author='Leo Tolstoy', isbn='9780199232765',
+            genre='Classics', condition='fair', lending_type='both', availability='borrowed',
+        )
+        cls.pending = BookRequest.objects.create(book=cls.book, requester=cls.borrower, request_type='borrow')
+        accepted = BookRequest.objects.create(
+            book=cls.lent_book, requester=cls.borrower, request_type='borrow', status='accepted'
+        )
+        cls.loan = BookLoan.objects.create(book_request=accepted, due_date=timezone.now().date() + timedelta(days=14))
+        cls.wish = Wishlist.objects.create(user=cls.borrower, title='Anna Karenina', author='Tolstoy')
+
+    def setUp(self):
+        super().setUp()
+        trigram_index.load()
+
+    def login(self, user):
+        token, created = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def assertIndexed(self, method, url, data=None, allow=(), status_code=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data, format='json')
+        if status_code is not None:
+            self.assertEqual(response.status_code, status_code, response.content)
+        else:
+            self.assertLess(response.status_code, 400, response.content)
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            scans = [scan for scan in full_scans(sql) if SCAN.match(scan).group(1) not in allow]
+            self.assertEqual(scans, [], f'{method.upper()} {url} full scan in:\n{sql}')
+        return response
+
+    # Books
+
+    def test_book_list(self):
+        self.assertIndexed('get', '/api/books/', allow=['books_book'])
+
+    def test_book_list_cursor(self):
+        self.assertIndexed('get', '/api/books/', {'paginate': 'cursor'})
+
+    def test_book_detail(self):
+        self.assertIndexed('get', f'/api/books/{self.book.id}/')
+
+    def test_book_create_update_delete(self):
+        self.login(self.owner)
+        self.assertIndexed('post', '/api/books/', {
+            'title': 'Dune', 'author': 'Frank Herbert', 'genre': 'Science Fiction',
+        }, allow=BOOK_WRITE_SCANS)
+        book = Book.objects.get(title='Dune')
+        self.assertIndexed('put', f'/api/books/{book.id}/', {
+            'title': 'Dune Messiah', 'author': 'Frank Herbert', 'genre': 'Science Fiction',
+        }, allow=BOOK_WRITE_SCANS)
+        self.assertIndexed('delete', f'/api/books/{book.id}/')
+
+    def test_available(self):
+        self.login(self.borrower)
+        self.assertIndexed('get', '/api/books/available/')
+
+    def test_genres(self):
+        self.assertIndexed('get', '/api/books/genres/')
+
+    def test_toggle_availability(self):
+        self.login(self.owner)
+        self.assertIndexed('post', f'/api/books/{self.book.id}/toggle_availability/')
+
+    def test_my_books(self):
+        self.login(self.owner)
+        self.assertIndexed('get', '/api/books/my_books/')
+        self.assertIndexed('get', '/api/books/my_books/', {'paginate': 'cursor'})
+
+    def test_search(self):
+        self.login(self.borrower)
+        self.assertIndexed('get', '/api/books/search/', {'q': 'shadow', 'genre': 'fiction', 'condition': 'good'})
+        self.assertIndexed('get', '/api/books/search/', {'q': 'shadw', 'fuzzy': 'true'})
+        self.assertIndexed('get', '/api/books/search/', {'q': 'shadow', 'facets': 'true'})
+        self.assertIndexed('get', '/api/books/search/', {'near': '59.9,10.7', 'radius_km': 30})
+        self.assertIndexed('get', '/api/books/search/', {'near': '59.9,10.7', 'radius_km': 500})
+        self.assertIndexed('get', '/api/books/search/', {'q': '0-306-40615-2'})
+
+    def test_book_info_without_isbn(self):
+        self.assertIndexed('get', f'/api/books/{self.book.id}/book_info_api/', status_code=404)
+
+    def test_featured(self):
+        self.assertIndexed('get', '/api/books/featured/')
+        self.assertIndexed('get', '/api/featured-books/')
+        rank_featured_books()
+        self.assertIndexed('get', '/api/books/featured/')
+        self.assertIndexed('get', '/api/featured-books/')
+
+    # Requests
+
+    def test_create_request(self):
+        self.login(self.borrower)
+        self.assertIndexed('post', '/api/requests/', {'book': self.book.id, 'request_type': 'borrow'})
+        self.assertIndexed('post', '/api/book-request/', {'book': self.book.id})
+        # A borrowed book hands out a waitlist ticket instead
+        self.assertIndexed('post', '/api/requests/', {'book': self.lent_book.id, 'request_type': 'borrow'})
+        self.assertIndexed('get', '/api/requests/my_requests/', {'status': 'waitlisted'})
+
+    def test_my_requests(self):
+        self.login(self.borrower)
+        self.assertIndexed('get', '/api/requests/my_requests/')
+        self.assertIndexed('get', '/api/requests/my_requests/', {'status': 'pending', 'request_type': 'borrow'})
+        self.assertIndexed('get', '/api/requests/my_requests/', {'include_history': 'true'})
+
+    def test_incoming_requests(self):
+        self.login(self.owner)
+        self.assertIndexed('get', '/api/requests/incoming_requests/')
+
+    def test_changes(self):
+        self.assertIndexed('get', '/api/changes/', {'since': 0})
+        self.login(self.borrower)
+        self.assertIndexed('get', '/api/changes/', {'since': 0})
+
+    def test_dashboard(self):
+        cache.clear()
+        for user in (self.owner, self.borrower):
+            self.login(user)
+            self.assertIndexed('get', '/api/dashboard/')
+
+    def test_accept_request(self):
+        self.login(self.owner)
+        self.assertIndexed('post', f'/api/requests/{self.pending.id}/accept_request/')
+
+    def test_decline_request(self):
+        self.login(self.owner)
+        self.assertIndexed('post', f'/api/requests/{self.pending.id}/decline_request/')
+
+    # Loans
+
+    def test_my_loans(self):
+        self.login(self.borrower)
+        self.assertIndexed('get', '/api/loans/my_loans/')
+        self.assertIndexed('get', '/api/loans/my_loans/', {'include_history': 'true'})
+
+    def test_my_lent_books(self):
+        self.login(self.owner)
+        self.assertIndexed('get', '/api/loans/my_lent_books/')
+        self.assertIndexed('get', '/api/loans/my_lent_books/', {'include_history': 'true'})
+
+    def test_return_book(self):
+        self.login(self.borrower)
+        self.assertIndexed('post', f'/api/loans/{self.loan.id}/return_book/', {'rating': 5}, allow=BOOK_WRITE_SCANS)
+
+    def test_return_book_to_waitlist(self):
+        self.login(self.owner)
+        self.client.post('/api/requests/', {'book': self.lent_book.id, 'request_type': 'borrow'}, format='json')
+        self.login(self.borrower)
+        self.assertIndexed('post', f'/api/loans/{self.loan.id}/return_book/')
+
+    # Profiles, wishlist and the rest
+
+    def test_my_profile(self):
+        self.login(self.owner)
+        self.assertIndexed('get', '/api/profiles/my_profile/')
+
+    def test_update_user(self):
+        self.login(self.owner)
+        self.assertIndexed('put', '/api/auth/update-user/', {'bio': 'Reader', 'location': 'Bergen'})
+
+    def test_wishlist(self):
+        self.login(self.borrower)
+        self.assertIndexed('get', '/api/wishlist/')
+        self.assertIndexed('get', '/api/wishlist/with_availability/')
+        self.assertIndexed('post', f'/api/wishlist/{self.wish.id}/find_matches/')
+        self.assertIndexed('post', '/api/add-wishlist/', {'title': 'Dune', 'author': 'Frank Herbert'})
+
+    def test_auth(self):
+        self.assertIndexed('post', '/api/auth/register/', {
+            'username': 'newcomer', 'email': 'new@example.com',
+            'password': 'password123', 'password_confirm': 'password123',
+        })
+        # Email login looks up auth_user.email, which contrib.auth leaves unindexed
+        self.assertIndexed(
+            'post', '/api/auth/login/', {'username': 'owner@example.com', 'password': 'password123'},
+            allow=['auth_user'],
+        )
+        self.login(self.owner)
+        self.assertIndexed('post', '/api/auth/logout/')
+
+    def test_simple_book_creation(self):
+        self.login(self.owner)
+        self.assertIndexed(
+            'post', '/api/create-book-simple/', {'title': 'Emma', 'author': 'Jane Austen', 'genre': 'Classics'},
+            allow=BOOK_WRITE_SCANS,
+        )
+        self.assertIndexed(
+            'post', '/api/simple-add-book/', {'title': 'Persuasion', 'author': 'Jane Austen'},
+            allow=BOOK_WRITE_SCANS,
+        )
+
+    def test_statistics(self):
+        # Maintained counters: no catalog-wide counts
+        cache.clear()
+        self.assertIndexed('get', '/api/statistics/')
+        self.assertIndexed('get', '/api/test/', allow=['books_book'])
+
+
+class QueryBudgetTests(LendingTestCase):
+    """List endpoints must issue a fixed number of queries, however many
+    rows they return. Each endpoint is measured before and after the data
+    grows and must stay within its budget both times."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.borrower = make_user('borrower')
+        cls.tokens = {user.pk: Token.objects.create(user=user).key for user in (cls.owner, cls.borrower)}
+
+    def setUp(self):
+        super().setUp()
+        self.serial = 0
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[user.pk]}')
+
+    def add_rows(self, count):
+        """Grow every table the endpoints read: books of both users,
+        requests both ways, active loans both ways and wishlist items."""
+        for _ in range(count):
+            self.serial += 1
+            n = self.serial
+            owned = make_book(self.owner, f'Shadow Volume {n}', author='Carlos Ruiz Zafon')
+            lent = make_book(
+                self.owner, f'Kingdom {n}', author='Leo Tolstoy',
+                genre='Classics', condition='fair', lending_type='both', availability='borrowed',
+            )
+            make_book(
+                self.borrower, f'Shadow Garden {n}', author='Anna Lindgren', condition='new', lending_type='swapping'
+            )
+            BookRequest.objects.create(book=owned, requester=self.borrower, request_type='borrow')
+            accepted = BookRequest.objects.create(
+                book=lent, requester=self.borrower, request_type='borrow', status='accepted'
+            )
+            BookLoan.objects.create(book_request=accepted, due_date=timezone.now().date() + timedelta(days=14))
+            Wishlist.objects.create(user=self.borrower, title=f'Kingdom {n}', author='Tolstoy')
+            Wishlist.objects.create(user=self.borrower, title=f'Shadow Volume {n}', author='')
+
+    def count_queries(self, method, url, data=None):
+        # Warm up first so one-off work (index loads, cache fills) is not counted
+        getattr(self.client, method)(url, data)
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400, response.content)
+        return len(captured)
+
+    def assertQueryBudget(self, budget, method, url, data=None, user=None):
+        if user is not None:
+            self.login(user)
+        self.add_rows(2)
+        small = self.count_queries(method, url, data)
+        self.add_rows(8)
+        large = self.count_queries(method, url, data)
+        self.assertEqual(small, large, f'{method.upper()} {url} query count grows with the data')
+        self.assertLessEqual(large, budget, f'{method.upper()} {url} exceeds its query budget')
+
+    def test_book_list(self):
+        self.assertQueryBudget(1, 'get', '/api/books/')
+
+    def test_available(self):
+        self.assertQueryBudget(2, 'get', '/api/books/available/', user=self.borrower)
+
+    def test_search(self):
+        self.assertQueryBudget(2, 'get', '/api/books/search/', {'q': 'shadow'}, user=self.borrower)
+
+    def test_my_books(self):
+        self.assertQueryBudget(2, 'get', '/api/books/my_books/', user=self.owner)
+
+    def test_featured(self):
+        # One read of the ranking; before the first ranking the fallback adds one
+        self.assertQueryBudget(2, 'get', '/api/books/featured/')
+        rank_featured_books()
+        self.assertQueryBudget(1, 'get', '/api/books/featured/')
+        self.assertQueryBudget(1, 'get', '/api/featured-books/')
+
+    def test_my_loans(self):
+        self.assertQueryBudget(2, 'get', '/api/loans/my_loans/', user=self.borrower)
+
+    def test_my_lent_books(self):
+        self.assertQueryBudget(2, 'get', '/api/loans/my_lent_books/', user=self.owner)
+
+    def test_my_requests(self):
+        self.assertQueryBudget(2, 'get', '/api/requests/my_requests/', user=self.borrower)
+
+    def test_incoming_requests(self):
+        self.assertQueryBudget(2, 'get', '/api/requests/incoming_requests/', user=self.owner)
+
+    def test_dashboard(self):
+        self.assertQueryBudget(4, 'get', '/api/dashboard/', user=self.owner)
+
+    def test_wishlist_with_availability(self):
+        # Wishlist, ranked matches, then the books shown
+        self.assertQueryBudget(4, 'get', '/api/wishlist/with_availability/', user=self.borrower)
+
+
+class FullTextSearchTests(LendingTestCase):
+    def book(self, title, description='', **fields):
+        return make_book(self.owner, title, description=description, **{'author': 'Someone', **fields})
+
+    def matches(self, query):
+        return list(full_text_search(Book.objects.all(), query).values_list('title', flat=True))
+
+    def search(self, **params):
+        return [book['title'] for book in self.client.get('/api/books/search/', params).json()]
+
+    def test_index_follows_writes(self):
+        dune = self.book('Dune', 'Spice on Arrakis')
+        self.assertEqual(self.matches('arrakis'), ['Dune'])
+        dune.title = 'Dune Messiah'
+        dune.description = 'Twelve years later'
+        dune.save()
+        self.assertEqual(self.matches('arrakis'), [])
+        self.assertEqual(self.matches('messiah'), ['Dune Messiah'])
+        # Prefixes of partially typed words
+        self.assertEqual(self.matches('mess twel'), ['Dune Messiah'])
+        dune.delete()
+        self.assertEqual(self.matches('messiah'), [])
+
+    def test_title_hits_rank_first(self):
+        self.book('Moby Dick', 'A voyage across the ocean')
+        self.book('The Old Man and the Sea', 'An ocean story told twice: ocean, ocean')
+        self.book('Ocean at the End of the Lane')
+        self.assertEqual(self.search(q='ocean')[0], 'Ocean at the End of the Lane')
+        self.assertEqual(len(self.search(q='ocean')), 3)
+
+    def test_filters_still_apply(self):
+        self.book('Ocean Fiction', genre='Fiction')
+        self.book('Ocean Poems', genre='Poetry', author='Mary Oliver')
+        self.book('Ocean Worn', condition='poor')
+        self.book('Ocean Swap', lending_type='swapping')
+        self.book('Ocean Either', lending_type='both')
+        self.assertEqual(self.search(q='ocean', genre='poetry'), ['Ocean Poems'])
+        self.assertEqual(self.search(q='ocean', author='oliver'), ['Ocean Poems'])
+        self.assertEqual(self.search(q='ocean', condition='poor'), ['Ocean Worn'])
+        self.assertEqual(set(self.search(q='ocean', lending_type='swapping')), {'Ocean Swap', 'Ocean Either'})
+
+
+class TrigramIndexTests(TestCase):
+    ROWS = [
+        (1, 'War and Peace', 'Leo Tolstoy'),
+        (2, 'Anna Karenina', 'Leo Tolstoy'),
+        (3, 'The Shadow of the Wind', 'Carlos Ruiz Zafon'),
+    ]
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        now = timezone.now()
+        self.index.load([(*row, now) for row in self.ROWS])
+
+    def ids(self, text, **kwargs):
+        return [book_id for book_id, _ in self.index.search(text, **kwargs)]
+
+    def test_edit_retires_old_slot(self):
+        self.index.add(Book(pk=1, title='Resurrection', author='Leo Tolstoy', updated_at=timezone.now()))
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.ids('war and peace', fields=('title',)), [])
+        self.assertEqual(self.ids('resurection'), [1])
+        self.assertEqual(sorted(self.ids('tolstio', fields=('author',))), [1, 2])
+
+    def test_remove(self):
+        self.index.remove(2)
+        self.index.remove(99)
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.ids('anna karenina'), [])
+        self.assertEqual(self.ids('tolstio'), [1])
+
+    def test_compact_keeps_results(self):
+        for n in range(5):
+            self.index.add(Book(pk=3, title=f'Shadow of the Wind {n}', author='Zafon', updated_at=timezone.now()))
+        self.index.remove(2)
+        queries = ('shadw of the wind', 'tolstio', 'war and peace', 'zafon')
+        before = {query: self.index.search(query) for query in queries}
+        size = self.index.memory_usage()
+        self.index.compact()
+        self.assertEqual({query: self.index.search(query) for query in queries}, before)
+        self.assertLess(self.index.memory_usage(), size)
+
+    def test_threshold(self):
+        score = similarity('tolstio', 'Leo Tolstoy')
+        self.assertAlmostEqual(similarity('Leo Tolstoy', 'leo tolstoy'), 1.0)
+        self.assertEqual(sorted(self.ids('tolstio', threshold=score)), [1, 2])
+        self.assertEqual(self.ids('tolstio', threshold=score + 0.01), [])
+        self.assertEqual(len(self.ids('tolstio', limit=1)), 1)
+        self.assertEqual(self.ids('xyzzy'), [])
+
+    def test_sync_with_other_processes(self):
+        owner = make_user('owner')
+        dune, emma = make_book(owner, 'Dune'), make_book(owner, 'Emma', author='Jane Austen')
+        index = TrigramIndex()
+        index.load()
+        # UPDATEs skip the signals, as writes from another process would
+        Book.objects.filter(pk=dune.pk).update(title='Children of Dune', updated_at=timezone.now())
+        Book.objects.filter(pk=emma.pk).update(title='Persuasion', updated_at=emma.updated_at - timedelta(days=1))
+        self.assertEqual(index.search('children of dune'), [])
+        bump_catalog_version()
+        self.assertEqual([book_id for book_id, _ in index.search('children of dune')], [dune.pk])
+        # Older than the watermark: not picked up before the next full load
+        self.assertEqual(index.search('persuasion'), [])
+        index.load()
+        self.assertEqual([book_id for book_id, _ in index.search('persuasion')], [emma.pk])
+
+    def test_search_limit_counts_only_qualifying_books(self):
+        reader, owner = make_user('reader'), make_user('owner')
+        Book.objects.bulk_create(
+            [Book(owner=reader, title='Shadow of the Wind', author='Zafon') for _ in range(60)]
+            + [Book(owner=owner, title='Shadow of the Wind', author='Zafon', availability='borrowed')]
+        )
+        lendable = make_book(owner, 'The Shadow of the Wind', author='Zafon')
+        trigram_index.load()
+        client = APIClient()
+        client.force_authenticate(reader)
+        response = client.get('/api/books/search/', {'q': 'shadow of the wind', 'fuzzy': 'true'})
+        self.assertEqual([book['id'] for book in response.json()], [lendable.pk])
+
+
+class KeysetPaginationTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Book.objects.bulk_create([Book(owner=cls.owner, title=f'Book {n}', **BOOK_DEFAULTS) for n in range(7)])
+        # Ties on created_at are broken by id
+        Book.objects.update(created_at=timezone.now())
+
+    def test_walk_to_the_end(self):
+        params = {'paginate': 'cursor', 'page_size': 3}
+        seen, pages = [], 0
+        while True:
+            page = self.client.get('/api/books/', params).json()
+            seen += [book['id'] for book in page['results']]
+            pages += 1
+            if page['next_cursor'] is None:
+                self.assertIsNone(page['next'])
+                break
+            params['cursor'] = page['next_cursor']
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, list(Book.objects.order_by('-id').values_list('id', flat=True)))
+
+    def test_bad_cursor(self):
+        for cursor in ('not-a-cursor', 'bm9waXBl'):
+            response = self.client.get('/api/books/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_unpaginated_by_default(self):
+        response = self.client.get('/api/books/')
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual(len(response.json()), 7)
+
+
+class SparseFieldsetTests(LendingTestCase):
+    CARD = {'id', 'title', 'author', 'genre', 'availability', 'display_image', 'owner_name'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        make_book(cls.owner, genre='Science Fiction', description='Spice', book_photos=['dune.jpg'])
+
+    def fetch(self, params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/books/', params)
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(query['sql'] for query in captured.captured_queries)
+        return response.json()[0], sql
+
+    def test_fields(self):
+        book, sql = self.fetch({'fields': 'title,author'})
+        self.assertEqual(set(book), {'title', 'author'})
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"book_photos"', sql)
+        self.assertNotIn('"auth_user"', sql)
+
+    def test_omit(self):
+        book, sql = self.fetch({'omit': 'description,book_photos'})
+        self.assertNotIn('description', book)
+        self.assertNotIn('book_photos', book)
+        self.assertIn('owner_name', book)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"book_photos"', sql)
+
+    def test_card_preset(self):
+        book, sql = self.fetch({'fields': 'card'})
+        self.assertEqual(set(book), self.CARD)
+        self.assertEqual(book['owner_name'], 'owner')
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"book_photos"', sql)
+
+    def test_full_by_default(self):
+        book, sql = self.fetch({})
+        self.assertEqual(book['description'], 'Spice')
+        self.assertEqual(book['book_photos'], ['dune.jpg'])
+        self.assertIn('"description"', sql)
+        self.assertIn('"book_photos"', sql)
+
+
+class CatalogCacheTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for title, genre, condition, lending_type, availability in (
+            ('Dune', 'Science Fiction', 'good', 'lending', 'available'),
+            ('Hyperion', 'science fiction', 'fair', 'both', 'available'),
+            ('Solaris', 'Science Fiction', 'good', 'swapping', 'available'),
+            ('Foundation', 'Science Fiction', 'good', 'lending', 'borrowed'),
+            ('Emma', 'Classics', 'good', 'lending', 'available'),
+        ):
+            make_book(
+                cls.owner, title, genre=genre, condition=condition, lending_type=lending_type, availability=availability
+            )
+
+    def book(self, title, genre, **fields):
+        return make_book(self.owner, title, genre=genre, **fields)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def facets(self, **params):
+        return self.client.get('/api/books/search/', {'facets': 'true', **params}).json()
+
+    def test_facet_counts(self):
+        result = self.facets(genre='science fiction', condition='good')
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(result['facets'], {
+            'genre': [{'value': 'Science Fiction', 'count': 2}],
+            'condition': [{'value': 'good', 'count': 2}],
+            'lending_type': [{'value': 'lending', 'count': 1}, {'value': 'swapping', 'count': 1}],
+            'availability': [{'value': 'available', 'count': 2}, {'value': 'borrowed', 'count': 1}],
+        })
+
+    def test_genre_normalization(self):
+        spaced = self.book('Ubik', ' science   fiction ')
+        typed = self.book('Neuromancer', 'SCIENCE Fiction')
+        # Each book keeps its own spelling; both share one Genre
+        self.assertEqual(self.client.get(f'/api/books/{spaced.id}/').json()['genre'], 'science fiction')
+        self.assertEqual(self.client.get(f'/api/books/{typed.id}/').json()['genre'], 'SCIENCE Fiction')
+        self.assertEqual(spaced.genre_ref_id, typed.genre_ref_id)
+        self.assertEqual(Genre.objects.get(pk=spaced.genre_ref_id).name, 'Science Fiction')
+        titles = {book['title'] for book in self.client.get('/api/books/search/', {'genre': 'science  FICTION'}).json()}
+        self.assertEqual(titles, {'Dune', 'Hyperion', 'Solaris', 'Ubik', 'Neuromancer'})
+
+    def test_genres(self):
+        self.assertEqual(self.client.get('/api/books/genres/').json(), ['Classics', 'Science Fiction'])
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get('/api/books/genres/')
+        self.assertEqual(len(captured), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book('Beowulf', '  epic poetry')
+        self.assertEqual(self.client.get('/api/books/genres/').json(), ['Classics', 'epic poetry', 'Science Fiction'])
+
+    def test_genre_named_by_owners(self):
+        def names():
+            return self.client.get('/api/books/genres/').json()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book('Twilight', 'ya')
+            self.book('Holes', 'Sci-Fi')
+        self.assertEqual(names(), ['Classics', 'Sci-Fi', 'Science Fiction', 'ya'])
+        # The most common spelling wins whichever came first; ties sort
+        with self.captureOnCommitCallbacks(execute=True):
+            wonder = self.book('Wonder', 'YA')
+        self.assertIn('YA', names())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book('Eragon', 'ya')
+        self.assertIn('ya', names())
+        with self.captureOnCommitCallbacks(execute=True):
+            wonder.genre = 'ya'
+            wonder.save()
+            Book.objects.get(title='Twilight').delete()
+            Book.objects.get(title='Eragon').delete()
+        self.assertEqual(Genre.objects.get(key='ya').name, 'ya')
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.get(title='Wonder').delete()
+            self.book('Matilda', 'YA')
+        self.assertEqual(Genre.objects.get(key='ya').name, 'YA')
+        facets = self.facets(genre='ya')['facets']['genre']
+        self.assertEqual(facets, [{'value': 'YA', 'count': 1}])
+
+    def test_facets_cached_until_write(self):
+        first = self.facets(genre='classics')
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.facets(genre='classics'), first)
+        self.assertEqual(len(captured), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book('Persuasion', 'Classics', condition='fair')
+        self.assertEqual(self.facets(genre='classics')['total'], first['total'] + 1)
+
+    def test_version_moves_on_commit(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                make_book(self.owner)
+                # Readers inside the window must not cache under a new version
+                self.assertEqual(catalog_version(), version)
+        self.assertNotEqual(catalog_version(), version)
+
+
+class ConditionalRequestTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.book = make_book(cls.owner)
+
+    def test_not_modified_skips_work(self):
+        first = self.client.get('/api/books/')
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        with mock.patch.object(BookSerializer, 'to_representation') as serialize:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(captured), 0)
+        serialize.assert_not_called()
+        modified = self.client.get('/api/books/available/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(modified.status_code, 304)
+
+    def test_validators_change(self):
+        etag = self.client.get('/api/featured-books/')['ETag']
+        # Per path and per user
+        self.assertNotEqual(self.client.get('/api/featured-books/', {'fields': 'card'})['ETag'], etag)
+        self.client.force_authenticate(self.owner)
+        self.assertNotEqual(self.client.get('/api/featured-books/')['ETag'], etag)
+        self.client.force_authenticate(None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(self.owner)
+            self.client.patch(f'/api/books/{self.book.id}/', {'title': 'Dune Messiah'})
+            self.client.force_authenticate(None)
+        response = self.client.get('/api/featured-books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['title'], 'Dune Messiah')
+
+    def test_validators_expire(self):
+        # A write in another worker never bumps this process's version
+        first = self.client.get('/api/books/')
+        Book.objects.filter(pk=self.book.pk).update(title='Dune Messiah')
+        self.assertEqual(self.client.get('/api/books/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        later = time.time() + VERSION_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()[0]['title'], 'Dune Messiah')
+            modified = self.client.get('/api/books/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+            self.assertEqual(modified.status_code, 200)
+
+
+class NearSearchTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = make_user('reader')
+        UserProfile.objects.create(user=cls.reader, location='Oslo')
+        for city in ('Oslo', 'Bergen', 'Stockholm', 'Tokyo'):
+            owner = make_user(city.lower())
+            UserProfile.objects.create(user=owner, location=city)
+            make_book(owner, f'Book in {city}')
+
+    def near(self, **params):
+        response = self.client.get('/api/books/search/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(book['title'], round(book['distance_km'])) for book in response.json()]
+
+    def test_nearest_first_within_radius(self):
+        # Oslo-Bergen is about 305 km, Oslo-Stockholm about 417 km
+        self.assertEqual(self.near(near='59.91,10.75', radius_km=350), [('Book in Oslo', 0), ('Book in Bergen', 305)])
+        self.assertEqual(
+            [title for title, _ in self.near(near='59.91,10.75', radius_km=500)],
+            ['Book in Oslo', 'Book in Bergen', 'Book in Stockholm'],
+        )
+        self.assertEqual(self.near(near='59.91,10.75', radius_km=500, limit=1), [('Book in Oslo', 0)])
+
+    def test_near_me(self):
+        self.client.force_authenticate(self.reader)
+        self.assertEqual([title for title, _ in self.near(near='me', radius_km=50)], ['Book in Oslo'])
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/books/search/', {'near': 'me'}).status_code, 400)
+
+    def test_bad_radius(self):
+        for radius in ('nan', 'inf', 'wide'):
+            response = self.client.get('/api/books/search/', {'near': '59.91,10.75', 'radius_km': radius})
+            self.assertEqual(response.status_code, 400)
+
+    def test_location_change_geocodes_again(self):
+        def located(profile):
+            profile.refresh_from_db()
+            return round(profile.latitude), round(profile.longitude), profile.geo_cell
+
+        profile = UserProfile.objects.get(user=self.reader)
+        self.client.force_authenticate(self.reader)
+        response = self.client.patch(f'/api/profiles/{profile.id}/', {'location': 'Tokyo'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(located(profile), (36, 140, cell_for(35.68, 139.69)))
+
+        profile.location = 'Bergen'
+        profile.save()
+        self.assertEqual(located(profile)[:2], (60, 5))
+        profile.location = 'Nowhere in particular'
+        profile.save()
+        profile.refresh_from_db()
+        self.assertEqual((profile.latitude, profile.longitude, profile.geo_cell), (None, None, None))
+
+        # Coordinates given with the new location are kept
+        profile.location, profile.latitude, profile.longitude = 'Cabin', 61.5, 9.0
+        profile.save()
+        self.assertEqual(located(profile)[:2], (62, 9))
+        profile.bio = 'Reads a lot'
+        profile.save()
+        self.assertEqual(located(profile)[:2], (62, 9))
+
+    def test_every_radius_narrows_by_cell(self):
+        # The largest allowed radius is still a few dozen index ranges
+        self.assertLessEqual(len(cell_ranges(60, 10, 500)), 40)
+        self.assertEqual(len(cell_ranges(89, 0, 500)), 1)
+        lon = 179.9
+        ranges = cell_ranges(0, lon, 50)
+        for east, west in ((0, lon), (0, -179.9)):
+            cell = cell_for(east, west)
+            self.assertTrue(any(first <= cell <= last for first, last in ranges))
+        self.assertFalse(any(first <= cell_for(0, 0) <= last for first, last in ranges))
+
+
+class WishlistMatchTests(LendingTestCase):
+    """The stored matches must equal what a full recomputation finds after
+    every kind of write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = make_user('reader')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+        self.wish = Wishlist.objects.create(user=self.reader, title='Shadow of the Wind', author='')
+        self.by_author = Wishlist.objects.create(user=self.reader, title='Anything', author='Tolstoy')
+
+    def book(self, title, author='Someone', owner=None, **fields):
+        return make_book(owner or self.owner, title, author=author, **fields)
+
+    def matches(self):
+        return set(WishlistMatch.objects.values_list('wishlist_id', 'book_id'))
+
+    def assertMatches(self, expected):
+        self.assertEqual(self.matches(), expected)
+        rebuild_matches()
+        self.assertEqual(self.matches(), expected, 'rebuild disagrees with incremental maintenance')
+
+    def test_book_writes(self):
+        book = self.book('The Shadow of the Wind')
+        other = self.book('War and Peace', author='Leo Tolstoy')
+        self.book('The shadow of the wind', owner=self.reader)
+        self.assertMatches({(self.wish.pk, book.pk), (self.by_author.pk, other.pk)})
+
+        book.availability = 'borrowed'
+        book.save()
+        other.title, other.author = 'Anna Karenina', 'Anon'
+        other.save()
+        self.assertMatches(set())
+
+        book.availability = 'available'
+        book.save(update_fields=['availability'])
+        self.assertMatches({(self.wish.pk, book.pk)})
+
+        book.delete()
+        self.assertMatches(set())
+
+    def test_wishlist_writes(self):
+        book = self.book('Dune Messiah', author='Frank Herbert')
+        response = self.client.post('/api/add-wishlist/', {'title': 'dune', 'author': ''})
+        wish = Wishlist.objects.get(pk=response.json()['id'])
+        self.assertMatches({(wish.pk, book.pk)})
+
+        wish.title = 'Children of Dune'
+        wish.save()
+        self.assertMatches(set())
+
+    def test_isbn(self):
+        book = self.book('Untitled', isbn='0306406152')
+        wish = Wishlist.objects.create(user=self.reader, title='Something else', isbn='978-0-306-40615-7')
+        self.assertMatches({(wish.pk, book.pk)})
+
+        book.isbn = ''
+        book.save()
+        self.assertMatches(set())
+
+    def test_find_matches_ranking(self):
+        wish = Wishlist.objects.create(user=self.reader, title='War and Peace', author='Tolstoy', isbn='0140447938')
+        author_only = self.book('Anna Karenina', author='Leo Tolstoy')
+        fuzzy_title = self.book('War and Paece', author='Anon')
+        title_only = self.book('War and Peace', author='Someone Else', condition='poor')
+        better_condition = self.book('War and Peace', author='Someone Else', condition='new')
+        both = self.book('War and Peace', author='Leo Tolstoy')
+        isbn = self.book('Voina i mir', author='L. N. Tolstoi', isbn='978-0-14-044793-4')
+        self.book('Dune', author='Frank Herbert')
+        trigram_index.load()
+
+        url = f'/api/wishlist/{wish.id}/find_matches/'
+        expected = [isbn, both, better_condition, title_only, fuzzy_title, author_only]
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url).json()
+        self.assertEqual([book['id'] for book in response['matching_books']], [book.id for book in expected])
+        self.assertEqual(
+            [book['match_type'] for book in response['matching_books']],
+            ['isbn', 'title_author', 'title', 'title', 'title', 'author'],
+        )
+        self.assertEqual(response['count'], 6)
+        self.assertLessEqual(len(captured), 4)
+
+        response = self.client.post(url + '?page=2&page_size=4').json()
+        self.assertEqual([book['id'] for book in response['matching_books']], [fuzzy_title.id, author_only.id])
+        self.assertFalse(response['has_next'])
+
+
+class ISBNTests(TestCase):
+    def test_canonical_isbn13(self):
+        for value in ('0306406152', '0-306-40615-2', '978-0-306-40615-7', ' 9780306406157 '):
+            self.assertEqual(to_isbn13(value), '9780306406157')
+        self.assertEqual(to_isbn13('080442957x'), '9780804429573')
+        for value in ('', '0306406153', '9780306406158', '12345', 'not an isbn'):
+            self.assertIsNone(to_isbn13(value))
+
+    def test_write_and_search(self):
+        owner, reader = make_user('owner'), make_user('reader')
+        client = APIClient()
+        client.force_authenticate(owner)
+        book_data = {'title': 'Dune', 'author': 'Frank Herbert', 'genre': 'Fiction'}
+        response = client.post('/api/books/', {**book_data, 'isbn': '0-441-17271-8'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/api/books/', {**book_data, 'isbn': '0-441-17271-7'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        book = Book.objects.get()
+        self.assertEqual((book.isbn, book.isbn13), ('0441172717', '9780441172719'))
+
+        client.force_authenticate(reader)
+        for query in ('978-0-441-17271-9', '0441172717'):
+            results = client.get('/api/books/search/', {'q': query}).json()
+            self.assertEqual([result['id'] for result in results], [book.id])
+
+
+class TransitionTests(LendingTestCase):
+    """Accept, decline and return are compare-and-set: a stale caller gets
+    an error and changes nothing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.first, cls.second = make_user('first'), make_user('second')
+
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(self.owner)
+        self.requests = [
+            BookRequest.objects.create(book=self.book, requester=user, request_type='borrow')
+            for user in (self.first, self.second)
+        ]
+        self.client.force_authenticate(self.owner)
+
+    def accept(self, book_request):
+        return self.client.post(f'/api/requests/{book_request.id}/accept_request/')
+
+    def test_accept_once(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.accept(self.requests[0]).status_code, 200)
+        self.assertNotEqual(catalog_version(), version)
+        # A double submit and a competing accept both lose
+        self.assertEqual(self.accept(self.requests[0]).json()['error'], 'Request is no longer pending')
+        self.assertEqual(self.accept(self.requests[1]).json()['error'], 'Request is no longer pending')
+        self.assertEqual(
+            list(BookRequest.objects.order_by('id').values_list('status', flat=True)), ['accepted', 'waitlisted']
+        )
+        self.assertEqual(BookLoan.objects.count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.availability, 'borrowed')
+
+    def test_failed_accept_rolls_back(self):
+        Book.objects.filter(pk=self.book.pk).update(availability='unavailable')
+        self.assertEqual(self.accept(self.requests[0]).json()['error'], 'Book is no longer available')
+        self.assertEqual(BookRequest.objects.filter(status='pending').count(), 2)
+        self.assertFalse(BookLoan.objects.exists())
+
+    def test_decline_and_return(self):
+        response = self.client.post(f'/api/requests/{self.requests[1].id}/decline_request/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/requests/{self.requests[1].id}/decline_request/')
+        self.assertEqual(response.status_code, 400)
+
+        self.accept(self.requests[0])
+        loan = BookLoan.objects.get()
+        self.client.force_authenticate(self.first)
+        response = self.client.post(f'/api/loans/{loan.id}/return_book/', {'rating': 9})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'/api/loans/{loan.id}/return_book/', {'rating': 4, 'review': 'Great'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post(f'/api/loans/{loan.id}/return_book/').status_code, 400)
+        loan.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual((loan.returned, loan.rating, self.book.availability), (True, 4, 'available'))
+        self.assertEqual(BookRequest.objects.get(pk=self.requests[0].pk).status, 'completed')
+
+    def test_toggle_availability(self):
+        def toggle():
+            return self.client.post(f'/api/books/{self.book.id}/toggle_availability/')
+
+        def available_books():
+            return StatCounter.objects.get(name='available_books').value
+
+        counted = available_books()
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(toggle().json(), {'status': 'Book marked as unavailable'})
+        self.assertNotEqual(catalog_version(), version)
+        self.assertEqual(available_books(), counted - 1)
+        self.assertEqual(toggle().json(), {'status': 'Book marked as available'})
+        self.assertEqual(available_books(), counted)
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(kind='book', object_id=self.book.pk).values_list(
+                'data__availability', flat=True
+            ).order_by('id'))[-2:],
+            ['unavailable', 'available'],
+        )
+
+        # A lent book stays lent and is not counted twice
+        self.accept(self.requests[0])
+        response = toggle()
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Book is out on loan'))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.availability, 'borrowed')
+        self.assertEqual(available_books(), counted - 1)
+
+
+class MyRequestsTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = make_user('reader')
+        book = make_book(cls.owner, lending_type='both')
+        for n in range(5):
+            BookRequest.objects.create(
+                book=book, requester=cls.reader, request_type='swap' if n % 2 else 'borrow',
+                status='declined' if n < 2 else 'pending',
+            )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+
+    def test_pages(self):
+        response = self.client.get('/api/requests/my_requests/', {'page_size': 3})
+        first = response.json()
+        self.assertEqual(len(first['results']), 3)
+        self.assertEqual(first['results'][0]['book_title'], 'Dune')
+        self.assertEqual(first['results'][0]['owner_name'], 'owner')
+        rest = self.client.get(first['next']).json()
+        self.assertIsNone(rest['next'])
+        ids = [row['id'] for row in first['results'] + rest['results']]
+        self.assertEqual(ids, sorted(BookRequest.objects.values_list('id', flat=True), reverse=True))
+
+    def test_filters(self):
+        rows = self.client.get('/api/requests/my_requests/', {'status': 'pending', 'request_type': 'borrow'}).json()
+        self.assertEqual([(row['status'], row['request_type']) for row in rows['results']], [('pending', 'borrow')] * 2)
+        self.assertEqual(self.client.get('/api/requests/my_requests/', {'status': 'lost'}).status_code, 400)
+
+
+class ArchiveTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = make_user('reader')
+        cls.book = make_book(cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+        self.declined, self.completed, self.lent, self.pending, self.recent = (
+            BookRequest.objects.create(book=self.book, requester=self.reader, request_type='borrow', status=status)
+            for status in ('declined', 'completed', 'accepted', 'pending', 'declined')
+        )
+        due = timezone.localdate()
+        self.returned = BookLoan.objects.create(book_request=self.completed, due_date=due, returned=True, rating=5)
+        LoanReminder.objects.create(loan=self.returned, recipient=self.reader, kind='overdue')
+        BookLoan.objects.create(book_request=self.lent, due_date=due)
+        old = timezone.now() - timedelta(days=100)
+        BookRequest.objects.exclude(pk=self.recent.pk).update(updated_at=old)
+        reconcile_counters()
+
+    def test_archive(self):
+        self.assertEqual(archive_history(timezone.now() - timedelta(days=30), batch_size=1), (2, 1))
+        self.assertEqual(
+            set(ArchivedBookRequest.objects.values_list('id', flat=True)), {self.declined.id, self.completed.id}
+        )
+        self.assertEqual(ArchivedBookLoan.objects.get().id, self.returned.id)
+        self.assertEqual(
+            set(BookRequest.objects.values_list('id', flat=True)), {self.lent.id, self.pending.id, self.recent.id}
+        )
+        self.assertFalse(LoanReminder.objects.exists())
+        # Moving history does not change the book's counters
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.request_count, self.book.rating_count), (5, 1))
+        self.assertEqual(reconcile_counters(), 0)
+        self.assertEqual(archive_history(timezone.now()), (1, 0))
+
+    def test_history_reads(self):
+        archive_history(timezone.now() - timedelta(days=30))
+        live = self.client.get('/api/requests/my_requests/').json()['results']
+        self.assertEqual(len(live), 3)
+        first = self.client.get('/api/requests/my_requests/', {'include_history': 'true', 'page_size': 4}).json()
+        rest = self.client.get(first['next']).json()
+        rows = first['results'] + rest['results']
+        self.assertEqual([row['id'] for row in rows], sorted(BookRequest.objects.values_list('id', flat=True).union(
+            ArchivedBookRequest.objects.values_list('id', flat=True)), reverse=True))
+        self.assertEqual({row['id'] for row in rows if row['archived']}, {self.declined.id, self.completed.id})
+
+        self.assertEqual(len(self.client.get('/api/loans/my_loans/').json()), 1)
+        loans = self.client.get('/api/loans/my_loans/', {'include_history': 'true'}).json()
+        self.assertEqual([(loan['id'], loan.get('archived')) for loan in loans][1:], [(self.returned.id, True)])
+        self.assertEqual(loans[1]['book_title'], 'Dune')
+
+
+class DashboardTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.readers = [make_user(f'reader{n}') for n in range(2)]
+
+    def setUp(self):
+        super().setUp()
+        # Primary keys repeat across tests; cached summaries must not
+        cache.clear()
+        self.dune, self.emma, self.lent = (
+            make_book(self.owner, title, availability=availability)
+            for title, availability in (('Dune', 'available'), ('Emma', 'available'), ('Ulysses', 'borrowed'))
+        )
+        self.requests = [
+            BookRequest.objects.create(book=self.dune, requester=reader, request_type='borrow') for reader in self.readers
+        ]
+        late = BookRequest.objects.create(book=self.lent, requester=self.readers[0], request_type='borrow', status='accepted')
+        BookLoan.objects.create(book_request=late, due_date=timezone.localdate() - timedelta(days=2))
+
+    def summary(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/dashboard/').json()
+
+    def test_counts(self):
+        self.assertEqual(self.summary(self.owner), {
+            'owned': 3, 'available': 2, 'borrowed': 1, 'pending_incoming': 2, 'pending_outgoing': 0, 'waitlisted': 0,
+            'active_loans': 0, 'overdue': 0, 'lent_out': 1,
+        })
+        self.assertEqual(self.summary(self.readers[0]), {
+            'owned': 0, 'available': 0, 'borrowed': 0, 'pending_incoming': 0, 'pending_outgoing': 1, 'waitlisted': 0,
+            'active_loans': 1, 'overdue': 1, 'lent_out': 0,
+        })
+
+    def test_cached_until_touched(self):
+        before = {user.pk: self.summary(user) for user in (self.owner, *self.readers)}
+        with CaptureQueriesContext(connection) as captured:
+            self.summary(self.owner)
+        self.assertEqual(len(captured), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(self.owner)
+            self.client.post(f'/api/requests/{self.requests[0].id}/accept_request/')
+        owner, first, second = (self.summary(user) for user in (self.owner, *self.readers))
+        self.assertEqual((owner['pending_incoming'], owner['lent_out']), (0, 2))
+        self.assertEqual(first['active_loans'], before[self.readers[0].pk]['active_loans'] + 1)
+        # The waitlisted sibling's counts move too
+        self.assertEqual((second['pending_outgoing'], second['waitlisted']), (0, 1))
+
+        self.client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/create-book-simple/', {'title': 'Emma', 'author': 'Jane Austen', 'genre': 'Fiction'})
+        self.assertEqual(self.summary(self.owner)['owned'], 4)
+
+
+class ChangeFeedTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader, cls.stranger = make_user('reader'), make_user('stranger')
+
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(self.owner)
+        self.request = BookRequest.objects.create(book=self.book, requester=self.reader, request_type='borrow')
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{self.request.id}/accept_request/')
+
+    def feed(self, user, **params):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/changes/', params).json()
+
+    def changes(self, user, since=0):
+        return [(c['kind'], c['action'], c['data']) for c in self.feed(user, since=since, limit=500)['changes']]
+
+    def test_audiences(self):
+        book = [('book', 'created', {'availability': 'available'}), ('book', 'updated', {'availability': 'borrowed'})]
+        self.assertEqual(self.changes(self.stranger), book)
+        reader = self.changes(self.reader)
+        self.assertEqual([change for change in reader if change[0] == 'book'], book)
+        self.assertEqual([change for change in reader if change[0] != 'book'], [
+            ('request', 'created', {'status': 'pending'}),
+            ('loan', 'created', {'returned': False, 'overdue': False}),
+            ('request', 'updated', {'status': 'accepted'}),
+        ])
+        self.assertEqual(self.changes(self.owner), reader)
+
+    def test_pages(self):
+        first = self.feed(self.reader, since=0, limit=2)
+        self.assertEqual((len(first['changes']), first['has_more'], first['reset']), (2, True, False))
+        rest = self.feed(self.reader, since=first['next_since'], limit=10)
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(len(first['changes']) + len(rest['changes']), 5)
+        self.assertEqual(self.feed(self.reader, since=rest['next_since'])['changes'], [])
+
+    def test_rolled_back_change_is_not_logged(self):
+        count = ChangeLogEntry.objects.count()
+        second = BookRequest.objects.create(book=self.book, requester=self.stranger, request_type='borrow')
+        BookRequest.objects.filter(pk=second.pk).update(status='pending')
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(f'/api/requests/{second.id}/accept_request/')
+        self.assertEqual(response.status_code, 400)
+        # Only the request's own creation made it in
+        self.assertEqual(ChangeLogEntry.objects.count(), count + 2)
+
+    def test_delete_user(self):
+        Wishlist.objects.create(user=self.reader, title='Anna Karenina', author='Tolstoy')
+        emma = make_book(self.reader, 'Emma', author='Jane Austen')
+        BookRequest.objects.create(book=emma, requester=self.stranger, request_type='borrow')
+        self.reader.delete()
+        self.assertFalse(User.objects.filter(username='reader').exists())
+        # The other parties still hear about the cascade
+        owner = [change[:2] for change in self.changes(self.owner)]
+        self.assertIn(('loan', 'deleted'), owner)
+        self.assertIn(('request', 'deleted'), owner)
+        self.assertIn(('request', 'deleted', {'status': 'pending'}), self.changes(self.stranger))
+        self.owner.delete()
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['stranger'])
+
+    def test_compaction(self):
+        self.assertEqual(compact(timezone.now() - timedelta(days=1)), (3, 0))
+        # The book's created entry and both copies of the pending request are superseded
+        self.assertEqual(self.changes(self.reader), [
+            ('loan', 'created', {'returned': False, 'overdue': False}),
+            ('request', 'updated', {'status': 'accepted'}),
+            ('book', 'updated', {'availability': 'borrowed'}),
+        ])
+        head = ChangeLogEntry.objects.latest('id').id
+        self.assertEqual(compact(timezone.now() + timedelta(seconds=1)), (0, 5))
+        behind = self.feed(self.reader, since=0)
+        self.assertEqual((behind['reset'], behind['next_since'], behind['changes']), (True, head, []))
+        self.assertEqual(self.feed(self.reader, since=head)['reset'], False)
+
+
+class BookCounterTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.readers = [make_user(f'reader{n}') for n in range(2)]
+
+    def setUp(self):
+        super().setUp()
+        self.books = [make_book(self.owner, title) for title in ('Dune', 'Children of Dune')]
+
+    def counters(self, book):
+        book.refresh_from_db()
+        return (book.request_count, book.loan_count, book.rating_sum, book.rating_count)
+
+    def test_lifecycle(self):
+        dune = self.books[0]
+        for reader in self.readers:
+            self.client.force_authenticate(reader)
+            self.client.post('/api/requests/', {'book': dune.id, 'request_type': 'borrow'})
+        self.assertEqual(self.counters(dune), (2, 0, 0, 0))
+
+        self.client.force_authenticate(self.owner)
+        first = BookRequest.objects.filter(book=dune).order_by('id').first()
+        self.client.post(f'/api/requests/{first.id}/accept_request/')
+        self.assertEqual(self.counters(dune), (2, 1, 0, 0))
+        self.client.post(f'/api/loans/{first.bookloan.id}/return_book/', {'rating': 4})
+        self.assertEqual(self.counters(dune), (2, 2, 4, 1))
+        self.assertEqual(self.client.get(f'/api/books/{dune.id}/').json()['average_rating'], 4.0)
+
+        BookRequest.objects.filter(book=dune).exclude(pk=first.pk).get().delete()
+        self.assertEqual(self.counters(dune)[0], 1)
+
+    def test_owner_edit_keeps_counters(self):
+        dune = self.books[0]
+        stale = Book.objects.get(pk=dune.pk)
+        for reader in self.readers:
+            BookRequest.objects.create(book=dune, requester=reader, request_type='borrow')
+        stale.description = 'Desert planet'
+        stale.save()
+        self.client.force_authenticate(self.owner)
+        self.client.put(f'/api/books/{dune.id}/', {'title': 'Dune', 'author': 'Frank Herbert', 'genre': 'Fiction'})
+        BookRequest.objects.create(book=dune, requester=self.readers[0], request_type='swap')
+        self.assertEqual(self.counters(dune), (3, 0, 0, 0))
+        self.assertEqual(dune.description, 'Desert planet')
+
+    def test_featured_order(self):
+        # Before the first ranking, featured falls back to the stored request counts
+        dune, children = self.books
+        for reader in self.readers:
+            BookRequest.objects.create(book=children, requester=reader, request_type='borrow')
+        titles = [book['title'] for book in self.client.get('/api/books/featured/').json()]
+        self.assertEqual(titles, ['Children of Dune', 'Dune'])
+
+    def test_reconcile(self):
+        dune, children = self.books
+        BookRequest.objects.bulk_create(
+            [BookRequest(book=dune, requester=reader, request_type='borrow') for reader in self.readers]
+        )
+        Book.objects.filter(pk=children.pk).update(request_count=5, rating_count=1)
+        self.assertEqual(reconcile_counters(), 2)
+        self.assertEqual(self.counters(dune), (2, 0, 0, 0))
+        self.assertEqual(self.counters(children), (0, 0, 0, 0))
+        self.assertEqual(reconcile_counters(), 0)
+
+class BulkTransitionTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = make_user('other')
+        cls.readers = [make_user(f'reader{n}') for n in range(3)]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.owner)
+
+    def requests_for(self, book):
+        return [BookRequest.objects.create(book=book, requester=reader, request_type='borrow') for reader in self.readers]
+
+    def test_outcomes(self):
+        first, second, lent = make_book(self.owner), make_book(self.owner), make_book(self.owner, availability='borrowed')
+        a, b, c = self.requests_for(first)
+        d, e, _ = self.requests_for(second)
+        (f, *_) = self.requests_for(lent)
+        (foreign, *_) = self.requests_for(make_book(self.other))
+        actions = [
+            (a, 'accept'), (b, 'accept'), (c, 'decline'), (d, 'decline'), (e, 'accept'),
+            (f, 'accept'), (foreign, 'accept'), (a, 'decline'),
+        ]
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post('/api/requests/bulk/', {
+                'actions': [{'id': request.id, 'action': action} for request, action in actions]
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([result['outcome'] for result in response.json()['results']], [
+            'accepted', 'book_unavailable', 'declined', 'declined', 'accepted',
+            'book_unavailable', 'not_found', 'not_pending',
+        ])
+        # Read, then set-based writes: the query count does not grow per item
+        self.assertLessEqual(len(captured), 14)
+
+        statuses = dict(BookRequest.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[r.id] for r in (a, b, c, d, e, f, foreign)], [
+            'accepted', 'waitlisted', 'declined', 'declined', 'accepted', 'pending', 'pending',
+        ])
+        self.assertEqual(set(BookLoan.objects.values_list('book_request_id', flat=True)), {a.id, e.id})
+        self.assertEqual(
+            set(Book.objects.filter(availability='borrowed').values_list('id', flat=True)), {first.id, second.id, lent.id}
+        )
+
+    def test_validation(self):
+        for payload in ({}, {'actions': []}, {'actions': [{'id': 'x', 'action': 'accept'}]},
+                        {'actions': [{'id': 1, 'action': 'approve'}]}):
+            self.assertEqual(self.client.post('/api/requests/bulk/', payload, format='json').status_code, 400)
+
+
+class WaitlistTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.readers = [make_user(f'reader{n}') for n in range(4)]
+
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(self.owner)
+
+    def submit(self, reader):
+        self.client.force_authenticate(reader)
+        return self.client.post('/api/requests/', {'book': self.book.id, 'request_type': 'borrow'}).json()
+
+    def positions(self):
+        self.client.force_authenticate(None)
+        return {
+            reader.username: BookRequest.objects.filter(requester=reader, book=self.book).values_list(
+                transitions.queue_position(), flat=True
+            ).first()
+            for reader in self.readers[1:]
+        }
+
+    def test_queue(self):
+        first, second = (self.submit(reader) for reader in self.readers[:2])
+        self.assertEqual(first['status'], 'pending')
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{first["id"]}/accept_request/')
+        # The pending sibling joins the queue ahead of later requests
+        self.assertEqual(BookRequest.objects.get(pk=second['id']).status, 'waitlisted')
+        third, fourth = (self.submit(reader) for reader in self.readers[2:])
+        self.assertEqual((third['status'], third['queue_position'], fourth['queue_position']), ('waitlisted', 2, 3))
+
+        self.client.force_authenticate(self.readers[1])
+        page = self.client.get('/api/requests/my_requests/').json()['results']
+        self.assertEqual((page[0]['status'], page[0]['queue_position']), ('waitlisted', 1))
+
+        loan = BookLoan.objects.get(book_request_id=first['id'])
+        self.client.force_authenticate(self.readers[0])
+        self.client.post(f'/api/loans/{loan.id}/return_book/')
+        self.assertEqual(BookRequest.objects.get(pk=second['id']).status, 'accepted')
+        self.assertTrue(BookLoan.objects.filter(book_request_id=second['id'], returned=False).exists())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.availability, self.book.loan_count), ('borrowed', 2))
+        self.assertEqual(self.positions(), {'reader1': None, 'reader2': 1, 'reader3': 2})
+
+    def test_positions_close_gaps(self):
+        first, *waiting = (self.submit(reader) for reader in self.readers)
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{first["id"]}/accept_request/')
+        self.assertEqual(self.positions(), {'reader1': 1, 'reader2': 2, 'reader3': 3})
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{waiting[1]["id"]}/decline_request/')
+        self.assertEqual(self.positions(), {'reader1': 1, 'reader2': None, 'reader3': 2})
+        BookRequest.objects.get(pk=waiting[0]['id']).delete()
+        self.assertEqual(self.positions(), {'reader1': None, 'reader2': None, 'reader3': 1})
+
+    def test_last_return_frees_book(self):
+        first, second = (self.submit(reader) for reader in self.readers[:2])
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{first["id"]}/accept_request/')
+        self.client.post(f'/api/requests/{second["id"]}/decline_request/')
+        loan = BookLoan.objects.get(book_request_id=first['id'])
+        self.client.post(f'/api/loans/{loan.id}/return_book/')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.availability, 'available')
+        self.assertEqual(BookLoan.objects.count(), 1)
+
+    def test_edit_keeps_tickets(self):
+        first = self.submit(self.readers[0])
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{first["id"]}/accept_request/')
+        stale = Book.objects.get(pk=self.book.pk)
+        one = transitions.submit_request(self.book.id, self.readers[1])
+        stale.description = 'Desert planet'
+        stale.save()
+        self.client.put(f'/api/books/{self.book.id}/', {'title': 'Dune', 'author': 'Frank Herbert', 'genre': 'Fiction'})
+        two = transitions.submit_request(self.book.id, self.readers[2])
+        self.assertEqual((one.queue_ticket, two.queue_ticket), (1, 2))
+        self.assertNotIn('queue_tail', self.client.get(f'/api/books/{self.book.id}/').json())
+
+    def test_owner_manages_queue(self):
+        first, second, third = (self.submit(reader) for reader in self.readers[:3])
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/requests/{first["id"]}/accept_request/')
+        incoming = self.client.get('/api/requests/incoming_requests/').json()
+        self.assertEqual(
+            [(row['id'], row['status'], row['queue_position']) for row in incoming],
+            [(second['id'], 'waitlisted', 1), (third['id'], 'waitlisted', 2)],
+        )
+        response = self.client.post('/api/requests/bulk/', {'actions': [
+            {'id': second['id'], 'action': 'accept'}, {'id': second['id'], 'action': 'decline'},
+        ]}, format='json')
+        self.assertEqual([result['outcome'] for result in response.json()['results']], ['not_pending', 'declined'])
+        self.assertEqual([row['id'] for row in self.client.get('/api/requests/incoming_requests/').json()], [third['id']])
+
+
+class StatsTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.readers = [make_user(f'reader{n}') for n in range(3)]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def assertAccurate(self):
+        self.assertEqual(self.client.get('/api/statistics/').json(), true_counts())
+
+    def test_tracks_writes(self):
+        dune, emma, persuasion = (make_book(self.owner, title) for title in ('Dune', 'Emma', 'Persuasion'))
+        requests = [
+            BookRequest.objects.create(book=book, requester=reader, request_type='borrow')
+            for book in (dune, emma) for reader in self.readers
+        ]
+        self.assertAccurate()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(self.owner)
+            self.client.post(f'/api/requests/{requests[0].id}/accept_request/')
+            self.client.post(f'/api/requests/{requests[1].id}/decline_request/')
+            self.client.post('/api/requests/bulk/', {'actions': [
+                {'id': requests[3].id, 'action': 'accept'}, {'id': requests[4].id, 'action': 'decline'},
+            ]}, format='json')
+            self.client.post(f'/api/books/{persuasion.id}/toggle_availability/')
+        self.assertAccurate()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # Both books go on to their waitlisted readers, then come back
+            for _ in range(2):
+                for loan in BookLoan.objects.filter(returned=False):
+                    self.client.post(f'/api/loans/{loan.id}/return_book/')
+            self.client.delete(f'/api/books/{emma.id}/')
+            make_user('late')
+        self.assertAccurate()
+        self.assertEqual(reconcile_stats(), [])
+
+    def test_cached_and_reconciled(self):
+        make_book(self.owner)
+        self.client.get('/api/statistics/')
+        with CaptureQueriesContext(connection) as captured:
+            cached = self.client.get('/api/statistics/').json()
+        self.assertEqual(len(captured), 0)
+        # Another worker's adjust clears only its own cache
+        StatCounter.objects.filter(name='total_books').update(value=5)
+        self.assertEqual(self.client.get('/api/statistics/').json(), cached)
+        with mock.patch('time.time', return_value=time.time() + STATS_TIMEOUT + 1):
+            self.assertEqual(self.client.get('/api/statistics/').json()['total_books'], 5)
+
+        Book.objects.update(availability='unavailable')
+        StatCounter.objects.filter(name='total_users').delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconcile_stats(), ['total_books', 'total_users', 'available_books'])
+        self.assertAccurate()
+
+
+class FeaturedTests(LendingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def book(self, title, age_days, requests=0, ratings=(), **fields):
+        book = make_book(self.owner, title, **fields)
+        Book.objects.filter(pk=book.pk).update(
+            created_at=self.now - timedelta(days=age_days), request_count=requests,
+            rating_sum=sum(ratings), rating_count=len(ratings),
+        )
+        return book
+
+    def titles(self, url):
+        return [book['title'] for book in self.client.get(url).json()]
+
+    def test_ranking(self):
+        self.book('Old and ignored', 400)
+        self.book('Popular', 200, requests=20)
+        self.book('Loved', 200, requests=3, ratings=[5] * 6)
+        self.book('One good review', 200, requests=3, ratings=[5])
+        self.book('New', 0)
+        self.book('Lent out', 0, requests=50, availability='borrowed')
+        self.assertEqual(rank_featured_books(now=self.now), 5)
+        expected = ['Popular', 'Loved', 'One good review', 'New', 'Old and ignored']
+        self.assertEqual(list(FeaturedBook.objects.values_list('book__title', flat=True)), expected)
+        self.assertEqual(self.titles('/api/books/featured/'), expected)
+        self.assertEqual(self.titles('/api/featured-books/'), expected)
+
+    def test_reads_ranking(self):
+        first, second = self.book('First', 0, requests=2), self.book('Second', 0, requests=1)
+        rank_featured_books(now=self.now)
+        Book.objects.filter(pk=second.pk).update(request_count=9)
+        # Served as ranked until the next run, minus books that left the shelf
+        self.assertEqual(self.titles('/api/featured-books/'), ['First', 'Second'])
+        Book.objects.filter(pk=first.pk).update(availability='borrowed')
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.titles('/api/books/featured/'), ['Second'])
+        self.assertFalse([query for query in captured if 'COUNT(' in query['sql'] or 'SUM(' in query['sql']])
+
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            rank_featured_books(now=self.now)
+        self.assertNotEqual(catalog_version(), version)
+        self.assertEqual(self.titles('/api/featured-books/'), ['Second'])
+
+
+class OverdueSweepTests(LendingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = make_user('reader')
+
+    def loan(self, days_late, returned=False):
+        book_request = BookRequest.objects.create(book=make_book(self.owner), requester=self.reader, request_type='borrow')
+        return BookLoan.objects.create(
+            book_request=book_request, returned=returned,
+            due_date=timezone.localdate() - timedelta(days=days_late),
+        )
+
+    def test_sweep(self):
+        late = [self.loan(3), self.loan(1)]
+        self.loan(0)
+        self.loan(-5)
+        self.loan(10, returned=True)
+        self.assertEqual(sweep_overdue(batch_size=1), 2)
+        self.assertEqual(set(BookLoan.objects.filter(overdue=True).values_list('id', flat=True)), {l.id for l in late})
+        self.assertEqual(
+            set(LoanReminder.objects.values_list('loan_id', 'recipient_id', 'kind')),
+            {(l.id, self.reader.id, 'overdue') for l in late},
+        )
+        # Nothing new the second time round
+        self.assertEqual(sweep_overdue(), 0)
+        self.assertEqual(LoanReminder.objects.count(), 2)
+
+    def test_overlapping_sweeps_log_once(self):
+        late = [self.loan(3), self.loan(1)]
+        # Both sweeps read the same candidates; the other one flags first
+        rows = [(loan.id, self.reader.id, self.owner.id) for loan in late]
+        self.assertEqual(overdue._flag(rows[:1]), 1)
+        count = ChangeLogEntry.objects.filter(kind='loan').count()
+        self.assertEqual(overdue._flag(rows), 1)
+        logged = list(ChangeLogEntry.objects.filter(kind='loan').order_by('id')[count:])
+        # One entry each for the borrower and the lender, for the new loan only
+        self.assertEqual([(entry.object_id, entry.data['overdue']) for entry in logged], [(late[1].id, True)] * 2)
 
-# Create your tests here.
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+    def test_sweep_uses_index(self):
+        self.loan(3)
+        with CaptureQueriesContext(connection) as captured:
+            sweep_overdue()
+        for query in captured:
+            if query['sql'].startswith('SELECT'):
+                self.assertEqual(full_scans(query['sql']), [], query['sql'])
@@ -0,0 +1,342 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.utils import timezone
+
+from . import stats
+from .cache import bump_catalog_version
+from .changelog import entries, record
+from .dashboard import touch_users
+from .matching import refresh_book_matches
+from .models import Book, BookLoan, BookRequest, WishlistMatch
+
+# Request and loan state changes as compare-and-set updates.
+#
+# Each step is an UPDATE whose WHERE clause repeats the state it expects
+# (request still pending, book still available, loan not yet returned), so
+# two concurrent callers cannot both pass a check that one of them is about
+# to invalidate: the loser's UPDATE matches no row. All steps of a
+# transition run in one transaction and any failed step rolls back the
+# others. Rows are always touched in the same order (request, then book) so
+# concurrent transitions cannot deadlock each other.
+#
+# These updates bypass Book.save(), so the catalog version is bumped on
+# commit and the wishlist matches of the book are refreshed in the same
+# transaction. The book's loan and rating counters (see books.counters)
+# ride along in the UPDATE that changes its availability, everyone whose
+# requests or loans changed has their cached dashboard invalidated, and each
+# change is appended to the change log (books.changelog). The site-wide
+# totals (books.stats) move by the same amounts.
+#
+# Requests for a borrowed book, and the pending requests left over when a
+# book is lent out, join the book's waitlist: each takes the next ticket
+# from Book.queue_tail (an UPDATE ... SET queue_tail = queue_tail + n, so
+# tickets are never handed out twice) and is served in ticket order. When
+# the loan is returned the lowest ticket is found with one seek on
+# (book, status, queue_ticket) and lent the book in the same transaction.
+
+LOAN_PERIOD = timedelta(days=14)
+# Requests the owner can still turn down
+DECLINABLE_STATUSES = ('pending', 'waitlisted')
+
+
+class TransitionError(Exception):
+    """The object was no longer in the state the transition starts from."""
+
+
+class ConcurrentChange(TransitionError):
+    """Rows changed between being read and being updated; nothing was applied."""
+
+
+def _book_changed(book_id, available):
+    if available:
+        refresh_book_matches(Book.objects.get(pk=book_id))
+    else:
+        WishlistMatch.objects.filter(book_id=book_id).delete()
+    transaction.on_commit(bump_catalog_version)
+
+
+def _request_entries(owner_id, rows, status):
+    # rows: (request id, requester id) pairs
+    return [
+        entry for request_id, requester_id in rows
+        for entry in entries('request', request_id, 'updated', (requester_id, owner_id), status=status)
+    ]
+
+
+def _enqueue(waiting, now):
+    """Put ``{book_id: [request ids in arrival order]}`` at the back of
+    their books' waitlists. Returns ``{request_id: ticket}``."""
+    waiting = {book_id: ids for book_id, ids in waiting.items() if ids}
+    if not waiting:
+        return {}
+    Book.objects.filter(pk__in=waiting).update(queue_tail=F('queue_tail') + Case(
+        *[When(pk=book_id, then=Value(len(ids))) for book_id, ids in waiting.items()],
+        output_field=IntegerField(),
+    ))
+    tails = dict(Book.objects.filter(pk__in=waiting).values_list('id', 'queue_tail'))
+    tickets = {}
+    for book_id, ids in waiting.items():
+        first = tails[book_id] - len(ids) + 1
+        tickets.update((request_id, first + offset) for offset, request_id in enumerate(ids))
+    BookRequest.objects.filter(pk__in=tickets).update(status='waitlisted', updated_at=now, queue_ticket=Case(
+        *[When(pk=request_id, then=Value(ticket)) for request_id, ticket in tickets.items()],
+        output_field=IntegerField(),
+    ))
+    return tickets
+
+
+def _expect(count, expected):
+    if count != expected:
+        raise ConcurrentChange('Some requests changed while being processed; nothing was applied')
+
+
+def queue_position():
+    """Annotation: a waitlisted request's place in its book's queue, 1 being
+    next; NULL for other requests.
+
+    Counts the waitlisted tickets up to its own with one range scan on
+    (book, status, queue_ticket), so it stays exact when someone ahead
+    leaves the queue early.
+    """
+    ahead = BookRequest.objects.filter(
+        book=OuterRef('book'), status='waitlisted', queue_ticket__lte=OuterRef('queue_ticket')
+    ).order_by().values('book').annotate(count=Count('id')).values('count')
+    return Case(When(status='waitlisted', then=Subquery(ahead)), output_field=IntegerField())
+
+
+def submit_request(book_id, requester, request_type='borrow', message=''):
+    """Create a request for ``book_id``: pending, or waitlisted with the
+    next ticket if the book is out on loan."""
+    with transaction.atomic():
+        if Book.objects.filter(pk=book_id, availability='borrowed').update(queue_tail=F('queue_tail') + 1):
+            ticket = Book.objects.filter(pk=book_id).values_list('queue_tail', flat=True).get()
+            return BookRequest.objects.create(
+                book_id=book_id, requester=requester, request_type=request_type, message=message,
+                status='waitlisted', queue_ticket=ticket,
+            )
+        return BookRequest.objects.create(
+            book_id=book_id, requester=requester, request_type=request_type, message=message
+        )
+
+
+def accept_request(book_request):
+    """pending -> accepted; the book is lent out, the other pending requests
+    for it join its waitlist and a loan is opened. Returns the loan."""
+    now = timezone.now()
+    with transaction.atomic():
+        if not BookRequest.objects.filter(pk=book_request.pk, status='pending').update(
+            status='accepted', updated_at=now
+        ):
+            raise TransitionError('Request is no longer pending')
+        if not Book.objects.filter(pk=book_request.book_id, availability='available').update(
+            availability='borrowed', loan_count=F('loan_count') + 1, updated_at=now
+        ):
+            raise TransitionError('Book is no longer available')
+        owner_id = book_request.book.owner_id
+        waiting = list(BookRequest.objects.filter(book_id=book_request.book_id, status='pending').order_by(
+            'created_at', 'id'
+        ).values_list('id', 'requester_id'))
+        _enqueue({book_request.book_id: [request_id for request_id, _ in waiting]}, now)
+        touch_users(book_request.requester_id, owner_id, *(requester_id for _, requester_id in waiting))
+        loan = BookLoan.objects.create(book_request_id=book_request.pk, due_date=now.date() + LOAN_PERIOD)
+        _book_changed(book_request.book_id, available=False)
+        stats.adjust(active_requests=-1, available_books=-1)
+        record(
+            _request_entries(owner_id, [(book_request.pk, book_request.requester_id)], 'accepted'),
+            _request_entries(owner_id, waiting, 'waitlisted'),
+            entries('book', book_request.book_id, 'updated', availability='borrowed'),
+        )
+    book_request.status = 'accepted'
+    return loan
+
+
+def decline_request(book_request):
+    """pending or waitlisted -> declined."""
+    with transaction.atomic():
+        if not BookRequest.objects.filter(pk=book_request.pk, status__in=DECLINABLE_STATUSES).update(
+            status='declined', updated_at=timezone.now()
+        ):
+            raise TransitionError('Request is no longer pending')
+        owner_id = book_request.book.owner_id
+        record(_request_entries(owner_id, [(book_request.pk, book_request.requester_id)], 'declined'))
+        stats.adjust(active_requests=-1)
+        touch_users(book_request.requester_id, owner_id)
+    book_request.status = 'declined'
+
+
+def return_loan(loan, rating=None, review=''):
+    """Close an open loan: the request completes and the book goes to the
+    head of its waitlist, or is available again if nobody is waiting.
+    Returns the promoted request's new loan, if any."""
+    now = timezone.now()
+    changes = {'returned': True, 'return_date': now.date()}
+    book_changes = {'availability': 'available', 'updated_at': now}
+    if rating:
+        changes.update(rating=rating, review=review)
+        book_changes.update(rating_sum=F('rating_sum') + rating, rating_count=F('rating_count') + 1)
+    with transaction.atomic():
+        if not BookLoan.objects.filter(pk=loan.pk, returned=False).update(**changes):
+            raise TransitionError('Cannot return this book')
+        BookRequest.objects.filter(pk=loan.book_request_id).update(status='completed', updated_at=now)
+        book_id = loan.book_request.book_id
+        audience = (loan.book_request.requester_id, loan.book_request.book.owner_id)
+        log = [
+            entries('loan', loan.pk, 'updated', audience, returned=True, overdue=loan.overdue),
+            _request_entries(audience[1], [(loan.book_request_id, audience[0])], 'completed'),
+        ]
+        head = BookRequest.objects.filter(book_id=book_id, status='waitlisted').order_by(
+            'queue_ticket'
+        ).values_list('id', 'requester_id').first()
+        promoted = None
+        if head:
+            _expect(BookRequest.objects.filter(pk=head[0], status='waitlisted').update(
+                status='accepted', updated_at=now
+            ), 1)
+            book_changes.update(availability='borrowed', loan_count=F('loan_count') + 1)
+            Book.objects.filter(pk=book_id).update(**book_changes)
+            promoted = BookLoan.objects.create(book_request_id=head[0], due_date=now.date() + LOAN_PERIOD)
+            transaction.on_commit(bump_catalog_version)
+            log.append(_request_entries(audience[1], [head], 'accepted'))
+            stats.adjust(active_requests=-1)
+            touch_users(head[1])
+        else:
+            Book.objects.filter(pk=book_id).update(**book_changes)
+            _book_changed(book_id, available=True)
+            stats.adjust(available_books=1)
+            log.append(entries('book', book_id, 'updated', availability='available'))
+        record(*log)
+        touch_users(*audience)
+    for name, value in changes.items():
+        setattr(loan, name, value)
+    return promoted
+
+
+# The owner's switch; borrowed books come back through return_loan
+TOGGLED_AVAILABILITY = {'available': 'unavailable', 'unavailable': 'available'}
+
+
+def toggle_availability(book):
+    """available <-> unavailable. Returns the new availability."""
+    with transaction.atomic():
+        if not Book.objects.filter(pk=book.pk, availability__in=TOGGLED_AVAILABILITY).update(
+            availability=Case(*[
+                When(availability=current, then=Value(toggled))
+                for current, toggled in TOGGLED_AVAILABILITY.items()
+            ]),
+            updated_at=timezone.now(),
+        ):
+            raise TransitionError('Book is out on loan')
+        availability = Book.objects.filter(pk=book.pk).values_list('availability', flat=True).get()
+        available = availability == 'available'
+        _book_changed(book.pk, available=available)
+        stats.adjust(available_books=1 if available else -1)
+        record(entries('book', book.pk, 'updated', availability=availability))
+        touch_users(book.owner_id)
+    book.availability = availability
+    return availability
+
+
+BULK_ACTIONS = ('accept', 'decline')
+
+
+def bulk_transition(owner, actions):
+    """Apply ``[(request_id, 'accept' | 'decline'), ...]`` for ``owner``'s
+    books in one transaction.
+
+    The requests and their books are locked and read once, every outcome is
+    decided in memory (in list order: the first accept for a book wins), and
+    the result is written with a handful of set-based conditional UPDATEs
+    plus one bulk insert of loans. If any UPDATE touches a different number
+    of rows than decided, the whole batch rolls back with ConcurrentChange.
+
+    Pending requests can be accepted or declined, waitlisted ones declined.
+    Returns one ``{'id', 'action', 'outcome'}`` dict per action; outcome is
+    accepted, declined, not_found, not_pending or book_unavailable.
+    """
+    now = timezone.now()
+    due_date = now.date() + LOAN_PERIOD
+    ids = {request_id for request_id, _ in actions}
+    with transaction.atomic():
+        rows = {
+            book_request.pk: book_request
+            for book_request in BookRequest.objects.select_for_update().select_related('book').filter(
+                pk__in=ids, book__owner=owner
+            ).order_by('pk')
+        }
+        results = []
+        decided = set()
+        accepted, declined, claimed = [], [], {}
+        for request_id, action in actions:
+            book_request = rows.get(request_id)
+            if book_request is None:
+                outcome = 'not_found'
+            elif book_request.status not in DECLINABLE_STATUSES or request_id in decided:
+                outcome = 'not_pending'
+            elif action == 'decline':
+                outcome = 'declined'
+                declined.append(request_id)
+            elif book_request.status != 'pending':
+                outcome = 'not_pending'
+            elif book_request.book.availability != 'available' or book_request.book_id in claimed:
+                outcome = 'book_unavailable'
+            else:
+                outcome = 'accepted'
+                accepted.append(request_id)
+                claimed[book_request.book_id] = request_id
+            if outcome in ('accepted', 'declined'):
+                decided.add(request_id)
+            result = {'id': request_id, 'action': action, 'outcome': outcome}
+            if outcome == 'accepted':
+                result['due_date'] = due_date
+            results.append(result)
+
+        pending = BookRequest.objects.filter(status='pending')
+
+        def parties(ids):
+            return [(request_id, rows[request_id].requester_id) for request_id in ids]
+
+        log = _request_entries(owner.pk, parties(declined), 'declined')
+        if declined:
+            _expect(
+                BookRequest.objects.filter(pk__in=declined, status__in=DECLINABLE_STATUSES).update(
+                    status='declined', updated_at=now
+                ),
+                len(declined),
+            )
+        if accepted:
+            _expect(pending.filter(pk__in=accepted).update(status='accepted', updated_at=now), len(accepted))
+            _expect(
+                Book.objects.filter(pk__in=claimed, availability='available').update(
+                    availability='borrowed', loan_count=F('loan_count') + 1, updated_at=now
+                ),
+                len(claimed),
+            )
+            # Whoever else was waiting for these books joins their waitlists
+            siblings = list(pending.filter(book_id__in=claimed).order_by('created_at', 'id').values_list(
+                'id', 'requester_id', 'book_id'
+            ))
+            waiting = {book_id: [] for book_id in claimed}
+            for request_id, _, book_id in siblings:
+                waiting[book_id].append(request_id)
+            _enqueue(waiting, now)
+            touch_users(*(requester_id for _, requester_id, _ in siblings))
+            loans = BookLoan.objects.bulk_create(
+                [BookLoan(book_request_id=request_id, due_date=due_date) for request_id in accepted]
+            )
+            WishlistMatch.objects.filter(book_id__in=claimed).delete()
+            transaction.on_commit(bump_catalog_version)
+            log += _request_entries(owner.pk, parties(accepted), 'accepted')
+            log += _request_entries(owner.pk, [row[:2] for row in siblings], 'waitlisted')
+            for loan in loans:
+                audience = (rows[loan.book_request_id].requester_id, owner.pk)
+                log += entries('loan', loan.pk, 'created', audience, returned=False, overdue=False)
+            for book_id in claimed:
+                log += entries('book', book_id, 'updated', availability='borrowed')
+        record(log)
+        stats.adjust(
+            active_requests=-len(decided), available_books=-len(claimed), total_loans=len(accepted)
+        )
+        touch_users(owner.pk, *(rows[request_id].requester_id for request_id in decided))
+    return results
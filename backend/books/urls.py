@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     BookViewSet, BookLoanViewSet, BookRequestViewSet, 
     UserProfileViewSet, WishlistViewSet, register, login, logout,
-    get_statistics, get_featured_books, create_book_simple, update_user, create_book_request, test_endpoint, add_to_wishlist, simple_add_book
+    changes, dashboard, get_statistics, get_featured_books, create_book_simple, update_user, create_book_request, test_endpoint, add_to_wishlist, simple_add_book
 )
 
 router = DefaultRouter()
@@ -21,6 +21,8 @@ urlpatterns = [
     path('api/auth/register/', register, name='register'),
     path('api/auth/login/', login, name='login'),
     path('api/auth/logout/', logout, name='logout'),
+    path('api/changes/', changes, name='changes'),
+    path('api/dashboard/', dashboard, name='dashboard'),
     path('api/statistics/', get_statistics, name='statistics'),
     path('api/featured-books/', get_featured_books, name='featured-books'),
     path('api/create-book-simple/', create_book_simple, name='create-book-simple'),
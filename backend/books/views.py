@@ -5,13 +5,33 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Q, Count
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.cache import cache
+from django.db.models import Q, Exists, F, IntegerField, OuterRef, Value, Window
+from django.db.models.functions import RowNumber
+import hashlib
+import heapq
+import math
 import requests
-from .models import Book, BookRequest, BookLoan, UserProfile, Wishlist
+from .models import (
+    ArchivedBookLoan, ArchivedBookRequest, Book, BookRequest, BookLoan, ChangeLogEntry, Genre, UserProfile, Wishlist,
+    WishlistMatch,
+)
+from .pagination import KeysetPagination, wants_cursor_pagination
+from .cache import catalog_version
+from .changelog import must_reset
+from .conditional import catalog_conditional
+from .dashboard import dashboard_summary
+from .featured import featured_books
+from .fuzzy import fuzzy_book_ids, fuzzy_filter
+from .geo import cell_ranges, distance_km, parse_coordinates
+from .isbn import to_isbn13, validate_isbn
+from .matching import top_matches
+from .search import full_text_search, search_facets
+from .stats import get_stats
+from . import transitions
 from .serializers import (
-    BookSerializer, BookCreateSerializer, BookRequestSerializer, BookLoanSerializer, 
+    BookSerializer, BookCreateSerializer, BookRequestSerializer, BookLoanSerializer, ArchivedBookLoanSerializer,
     UserProfileSerializer, WishlistSerializer, UserRegistrationSerializer, UserSerializer
 )
 
@@ -82,8 +102,23 @@ def logout(request):
     except:
         return Response({'error': 'Error logging out'}, status=status.HTTP_400_BAD_REQUEST)
 
+FACET_CACHE_TIMEOUT = 300
+NEAR_DEFAULT_RADIUS_KM = 25
+NEAR_MAX_RADIUS_KM = 500
+NEAR_DEFAULT_LIMIT = 50
+NEAR_MAX_LIMIT = 200
+
+def profile_origin(user):
+    # (lat, lon) of the user's profile, or None when it is not located
+    if not user.is_authenticated:
+        return None
+    origin = UserProfile.objects.filter(user=user).values_list('latitude', 'longitude').first()
+    if origin and None in origin:
+        return None
+    return origin
+
 class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+    queryset = Book.objects.select_related('owner')
     serializer_class = BookSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
@@ -99,6 +134,20 @@ class BookViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated()]
         return [permissions.IsAuthenticatedOrReadOnly()]
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            queryset = self.sparse(queryset)
+        return queryset
+    
+    @catalog_conditional
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    def sparse(self, queryset):
+        # ?fields= / ?omit= narrow the SELECT as well as the JSON
+        return BookSerializer.sparse_queryset(queryset, self.request)
+    
     def update(self, request, *args, **kwargs):
         book = self.get_object()
         if book.owner != request.user:
@@ -126,85 +175,180 @@ class BookViewSet(viewsets.ModelViewSet):
             raise
     
     @action(detail=False, methods=['get'])
+    @catalog_conditional
     def available(self, request):
-        available_books = Book.objects.filter(availability='available').exclude(
+        available_books = self.sparse(Book.objects.select_related('owner').filter(availability='available').exclude(
             owner=request.user if request.user.is_authenticated else None
-        )
+        ))
         serializer = self.get_serializer(available_books, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def genres(self, request):
-        genres = Book.objects.values_list('genre', flat=True).distinct().order_by('genre')
-        return Response(list(genres))
+        # Precomputed list; any book write moves the catalog version on
+        cache_key = f'books:genres:{catalog_version()}'
+        genres = cache.get(cache_key)
+        if genres is None:
+            genres = list(Genre.objects.filter(
+                Exists(Book.objects.filter(genre_ref=OuterRef('pk')))
+            ).values_list('name', flat=True))
+            cache.set(cache_key, genres, None)
+        return Response(genres)
     
     @action(detail=True, methods=['post'])
     def toggle_availability(self, request, pk=None):
         book = self.get_object()
         if book.owner != request.user:
             return Response({'error': 'You can only modify your own books'}, status=status.HTTP_403_FORBIDDEN)
-        
-        if book.availability == 'available':
-            book.availability = 'unavailable'
-        elif book.availability == 'unavailable':
-            book.availability = 'available'
-        book.save()
+        try:
+            transitions.toggle_availability(book)
+        except transitions.TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'status': f'Book marked as {book.availability}'})
     
     @action(detail=False, methods=['get'])
     def my_books(self, request):
         if request.user.is_authenticated:
-            my_books = Book.objects.filter(owner=request.user)
+            my_books = self.sparse(Book.objects.select_related('owner').filter(owner=request.user))
+            page = self.paginate_queryset(my_books)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
             serializer = self.get_serializer(my_books, many=True)
             return Response(serializer.data)
         return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    def get_paginated_response(self, data):
-        if self.action in ['my_books', 'list']:
-            return Response(data)
-        return super().get_paginated_response(data)
+    @property
+    def paginator(self):
+        # list and my_books stay unpaginated for existing callers unless
+        # cursor mode is requested with ?paginate=cursor.
+        if not hasattr(self, '_paginator'):
+            if self.action in ['my_books', 'list']:
+                self._paginator = KeysetPagination() if wants_cursor_pagination(self.request) else None
+            else:
+                self._paginator = self.pagination_class() if self.pagination_class else None
+        return self._paginator
     
-    def paginate_queryset(self, queryset):
-        if self.action in ['my_books', 'list']:
-            return None
-        return super().paginate_queryset(queryset)
+    SEARCH_PARAMS = ('q', 'genre', 'author', 'condition', 'lending_type')
     
-    @action(detail=False, methods=['get'])
-    def search(self, request):
+    def get_search_queryset(self, request, fuzzy=False, available=False):
         query = request.query_params.get('q', '')
         genre = request.query_params.get('genre', '')
         author = request.query_params.get('author', '')
         condition = request.query_params.get('condition', '')
         lending_type = request.query_params.get('lending_type', '')
         
-        books = Book.objects.filter(availability='available').exclude(owner=request.user if request.user.is_authenticated else None)
-        
-        if query:
-            books = books.filter(
-                Q(title__icontains=query) | 
-                Q(author__icontains=query) | 
-                Q(isbn__icontains=query) |
-                Q(description__icontains=query)
-            )
+        books = Book.objects.select_related('owner').exclude(
+            owner=request.user if request.user.is_authenticated else None
+        )
+        if available:
+            books = books.filter(availability='available')
+        
+        isbn13 = to_isbn13(query)
+        if isbn13:
+            # Any spelling of an ISBN is one indexed equality lookup
+            books = books.filter(isbn13=isbn13)
+        elif query and not fuzzy:
+            books = full_text_search(books, query)
         if genre:
-            books = books.filter(genre__icontains=genre)
+            books = books.filter(genre_ref__key=Genre.normalize_key(genre))
         if author:
             books = books.filter(author__icontains=author)
         if condition:
             books = books.filter(condition=condition)
         if lending_type:
             books = books.filter(lending_type__in=[lending_type, 'both'])
-            
+        if query and fuzzy and not isbn13:
+            # Last, so the closest matches are picked among books that pass
+            # every other filter
+            books = fuzzy_filter(books, query)
+        return books
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        if request.query_params.get('facets') in ('1', 'true'):
+            return Response(self.get_search_facets(request))
+        
+        if request.query_params.get('near'):
+            return self.near_search(request)
+        
+        fuzzy = request.query_params.get('fuzzy') in ('1', 'true')
+        books = self.sparse(self.get_search_queryset(request, fuzzy=fuzzy, available=True))
         serializer = self.get_serializer(books, many=True)
+        query = request.query_params.get('q')
+        if not serializer.data and not fuzzy and query and not to_isbn13(query):
+            # Nothing matched word for word; retry tolerating typos.
+            books = self.sparse(self.get_search_queryset(request, fuzzy=True, available=True))
+            serializer = self.get_serializer(books, many=True)
         return Response(serializer.data)
     
+    def near_search(self, request):
+        # Available books within radius_km of ?near=lat,lon (or ?near=me for
+        # the user's profile location), nearest first. Ranges of grid cells
+        # narrow the candidates through an index at any allowed radius; exact
+        # distances are computed only for books in those cells.
+        near = request.query_params['near']
+        if near == 'me':
+            origin = profile_origin(request.user)
+        else:
+            origin = parse_coordinates(near)
+        if origin is None:
+            return Response({'error': 'near must be "lat,lon" or "me" with a located profile'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            radius = float(request.query_params.get('radius_km', NEAR_DEFAULT_RADIUS_KM))
+            limit = int(request.query_params.get('limit', NEAR_DEFAULT_LIMIT))
+        except ValueError:
+            return Response({'error': 'radius_km and limit must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not math.isfinite(radius):
+            return Response({'error': 'radius_km must be a finite number'}, status=status.HTTP_400_BAD_REQUEST)
+        radius = min(max(radius, 0), NEAR_MAX_RADIUS_KM)
+        limit = min(max(limit, 1), NEAR_MAX_LIMIT)
+        
+        candidates = self.get_search_queryset(request).filter(
+            availability='available', owner__userprofile__geo_cell__isnull=False
+        )
+        cells = Q()
+        for first, last in cell_ranges(origin[0], origin[1], radius):
+            cells |= Q(owner__userprofile__geo_cell__range=(first, last))
+        candidates = candidates.filter(cells)
+        rows = candidates.order_by().values_list(
+            'id', 'owner__userprofile__latitude', 'owner__userprofile__longitude'
+        )
+        nearest = heapq.nsmallest(limit, (
+            (distance, book_id)
+            for book_id, lat, lon in rows
+            for distance in [distance_km(origin[0], origin[1], lat, lon)]
+            if distance <= radius
+        ))
+        
+        books = self.sparse(Book.objects.select_related('owner')).in_bulk([book_id for _, book_id in nearest])
+        data = self.get_serializer([books[book_id] for _, book_id in nearest], many=True).data
+        for item, (distance, _) in zip(data, nearest):
+            item['distance_km'] = round(distance, 2)
+        return Response(data)
+    
+    def get_search_facets(self, request):
+        # Facets depend on the query, the filters and (because own books are
+        # excluded) the user; the catalog version retires them on any write.
+        params = '&'.join(f'{name}={request.query_params.get(name, "")}' for name in self.SEARCH_PARAMS)
+        cache_key = 'books:facets:%s:%s:%s' % (
+            catalog_version(),
+            request.user.pk if request.user.is_authenticated else 0,
+            hashlib.md5(params.encode()).hexdigest(),
+        )
+        facets = cache.get(cache_key)
+        if facets is None:
+            facets = search_facets(self.get_search_queryset(request))
+            cache.set(cache_key, facets, FACET_CACHE_TIMEOUT)
+        return facets
+    
     @action(detail=True, methods=['get'])
     def book_info_api(self, request, pk=None):
         book = self.get_object()
-        if book.isbn:
+        if book.isbn13:
             try:
                 # Google Books API integration
-                api_url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{book.isbn}"
+                api_url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{book.isbn13}"
                 response = requests.get(api_url)
                 if response.status_code == 200:
                     data = response.json()
@@ -224,54 +368,83 @@ class BookViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def featured(self, request):
-        # Get featured books (most requested or highest rated)
-        featured = Book.objects.filter(availability='available').annotate(
-            request_count=Count('bookrequest')
-        ).order_by('-request_count', '-created_at')[:6]
+        # Precomputed by rank_featured_books (books.featured)
+        featured = featured_books(self.sparse(Book.objects.select_related('owner')))
         serializer = self.get_serializer(featured, many=True)
         return Response(serializer.data)
 
+BULK_MAX_ACTIONS = 200
+
+def include_history(request):
+    return request.query_params.get('include_history') in ('1', 'true')
+
+def submitted(book_request):
+    # A request for a borrowed book is waitlisted: say where in the queue it landed
+    response = {'success': True, 'id': book_request.id, 'status': book_request.status}
+    if book_request.status == 'waitlisted':
+        response['queue_position'] = BookRequest.objects.filter(pk=book_request.pk).values_list(
+            transitions.queue_position(), flat=True
+        ).get()
+    return response
+
 class BookRequestViewSet(viewsets.ModelViewSet):
     queryset = BookRequest.objects.all()
     serializer_class = BookRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def create(self, request):
-        BookRequest.objects.create(
-            book_id=request.data['book'],
-            requester=request.user,
-            request_type=request.data.get('request_type', 'borrow'),
-            message=request.data.get('message', '')
+        book_request = transitions.submit_request(
+            request.data['book'],
+            request.user,
+            request.data.get('request_type', 'borrow'),
+            request.data.get('message', '')
         )
-        return Response({'success': True}, status=201)
+        return Response(submitted(book_request), status=201)
     
 
     
     @action(detail=False, methods=['get'])
     def my_requests(self, request):
-        my_requests = BookRequest.objects.filter(requester=request.user)
-        print(f"Found {my_requests.count()} requests for user {request.user}")
-        
-        # Simple response without serializer
-        requests_data = []
-        for req in my_requests:
-            requests_data.append({
-                'id': req.id,
-                'book_title': req.book.title,
-                'book_author': req.book.author,
-                'request_type': req.request_type,
-                'status': req.status,
-                'message': req.message,
-                'created_at': req.created_at.isoformat()
-            })
-        
-        return Response(requests_data)
+        # Newest first in keyset pages over request_requester_created_idx;
+        # one query joined to the book, whatever the history length.
+        # ?include_history=true merges in the archived requests as well.
+        filters = {'requester': request.user}
+        for name, choices in (('status', BookRequest.STATUS_CHOICES), ('request_type', BookRequest.REQUEST_TYPE_CHOICES)):
+            value = request.query_params.get(name)
+            if not value:
+                continue
+            if value not in dict(choices):
+                return Response({'error': f'Unknown {name}: {value}'}, status=status.HTTP_400_BAD_REQUEST)
+            filters[name] = value
+        sources = [BookRequest]
+        if include_history(request):
+            sources.append(ArchivedBookRequest)
+        paginator = KeysetPagination()
+        page = paginator.paginate_querysets([
+            model.objects.filter(**filters).values(
+                'id', 'book', 'request_type', 'status', 'message', 'created_at',
+                book_title=F('book__title'), book_author=F('book__author'),
+                owner_name=F('book__owner__username'), archived=Value(model is ArchivedBookRequest),
+                queue_position=(
+                    Value(None, output_field=IntegerField()) if model is ArchivedBookRequest
+                    else transitions.queue_position()
+                ),
+            )
+            for model in sources
+        ], request, view=self)
+        return paginator.get_paginated_response(page)
     
     @action(detail=False, methods=['get'])
     def incoming_requests(self, request):
-        incoming = BookRequest.objects.filter(book__owner=request.user, status='pending')
-        serializer = self.get_serializer(incoming, many=True)
-        return Response(serializer.data)
+        # Pending requests, then each book's waitlist in queue order
+        incoming = BookRequest.objects.filter(
+            book__owner=request.user, status__in=transitions.DECLINABLE_STATUSES
+        ).order_by('book_id', F('queue_ticket').asc(nulls_first=True), 'created_at').values(
+            'id', 'book', 'request_type', 'status', 'message', 'created_at',
+            book_title=F('book__title'), book_author=F('book__author'),
+            requester_name=F('requester__username'), queue_position=transitions.queue_position(),
+        )
+        return Response(list(incoming))
     
     @action(detail=True, methods=['post'])
     def accept_request(self, request, pk=None):
@@ -280,32 +453,12 @@ class BookRequestViewSet(viewsets.ModelViewSet):
         if book_request.book.owner != request.user:
             return Response({'error': 'Only the book owner can accept requests'}, status=status.HTTP_403_FORBIDDEN)
         
-        if book_request.status != 'pending':
-            return Response({'error': 'Request is no longer pending'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        # Check if book is still available
-        if book_request.book.availability != 'available':
-            return Response({'error': 'Book is no longer available'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        book_request.status = 'accepted'
-        book_request.book.availability = 'borrowed'
-        book_request.book.save()
-        book_request.save()
-        
-        # Decline all other pending requests for this book
-        BookRequest.objects.filter(
-            book=book_request.book, 
-            status='pending'
-        ).exclude(id=book_request.id).update(status='declined')
-        
-        # Create loan record
-        due_date = timezone.now().date() + timedelta(days=14)  # 2 weeks default
-        BookLoan.objects.create(
-            book_request=book_request,
-            due_date=due_date
-        )
+        try:
+            loan = transitions.accept_request(book_request)
+        except transitions.TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response({'status': 'request accepted', 'due_date': due_date})
+        return Response({'status': 'request accepted', 'due_date': loan.due_date})
     
     @action(detail=True, methods=['post'])
     def decline_request(self, request, pk=None):
@@ -314,52 +467,79 @@ class BookRequestViewSet(viewsets.ModelViewSet):
         if book_request.book.owner != request.user:
             return Response({'error': 'Only the book owner can decline requests'}, status=status.HTTP_403_FORBIDDEN)
             
-        if book_request.status != 'pending':
-            return Response({'error': 'Request is no longer pending'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        book_request.status = 'declined'
-        book_request.save()
+        try:
+            transitions.decline_request(book_request)
+        except transitions.TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'status': 'request declined'})
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # {"actions": [{"id": 1, "action": "accept"}, {"id": 2, "action": "decline"}]}
+        actions = request.data.get('actions')
+        if not isinstance(actions, list) or not 0 < len(actions) <= BULK_MAX_ACTIONS:
+            return Response(
+                {'error': f'actions must be a list of 1 to {BULK_MAX_ACTIONS} items'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            actions = [(int(item['id']), item['action']) for item in actions]
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'Each action needs an integer id and an action'}, status=status.HTTP_400_BAD_REQUEST)
+        if any(action not in transitions.BULK_ACTIONS for _, action in actions):
+            return Response({'error': 'action must be accept or decline'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            results = transitions.bulk_transition(request.user, actions)
+        except transitions.ConcurrentChange as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({'results': results})
+
 class BookLoanViewSet(viewsets.ModelViewSet):
-    queryset = BookLoan.objects.all()
+    queryset = BookLoan.objects.select_related(
+        'book_request__book__owner', 'book_request__requester'
+    )
     serializer_class = BookLoanSerializer
     permission_classes = [permissions.IsAuthenticated]
     
+    def with_history(self, request, **filters):
+        # Live loans, then archived ones when ?include_history=true
+        data = self.get_serializer(self.get_queryset().filter(**filters), many=True).data
+        if include_history(request):
+            archived = ArchivedBookLoan.objects.select_related(
+                'book_request__book__owner', 'book_request__requester'
+            ).filter(**filters).order_by('-created_at')
+            data += ArchivedBookLoanSerializer(archived, many=True, context=self.get_serializer_context()).data
+        return Response(data)
+    
     @action(detail=False, methods=['get'])
     def my_loans(self, request):
-        my_loans = BookLoan.objects.filter(book_request__requester=request.user)
-        serializer = self.get_serializer(my_loans, many=True)
-        return Response(serializer.data)
+        return self.with_history(request, book_request__requester=request.user)
     
     @action(detail=False, methods=['get'])
     def my_lent_books(self, request):
-        lent_books = BookLoan.objects.filter(book_request__book__owner=request.user)
-        serializer = self.get_serializer(lent_books, many=True)
-        return Response(serializer.data)
+        return self.with_history(request, book_request__book__owner=request.user)
     
     @action(detail=True, methods=['post'])
     def return_book(self, request, pk=None):
         loan = self.get_object()
-        if (loan.book_request.requester == request.user or 
-            loan.book_request.book.owner == request.user) and not loan.returned:
-            loan.returned = True
-            loan.return_date = timezone.now().date()
-            loan.book_request.book.availability = 'available'
-            loan.book_request.status = 'completed'
-            
-            # Add rating if provided
-            rating = request.data.get('rating')
-            review = request.data.get('review', '')
-            if rating:
-                loan.rating = rating
-                loan.review = review
-            
-            loan.book_request.book.save()
-            loan.book_request.save()
-            loan.save()
-            return Response({'status': 'book returned'})
-        return Response({'error': 'Cannot return this book'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.user not in (loan.book_request.requester, loan.book_request.book.owner):
+            return Response({'error': 'Cannot return this book'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Add rating if provided
+        rating = request.data.get('rating')
+        if rating:
+            try:
+                rating = int(rating)
+            except (TypeError, ValueError):
+                rating = 0
+            if not 1 <= rating <= 5:
+                return Response({'error': 'Rating must be between 1 and 5'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            transitions.return_loan(loan, rating, request.data.get('review', ''))
+        except transitions.TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'book returned'})
 
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
@@ -393,6 +573,10 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         
         return Response(profile_data)
 
+WISHLIST_MATCHES_SHOWN = 3
+FIND_MATCHES_PAGE_SIZE = 20
+FIND_MATCHES_MAX_PAGE_SIZE = 100
+
 class WishlistViewSet(viewsets.ModelViewSet):
     queryset = Wishlist.objects.all()
     serializer_class = WishlistSerializer
@@ -406,56 +590,133 @@ class WishlistViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def with_availability(self, request):
-        wishlist_items = self.get_queryset()
-        result = []
-        
-        for item in wishlist_items:
-            matching_books = Book.objects.filter(
-                Q(title__icontains=item.title) | Q(author__icontains=item.author),
-                availability='available'
-            ).exclude(owner=request.user)[:3]
-            
-            item_data = WishlistSerializer(item).data
-            item_data['available_books'] = BookSerializer(matching_books, many=True).data
-            item_data['has_available'] = matching_books.exists()
-            result.append(item_data)
+        wishlist_items = list(self.get_queryset())
+        
+        # Newest few stored matches per entry, ranked in the database on the
+        # narrow match table; only the books shown are loaded in full
+        ranked = WishlistMatch.objects.filter(wishlist__user=request.user).annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F('wishlist_id'),
+                order_by=[F('book__created_at').desc(), F('book_id').desc()],
+            )
+        ).filter(position__lte=WISHLIST_MATCHES_SHOWN).order_by('wishlist_id', 'position')
+        matches = {}
+        for wishlist_id, book_id in ranked.values_list('wishlist_id', 'book_id'):
+            matches.setdefault(wishlist_id, []).append(book_id)
+        shown = {book_id for ids in matches.values() for book_id in ids}
+        books = Book.objects.select_related('owner').in_bulk(shown) if shown else {}
+        
+        # Serialize each list in one pass; per-row serializers rebuild their
+        # fields every time
+        book_data = dict(zip(books, BookSerializer(list(books.values()), many=True).data))
+        
+        result = WishlistSerializer(wishlist_items, many=True).data
+        for item, item_data in zip(wishlist_items, result):
+            available = [book_data[book_id] for book_id in matches.get(item.pk, [])]
+            item_data['available_books'] = available
+            item_data['has_available'] = bool(available)
         
         return Response(result)
     
     @action(detail=True, methods=['post'])
     def find_matches(self, request, pk=None):
         wishlist_item = self.get_object()
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = int(request.query_params.get('page_size', FIND_MATCHES_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = min(max(page_size, 1), FIND_MATCHES_MAX_PAGE_SIZE)
+        
+        # Stored matches, plus trigram candidates for misspelt titles and authors
+        fuzzy_ids = fuzzy_book_ids(wishlist_item.title, fields=('title',))
+        if wishlist_item.author:
+            fuzzy_ids += fuzzy_book_ids(wishlist_item.author, fields=('author',))
+        
+        criteria = Q(id__in=wishlist_item.matches.values('book_id'))
+        if fuzzy_ids:
+            criteria |= Q(id__in=fuzzy_ids, availability='available')
+        candidates = Book.objects.filter(criteria).exclude(owner=request.user).values(
+            'id', 'title', 'author', 'isbn13', 'condition', 'created_at',
+            latitude=F('owner__userprofile__latitude'), longitude=F('owner__userprofile__longitude'),
+        )
         
-        matching_books = Book.objects.filter(
-            Q(title__icontains=wishlist_item.title) | 
-            Q(author__icontains=wishlist_item.author),
-            availability='available'
-        ).exclude(owner=request.user)
+        # Score every candidate in one pass over the narrow rows, keep the top
+        # of the ranking up to this page, and load only the page's books
+        count, ranked = top_matches(wishlist_item, candidates, page * page_size, profile_origin(request.user))
+        ranked = ranked[(page - 1) * page_size:]
+        books = Book.objects.select_related('owner').in_bulk([row['id'] for _, _, row in ranked])
+        ranked = [entry for entry in ranked if entry[2]['id'] in books]
+        matching_books = BookSerializer([books[row['id']] for _, _, row in ranked], many=True).data
+        for book_data, (match_type, distance, _) in zip(matching_books, ranked):
+            book_data['match_type'] = match_type
+            book_data['distance_km'] = round(distance, 2) if distance is not None else None
         
         return Response({
             'wishlist_item': WishlistSerializer(wishlist_item).data,
-            'matching_books': BookSerializer(matching_books, many=True).data,
-            'count': matching_books.count()
+            'matching_books': matching_books,
+            'count': count,
+            'page': page,
+            'page_size': page_size,
+            'has_next': page * page_size < count,
         })
 
+CHANGES_PAGE_SIZE = 100
+CHANGES_MAX_PAGE_SIZE = 500
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def changes(request):
+    # Log entries after ?since=<sequence>, oldest first: public catalog
+    # changes plus the caller's own requests, loans and wishlist
+    try:
+        since = int(request.query_params.get('since', 0))
+        limit = int(request.query_params.get('limit', CHANGES_PAGE_SIZE))
+    except ValueError:
+        return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, CHANGES_MAX_PAGE_SIZE))
+    if must_reset(since):
+        # What happened after `since` is gone: reload, then follow from here
+        head = ChangeLogEntry.objects.order_by('-id').values_list('id', flat=True).first()
+        return Response({'changes': [], 'next_since': head, 'has_more': False, 'reset': True})
+    readers = Q(user__isnull=True)
+    if request.user.is_authenticated:
+        readers |= Q(user=request.user)
+    rows = list(ChangeLogEntry.objects.filter(readers, id__gt=since).order_by('id').values(
+        'id', 'kind', 'object_id', 'action', 'data', 'created_at'
+    )[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return Response({
+        'changes': [
+            {'seq': row['id'], 'kind': row['kind'], 'id': row['object_id'], 'action': row['action'],
+             'data': row['data'], 'at': row['created_at']}
+            for row in rows
+        ],
+        'next_since': rows[-1]['id'] if rows else since,
+        'has_more': has_more,
+        'reset': False,
+    })
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def dashboard(request):
+    return Response(dashboard_summary(request.user))
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def get_statistics(request):
-    stats = {
-        'total_books': Book.objects.count(),
-        'total_users': User.objects.count(),
-        'total_loans': BookLoan.objects.count(),
-        'active_requests': BookRequest.objects.filter(status='pending').count(),
-        'available_books': Book.objects.filter(availability='available').count(),
-    }
-    return Response(stats)
+    # Maintained counters (books.stats), not counts over the catalog
+    return Response(get_stats())
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_conditional
 def get_featured_books(request):
     try:
-        featured = Book.objects.filter(availability='available').order_by('-created_at')[:6]
-        serializer = BookSerializer(featured, many=True)
+        featured = featured_books(BookSerializer.sparse_queryset(Book.objects.select_related('owner'), request))
+        serializer = BookSerializer(featured, many=True, context={'request': request})
         return Response(serializer.data)
     except Exception as e:
         return Response([], status=200)
@@ -474,12 +735,16 @@ def create_book_simple(request):
             return Response({'error': 'Author is required'}, status=400)
         if not request.data.get('genre'):
             return Response({'error': 'Genre is required'}, status=400)
+        try:
+            isbn = validate_isbn(request.data.get('isbn', ''))
+        except DjangoValidationError as e:
+            return Response({'error': e.messages[0]}, status=400)
             
         book = Book(
             owner=request.user,
             title=request.data.get('title'),
             author=request.data.get('author'),
-            isbn=request.data.get('isbn', ''),
+            isbn=isbn,
             genre=request.data.get('genre'),
             description=request.data.get('description', ''),
             condition=request.data.get('condition', 'good'),
@@ -508,21 +773,24 @@ def create_book_request(request):
     book_id = request.data.get('book')
     book = Book.objects.get(id=book_id)
     
-    book_request = BookRequest.objects.create(
-        book=book,
-        requester=request.user,
-        request_type=request.data.get('request_type', 'borrow'),
-        message=request.data.get('message', '')
+    book_request = transitions.submit_request(
+        book.id,
+        request.user,
+        request.data.get('request_type', 'borrow'),
+        request.data.get('message', '')
     )
     
-    return Response({'success': True, 'id': book_request.id}, status=201)
+    return Response(submitted(book_request), status=201)
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def add_to_wishlist(request):
     title = request.data.get('title')
     author = request.data.get('author')
-    isbn = request.data.get('isbn', '')
+    try:
+        isbn = validate_isbn(request.data.get('isbn', ''))
+    except DjangoValidationError as e:
+        return Response({'error': e.messages[0]}, status=400)
     
     wishlist_item, created = Wishlist.objects.get_or_create(
         user=request.user,
@@ -544,13 +812,17 @@ def simple_add_book(request):
     try:
         print(f"Request data: {request.data}")
         print(f"User: {request.user}")
+        try:
+            isbn = validate_isbn(request.data.get('isbn', ''))
+        except DjangoValidationError as e:
+            return Response({'error': e.messages[0]}, status=400)
         
         book = Book(
             owner=request.user,
             title=request.data.get('title', 'Test Title'),
             author=request.data.get('author', 'Test Author'),
             genre=request.data.get('genre', 'Fiction'),
-            isbn=request.data.get('isbn', ''),
+            isbn=isbn,
             description=request.data.get('description', ''),
             condition=request.data.get('condition', 'good'),
             lending_type=request.data.get('lending_type', 'lending'),
@@ -604,6 +876,11 @@ def update_user(request):
             'preferred_genres': request.data.get('preferred_genres', profile.preferred_genres)
         }
         
+        # Explicit coordinates win; UserProfile.save geocodes a changed location
+        if 'latitude' in request.data and 'longitude' in request.data:
+            profile_data['latitude'] = request.data.get('latitude') or None
+            profile_data['longitude'] = request.data.get('longitude') or None
+        
         if 'profile_picture' in request.FILES:
             profile_data['profile_picture'] = request.FILES['profile_picture']
         
@@ -619,6 +896,8 @@ def update_user(request):
                 'phone': profile.phone,
                 'website': profile.website,
                 'preferred_genres': profile.preferred_genres,
+                'latitude': profile.latitude,
+                'longitude': profile.longitude,
                 'profile_picture': profile.profile_picture.url if profile.profile_picture else None,
                 'user': {
                     'id': user.id,
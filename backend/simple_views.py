@@ -3,7 +3,8 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from books.models import Book, BookRequest
+from books import transitions
+from books.models import Book
 import json
 
 @csrf_exempt
@@ -38,14 +39,14 @@ def simple_request(request):
             book = Book.objects.get(id=data['book'])
             user = User.objects.get(id=data['user_id'])
             
-            book_request = BookRequest.objects.create(
-                book=book,
-                requester=user,
-                request_type=data.get('request_type', 'borrow'),
-                message=data.get('message', '')
+            book_request = transitions.submit_request(
+                book.id,
+                user,
+                data.get('request_type', 'borrow'),
+                data.get('message', '')
             )
             
-            return JsonResponse({'success': True, 'id': book_request.id})
+            return JsonResponse({'success': True, 'id': book_request.id, 'status': book_request.status})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
     
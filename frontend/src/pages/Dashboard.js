@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { Link } from 'react-router-dom'
 import { useAuth } from '../context/AuthContext'
-import { bookService, requestService, loanService } from '../services/api'
+import { bookService, requestService, dashboardService } from '../services/api'
 import { BookOpen, Plus, Clock, CheckCircle, AlertCircle, Users, User, MessageSquare, Trash2 } from 'lucide-react'
 
 const Dashboard = () => {
@@ -9,7 +9,7 @@ const Dashboard = () => {
   const [myBooks, setMyBooks] = useState([])
   const [myRequests, setMyRequests] = useState([])
   const [incomingRequests, setIncomingRequests] = useState([])
-  const [myLoans, setMyLoans] = useState([])
+  const [summary, setSummary] = useState({})
   const [loading, setLoading] = useState(true)
 
   const handleDeleteBook = async (bookId) => {
@@ -17,6 +17,8 @@ const Dashboard = () => {
       try {
         await bookService.deleteBook(bookId)
         setMyBooks(prev => prev.filter(book => book.id !== bookId))
+        const summaryRes = await dashboardService.getSummary()
+        setSummary(summaryRes.data)
       } catch (error) {
         console.error('Failed to delete book:', error)
       }
@@ -26,17 +28,17 @@ const Dashboard = () => {
   useEffect(() => {
     const fetchDashboardData = async () => {
       try {
-        const [booksRes, requestsRes, incomingRes, loansRes] = await Promise.all([
+        const [booksRes, requestsRes, incomingRes, summaryRes] = await Promise.all([
           bookService.getMyBooks(),
-          requestService.getMyRequests(),
+          requestService.getMyRequests({ page_size: 4 }),
           requestService.getIncomingRequests(),
-          loanService.getMyLoans()
+          dashboardService.getSummary()
         ])
         
         setMyBooks(booksRes.data)
-        setMyRequests(requestsRes.data)
+        setMyRequests(requestsRes.data.results)
         setIncomingRequests(incomingRes.data)
-        setMyLoans(loansRes.data)
+        setSummary(summaryRes.data)
       } catch (error) {
         console.error('Failed to fetch dashboard data:', error)
       } finally {
@@ -71,7 +73,7 @@ const Dashboard = () => {
               <BookOpen className="h-8 w-8 text-violet-600" />
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">My Books</p>
-                <p className="text-2xl font-bold text-gray-900">{myBooks.length}</p>
+                <p className="text-2xl font-bold text-gray-900">{summary.owned || 0}</p>
               </div>
             </div>
           </div>
@@ -81,7 +83,7 @@ const Dashboard = () => {
               <Clock className="h-8 w-8 text-blue-600" />
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Pending Requests</p>
-                <p className="text-2xl font-bold text-gray-900">{myRequests.filter(r => r.status === 'pending').length}</p>
+                <p className="text-2xl font-bold text-gray-900">{summary.pending_outgoing || 0}</p>
               </div>
             </div>
           </div>
@@ -91,7 +93,7 @@ const Dashboard = () => {
               <Users className="h-8 w-8 text-green-600" />
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Incoming Requests</p>
-                <p className="text-2xl font-bold text-gray-900">{incomingRequests.length}</p>
+                <p className="text-2xl font-bold text-gray-900">{summary.pending_incoming || 0}</p>
               </div>
             </div>
           </div>
@@ -101,7 +103,7 @@ const Dashboard = () => {
               <CheckCircle className="h-8 w-8 text-orange-600" />
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Active Loans</p>
-                <p className="text-2xl font-bold text-gray-900">{myLoans.filter(l => !l.returned).length}</p>
+                <p className="text-2xl font-bold text-gray-900">{summary.active_loans || 0}</p>
               </div>
             </div>
           </div>
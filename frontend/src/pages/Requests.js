@@ -5,6 +5,7 @@ import { MessageSquare, Check, X, Clock, User, RefreshCw } from 'lucide-react'
 const Requests = () => {
   const [incomingRequests, setIncomingRequests] = useState([])
   const [myRequests, setMyRequests] = useState([])
+  const [myRequestsCursor, setMyRequestsCursor] = useState(null)
   const [activeTab, setActiveTab] = useState('incoming')
   const [loading, setLoading] = useState(true)
   const [myBooks, setMyBooks] = useState([])
@@ -25,7 +26,8 @@ const Requests = () => {
         bookService.getMyBooks()
       ])
       setIncomingRequests(incomingRes.data)
-      setMyRequests(myRequestsRes.data)
+      setMyRequests(myRequestsRes.data.results)
+      setMyRequestsCursor(myRequestsRes.data.next_cursor)
       setMyBooks(booksRes.data)
     } catch (error) {
       console.error('Error fetching requests:', error)
@@ -34,6 +36,16 @@ const Requests = () => {
     }
   }
 
+  const loadMoreRequests = async () => {
+    try {
+      const response = await requestService.getMyRequests({ cursor: myRequestsCursor })
+      setMyRequests([...myRequests, ...response.data.results])
+      setMyRequestsCursor(response.data.next_cursor)
+    } catch (error) {
+      console.error('Error fetching requests:', error)
+    }
+  }
+
   const handleAcceptRequest = async (requestId) => {
     try {
       await requestService.acceptRequest(requestId)
@@ -181,11 +193,13 @@ const Requests = () => {
                         <div className="flex items-center gap-3 mb-4">
                           <span className={`inline-flex items-center gap-1 px-3 py-1 rounded-full text-sm font-semibold ${
                             request.status === 'pending' ? 'bg-yellow-100 text-yellow-800' :
+                            request.status === 'waitlisted' ? 'bg-blue-100 text-blue-800' :
                             request.status === 'accepted' ? 'bg-green-100 text-green-800' :
                             'bg-red-100 text-red-800'
                           }`}>
                             {getStatusIcon(request.status)}
                             {request.status.charAt(0).toUpperCase() + request.status.slice(1)}
+                            {request.queue_position && ` #${request.queue_position}`}
                           </span>
                           <span className="px-3 py-1 bg-violet-100 text-violet-800 rounded-full text-sm font-medium">
                             {request.request_type.charAt(0).toUpperCase() + request.request_type.slice(1)}
@@ -217,6 +231,16 @@ const Requests = () => {
                         </button>
                       </div>
                     )}
+                    {request.status === 'waitlisted' && (
+                      <div className="flex justify-end">
+                        <button
+                          onClick={() => handleDeclineRequest(request.id)}
+                          className="inline-flex items-center px-6 py-3 bg-white border border-red-200 text-red-600 font-semibold rounded-2xl hover:bg-red-50 transition-all duration-300"
+                        >
+                          <X className="w-4 h-4 mr-2" /> Remove from queue
+                        </button>
+                      </div>
+                    )}
                   </div>
                 ))}
               </div>
@@ -258,11 +282,13 @@ const Requests = () => {
                         <div className="flex items-center gap-3 mb-4">
                           <span className={`inline-flex items-center gap-1 px-3 py-1 rounded-full text-sm font-semibold ${
                             request.status === 'pending' ? 'bg-yellow-100 text-yellow-800' :
+                            request.status === 'waitlisted' ? 'bg-blue-100 text-blue-800' :
                             request.status === 'accepted' ? 'bg-green-100 text-green-800' :
                             'bg-red-100 text-red-800'
                           }`}>
                             {getStatusIcon(request.status)}
                             {request.status.charAt(0).toUpperCase() + request.status.slice(1)}
+                            {request.queue_position && ` #${request.queue_position}`}
                           </span>
                           <span className="px-3 py-1 bg-violet-100 text-violet-800 rounded-full text-sm font-medium">
                             {request.request_type.charAt(0).toUpperCase() + request.request_type.slice(1)}
@@ -282,6 +308,16 @@ const Requests = () => {
                     </div>
                   </div>
                 ))}
+                {myRequestsCursor && (
+                  <div className="text-center">
+                    <button
+                      onClick={loadMoreRequests}
+                      className="px-6 py-3 bg-violet-100 text-violet-700 font-semibold rounded-2xl hover:bg-violet-200 transition-all"
+                    >
+                      Load more
+                    </button>
+                  </div>
+                )}
               </div>
             )}
           </div>
@@ -61,14 +61,20 @@ export const bookService = {
 
 export const requestService = {
   getRequests: () => api.get('/api/requests/'),
+  // { success, id, status, queue_position }: requests for a borrowed book
+  // are waitlisted and served in order when it comes back
   createRequest: (data) => {
     console.log('Creating request with data:', data)
     return api.post('/api/requests/', data)
   },
-  getMyRequests: () => api.get('/api/requests/my_requests/'),
+  // Keyset pages: { results, next_cursor }; params: status, request_type, cursor
+  getMyRequests: (params = {}) => api.get('/api/requests/my_requests/', { params }),
+  // Pending requests for the user's books, then their waitlists in queue order
   getIncomingRequests: () => api.get('/api/requests/incoming_requests/'),
   acceptRequest: (id) => api.post(`/api/requests/${id}/accept_request/`),
   declineRequest: (id) => api.post(`/api/requests/${id}/decline_request/`),
+  // actions: [{ id, action: 'accept' | 'decline' }]
+  bulkRespond: (actions) => api.post('/api/requests/bulk/', { actions }),
 }
 
 export const loanService = {
@@ -109,6 +115,18 @@ export const wishlistService = {
   findMatches: (id) => api.post(`/api/wishlist/${id}/find_matches/`),
 }
 
+// Per-user counters: owned, available, borrowed, pending_incoming,
+// pending_outgoing, waitlisted, active_loans, overdue, lent_out
+export const dashboardService = {
+  getSummary: () => api.get('/api/dashboard/'),
+}
+
+// Incremental sync: pass the last next_since; on reset, reload lists and
+// continue from the returned next_since
+export const changeService = {
+  getChanges: (since = 0, limit = 100) => api.get('/api/changes/', { params: { since, limit } }),
+}
+
 // Statistics and featured content
 export const homeService = {
   getStatistics: () => {